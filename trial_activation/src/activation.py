@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from trial_activation.src.encoding import epoch_ms_to_text, is_compact, staging_table
+from trial_activation.src.goals import GOALS
+from trial_activation.src.stages import SCOPE_TABLE
+
+MOMENT_COLUMNS = ['organization_id', 'event_id', 'activated_at']
+
+
+def find_activation_moments(events):
+    """
+    Return the event that completes activation for every activated organization.
+
+    `events` needs the staging columns id, organization_id, activity_name,
+    activity_detail and timestamp. Events are sorted once by organization,
+    timestamp and id; per-goal running counts are then plain cumulative sums
+    rebased at each organization boundary, so the whole search is O(n log n).
+    """
+    ordered = events.sort_values(['organization_id', 'timestamp', 'id'], kind='stable')
+    organizations = ordered['organization_id'].to_numpy()
+    n = len(ordered)
+    if n == 0:
+        return pd.DataFrame(columns=MOMENT_COLUMNS)
+
+    starts = np.flatnonzero(np.r_[True, organizations[1:] != organizations[:-1]])
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+
+    names = ordered['activity_name'].to_numpy()
+    details = ordered['activity_detail']
+    completed = np.ones(n, dtype=bool)
+    for goal in GOALS:
+        hits = names == goal.activity_name
+        if goal.details is not None:
+            hits &= details.isin(goal.details).to_numpy()
+        running = np.cumsum(hits, dtype=np.int64)
+        offset = running[starts] - hits[starts]
+        completed &= running - offset[group] >= goal.min_count
+
+    rows = np.flatnonzero(completed)
+    _, first = np.unique(group[rows], return_index=True)
+    moments = ordered.iloc[rows[first]]
+    return pd.DataFrame({
+        'organization_id': moments['organization_id'].to_numpy(),
+        'event_id': moments['id'].to_numpy(),
+        'activated_at': moments['timestamp'].to_numpy(),
+    })
+
+
+def activation_moments_query(scoped=False, compact=False):
+    # Compact staging orders by integer timestamps; only the winning event is formatted
+    counts = ',\n                '.join(
+        f'SUM(CASE WHEN {goal.condition(compact=compact)} THEN 1 ELSE 0 END) OVER running AS {goal.key}_count' for goal in GOALS
+    )
+    completed = ' AND '.join(f'{goal.key}_count >= {goal.min_count}' for goal in GOALS)
+    scope = f'WHERE organization_id IN (SELECT organization_id FROM {SCOPE_TABLE})' if scoped else ''
+    return f'''
+        WITH running_counts AS (
+            SELECT
+                id,
+                organization_id,
+                timestamp,
+                {counts}
+            FROM {staging_table(compact)}
+            {scope}
+            WINDOW running AS (PARTITION BY organization_id ORDER BY timestamp, id ROWS UNBOUNDED PRECEDING)
+        ),
+        completions AS (
+            SELECT
+                organization_id,
+                id,
+                timestamp,
+                ROW_NUMBER() OVER (PARTITION BY organization_id ORDER BY timestamp, id) AS completion_rank
+            FROM running_counts
+            WHERE {completed}
+        )
+        SELECT organization_id, id AS event_id, {epoch_ms_to_text('timestamp') if compact else 'timestamp'} AS activated_at
+        FROM completions
+        WHERE completion_rank = 1
+    '''
+
+
+def query_activation_moments(conn, scoped=False):
+    """SQL window-function equivalent of find_activation_moments, run against staging."""
+    return pd.read_sql(text(activation_moments_query(scoped, is_compact(conn))), conn)
+
+
+def add_activated_at_column(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('trial_activation')}
+    if 'activated_at' not in columns:
+        conn.execute(text('ALTER TABLE trial_activation ADD COLUMN activated_at DATETIME'))
+
+
+def persist_activated_at(conn, scoped=False):
+    """Store each organization's activation timestamp in trial_activation.activated_at."""
+    add_activated_at_column(conn)
+
+    conn.execute(text('DROP TABLE IF EXISTS temp.activation_moments'))
+    conn.execute(text('''
+        CREATE TEMP TABLE activation_moments (
+            organization_id TEXT PRIMARY KEY,
+            event_id INTEGER,
+            activated_at DATETIME
+        )
+    '''))
+    conn.execute(text(f'INSERT INTO activation_moments {activation_moments_query(scoped, is_compact(conn))}'))
+    scope = f'WHERE organization_id IN (SELECT organization_id FROM {SCOPE_TABLE})' if scoped else ''
+    conn.execute(text(f'''
+        UPDATE trial_activation
+        SET activated_at = (
+            SELECT am.activated_at
+            FROM activation_moments am
+            WHERE am.organization_id = trial_activation.organization_id
+        )
+        {scope}
+    '''))
+    conn.execute(text('DROP TABLE temp.activation_moments'))
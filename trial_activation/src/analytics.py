@@ -1,181 +1,345 @@
+import numpy as np
 import pandas as pd
 import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
 from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from trial_activation.src.cache import cached
+from trial_activation.src.cohorts import COHORT_SETTLE_DAYS, get_cohort
+from trial_activation.src.goals import GOALS, GOALS_BY_KEY, detail_flag_column
+from trial_activation.src.incremental import BUILD_KEY, LINEAGE_KEY, WATERMARK_KEY, cohort_change_before, read_state
+from trial_activation.src.instrumentation import NULL_TRACER
+
+ADVANCED_PAGES = GOALS_BY_KEY['advanced_features'].details
+ACTIVATION_LABEL = 'Activation'
+
+
+@dataclass(frozen=True)
+class SummaryMetric:
+    # Aggregate expressions over org_summary ("<expression> AS <alias>") and a
+    # function turning the result row into the metric value. Metrics are fused
+    # into one SELECT by concatenating their columns.
+    columns: tuple
+    parse: Callable
+
+
+def _activation_rate(row):
+    return row.activated_orgs / row.total_orgs if row.total_orgs > 0 else 0
+
+
+def _time_to_activation(row):
+    return row.avg_activation_days if row.avg_activation_days is not None else 0
+
+
+def _goal_completion_rates(row):
+    return {goal.label: getattr(row, f'{goal.key}_completed') / row.total_orgs for goal in GOALS}
+
+
+def _advanced_features_rate(row):
+    # Only pages some organization actually viewed, as with a GROUP BY over the events
+    return {
+        page: getattr(row, detail_flag_column(page)) / row.total_orgs
+        for page in ADVANCED_PAGES
+        if getattr(row, detail_flag_column(page))
+    }
+
+
+def _goal_achievement_times(row):
+    return {goal.label: getattr(row, f'{goal.key}_days') for goal in GOALS}
+
+
+# Every metric reads the org_summary mart built by db.py: one row per organization,
+# so cost scales with the number of organizations rather than events
+SUMMARY_METRICS = {
+    'trial_activation_rate': SummaryMetric(
+        ('SUM(activated) AS activated_orgs', 'COUNT(*) AS total_orgs'),
+        _activation_rate,
+    ),
+    'time_to_activation': SummaryMetric(
+        ('AVG(CASE WHEN activated = 1 THEN JULIANDAY(last_event) - JULIANDAY(first_event) END) AS avg_activation_days',),
+        _time_to_activation,
+    ),
+    'goal_completion_rates': SummaryMetric(
+        tuple(f'SUM({goal.column}) AS {goal.key}_completed' for goal in GOALS) + ('COUNT(*) AS total_orgs',),
+        _goal_completion_rates,
+    ),
+    'advanced_features_rate': SummaryMetric(
+        tuple(f'SUM({detail_flag_column(page)}) AS {detail_flag_column(page)}' for page in ADVANCED_PAGES)
+        + ('COUNT(*) AS total_orgs',),
+        _advanced_features_rate,
+    ),
+    'goal_achievement_times': SummaryMetric(
+        tuple(f'AVG(CASE WHEN {goal.column} = 1 THEN {goal.key}_first_offset END) / 86400.0 AS {goal.key}_days'
+              for goal in GOALS),
+        _goal_achievement_times,
+    ),
+}
+
+# Metrics reported per signup cohort, fused into one grouped query
+COHORT_METRICS = ('trial_activation_rate', 'time_to_activation', 'goal_completion_rates')
+COHORT_COLUMNS = ['organizations', 'trial_activation_rate', 'time_to_activation'] + [goal.label for goal in GOALS]
+
+
+@dataclass
+class TrialReport:
+    trial_activation_rate: float
+    time_to_activation: float
+    goal_completion_rates: dict
+    advanced_features_rate: dict
+    goal_achievement_times: dict
+    goal_achievement_curves: pd.DataFrame = None
+    # Seconds spent on the query that produced each metric (fused metrics share one)
+    timings: dict = field(default_factory=dict)
+    # End-to-end latency of report()
+    seconds: float = 0.0
+
+
+def read_only_engine(db_path, pool_size=4):
+    """Pooled engine whose connections open the SQLite file read-only."""
+    uri = Path(db_path).absolute().as_uri() + '?mode=ro'
+
+    def connect():
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    return create_engine('sqlite://', creator=connect, poolclass=QueuePool, pool_size=pool_size)
+
 
 class TrialAnalytics:
-    def __init__(self, db_name='trial_data.db'):
-        # Use a relative path to the project root
-        self.engine = create_engine(f'sqlite:///trial_activation/{db_name}')
+    def __init__(self, db_name='trial_data.db', cache=None, pool_size=4, tracer=None, db_path=None):
+        # Use a relative path to the project root unless given an explicit path
+        self.db_path = db_path or os.path.join('trial_activation', db_name)
+        # Analytics never write, so connections are read-only and pooled; with the
+        # database in WAL mode they run alongside a refresh and each other
+        self.engine = read_only_engine(self.db_path, pool_size)
+        self.pool_size = pool_size
+        # Optional ResultCache; results are reused until the database is rebuilt
+        self.cache = cache
+        # Optional Tracer recording every query; the default records nothing
+        self.tracer = tracer or NULL_TRACER
+        self.tracer.instrument(self.engine)
 
-    def trial_activation_rate(self):
+    def version_token(self):
+        # The build id db.py writes on every (re)build; fall back to the file's
+        # modification time for databases built before it existed
         with self.engine.connect() as conn:
-            query = text('''
-                SELECT 
-                    (SELECT COUNT(*) FROM trial_activation) AS activated_orgs,
-                    (SELECT COUNT(DISTINCT organization_id) FROM staging_behavioral_events) AS total_orgs
+            build_id = read_state(conn, BUILD_KEY)
+        if build_id is not None:
+            return build_id
+        return os.stat(self.db_path).st_mtime_ns if os.path.exists(self.db_path) else None
+
+    def _summary(self, names):
+        # One SELECT over org_summary for all requested metrics
+        columns = list(dict.fromkeys(column for name in names for column in SUMMARY_METRICS[name].columns))
+        with self.engine.connect() as conn, \
+                self.tracer.span(f"summary({','.join(names)})", conn, kind='query', rows_in='org_summary') as span:
+            query = text(f'''
+                SELECT
+                    {', '.join(columns)}
+                FROM org_summary
             ''')
             result = conn.execute(query).fetchone()
-            activated_orgs, total_orgs = result
+            span.record(rows_out=1)
+        return {name: SUMMARY_METRICS[name].parse(result) for name in names}
 
-        rate = activated_orgs / total_orgs if total_orgs > 0 else 0
-        return rate
+    @cached
+    def trial_activation_rate(self):
+        return self._summary(['trial_activation_rate'])['trial_activation_rate']
 
+    @cached
     def time_to_activation(self):
-        with self.engine.connect() as conn:
-            query = text('''
-                WITH activation_times AS (
-                    SELECT 
-                        organization_id,
-                        MIN(timestamp) AS first_event,
-                        MAX(timestamp) AS last_event
-                    FROM staging_behavioral_events
-                    GROUP BY organization_id
-                ),
-                activated_orgs AS (
-                    SELECT organization_id FROM trial_activation
-                )
-                SELECT AVG(JULIANDAY(last_event) - JULIANDAY(first_event)) AS avg_days
-                FROM activation_times
-                WHERE organization_id IN (SELECT organization_id FROM activated_orgs)
-            ''')
-            result = conn.execute(query).fetchone()
-            avg_days = result[0] if result[0] is not None else 0
-        return avg_days
+        return self._summary(['time_to_activation'])['time_to_activation']
 
+    @cached
     def goal_completion_rates(self):
-        with self.engine.connect() as conn:
-            query = text('''
-                SELECT 
-                    SUM(goal_shift_created) AS shift_created,
-                    SUM(goal_employee_invited) AS employee_invited,
-                    SUM(goal_punched_in) AS punched_in,
-                    SUM(goal_punch_in_approved) AS punch_in_approved,
-                    SUM(goal_advanced_features) AS advanced_features,
-                    COUNT(*) AS total_orgs
-                FROM trial_goals
-            ''')
-            result = conn.execute(query).fetchone()
-
-        total_orgs = result.total_orgs
-        rates = {
-            'Shift Created': result.shift_created / total_orgs,
-            'Employee Invited': result.employee_invited / total_orgs,
-            'Punched In': result.punched_in / total_orgs,
-            'Punch In Approved': result.punch_in_approved / total_orgs,
-            'Advanced Features': result.advanced_features / total_orgs
-        }
-        return rates
+        return self._summary(['goal_completion_rates'])['goal_completion_rates']
 
+    @cached
     def advanced_features_rate(self):
-        with self.engine.connect() as conn:
-            query = text('''
-                SELECT 
-                    activity_detail,
-                    COUNT(DISTINCT organization_id) AS engaged_orgs,
-                    (SELECT COUNT(DISTINCT organization_id) FROM staging_behavioral_events) AS total_orgs
-                FROM staging_behavioral_events
-                WHERE activity_name = 'Page.Viewed' 
-                  AND activity_detail IN ('revenue', 'integrations-overview', 'absence-accounts', 'availability')
-                GROUP BY activity_detail
+        return self._summary(['advanced_features_rate'])['advanced_features_rate']
+
+    @cached
+    def goal_achievement_times(self):
+        return self._summary(['goal_achievement_times'])['goal_achievement_times']
+
+    def _report_tasks(self):
+        # Each task is one query returning {metric name: value}. Metrics over the
+        # same table are fused into a single task; independent tasks run concurrently.
+        return [
+            lambda: self._summary(list(SUMMARY_METRICS)),
+            lambda: {'goal_achievement_curves': self._achievement_curves()},
+        ]
+
+    def report(self, max_workers=None):
+        """Compute every metric in one call, returning a TrialReport with per-metric timings."""
+        start = time.perf_counter()
+
+        def timed(task):
+            task_start = time.perf_counter()
+            values = task()
+            return values, time.perf_counter() - task_start
+
+        tasks = self._report_tasks()
+        if len(tasks) == 1:
+            results = [timed(tasks[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers or min(len(tasks), self.pool_size)) as pool:
+                results = list(pool.map(timed, tasks))
+
+        values, timings = {}, {}
+        for task_values, seconds in results:
+            values.update(task_values)
+            timings.update(dict.fromkeys(task_values, seconds))
+        return TrialReport(**values, timings=timings, seconds=time.perf_counter() - start)
+
+    def _achievement_curves(self):
+        # One row per organization: offsets of the event that reached each achieved
+        # goal and of activation, plus the trial length
+        offsets = ',\n                    '.join(
+            f'CASE WHEN os.{goal.column} = 1 THEN os.{goal.key}_achieved_offset END AS {goal.key}' for goal in GOALS
+        )
+        with self.engine.connect() as conn, \
+                self.tracer.span('achievement_curves', conn, kind='query', rows_in='org_summary') as span:
+            query = text(f'''
+                SELECT
+                    {offsets},
+                    CAST(ROUND((JULIANDAY(ta.activated_at) - JULIANDAY(os.first_event)) * 86400) AS INTEGER) AS activation,
+                    (JULIANDAY(os.last_event) - JULIANDAY(os.first_event)) * 86400 AS duration
+                FROM org_summary os
+                LEFT JOIN trial_activation ta ON ta.organization_id = os.organization_id
             ''')
-            results = conn.execute(query).fetchall()
+            frame = pd.read_sql(query, conn)
+            span.record(rows_out=len(frame))
 
-        rates = {row.activity_detail: row.engaged_orgs / row.total_orgs for row in results}
-        return rates
+        total_orgs = len(frame)
+        last_day = int(np.ceil(frame['duration'].max() / 86400)) if total_orgs else 0
+        days = np.arange(last_day + 1)
+        curves = {}
+        for column, label in [(goal.key, goal.label) for goal in GOALS] + [('activation', ACTIVATION_LABEL)]:
+            achieved = frame[column].dropna().to_numpy(dtype=np.float64)
+            # Achieved within N days <=> ceil(offset in days) <= N: bin by that day, then cumulative sum
+            achieved_on = np.minimum(np.ceil(achieved / 86400).astype(np.int64), last_day + 1)
+            counts = np.bincount(achieved_on, minlength=last_day + 2)[:last_day + 1]
+            curves[label] = np.cumsum(counts) / total_orgs if total_orgs else np.zeros(len(days))
+        return pd.DataFrame(curves, index=pd.Index(days, name='days'))
 
-    def goal_achievement_times(self):
-        with self.engine.connect() as conn:
-            query = text('''
-                WITH goal_times AS (
-                    SELECT
-                        organization_id,
-                        MIN(CASE WHEN activity_name = 'Shift.Created' THEN time_since_first_activity END) AS shift_created_time,
-                        MIN(CASE WHEN activity_name = 'Hr.Employee.Invited' THEN time_since_first_activity END) AS employee_invited_time,
-                        MIN(CASE WHEN activity_name = 'PunchClock.PunchedIn' THEN time_since_first_activity END) AS punched_in_time,
-                        MIN(CASE WHEN activity_name = 'PunchClock.Approvals.EntryApproved' THEN time_since_first_activity END) AS punch_approved_time,
-                        MIN(CASE WHEN activity_name = 'Page.Viewed' AND activity_detail IN ('revenue', 'integrations-overview', 'absence-accounts', 'availability') THEN time_since_first_activity END) AS advanced_feature_time
-                    FROM staging_behavioral_events
-                    GROUP BY organization_id
-                ),
-                goal_counts AS (
-                    SELECT
-                        organization_id,
-                        SUM(CASE WHEN activity_name = 'Shift.Created' THEN 1 ELSE 0 END) AS shift_created_count,
-                        SUM(CASE WHEN activity_name = 'Hr.Employee.Invited' THEN 1 ELSE 0 END) AS employee_invited_count,
-                        SUM(CASE WHEN activity_name = 'PunchClock.PunchedIn' THEN 1 ELSE 0 END) AS punched_in_count,
-                        SUM(CASE WHEN activity_name = 'PunchClock.Approvals.EntryApproved' THEN 1 ELSE 0 END) AS punch_approved_count,
-                        SUM(CASE WHEN activity_name = 'Page.Viewed' AND activity_detail IN ('revenue', 'integrations-overview', 'absence-accounts', 'availability') THEN 1 ELSE 0 END) AS advanced_feature_count
-                    FROM staging_behavioral_events
-                    GROUP BY organization_id
-                )
+    @cached
+    def goal_achievement_curves(self):
+        """
+        Fraction of organizations that achieved each goal, and full activation,
+        within N days of their first activity, for every N from 0 to the longest trial.
+        Returns a DataFrame indexed by day with one column per goal label plus 'Activation'.
+        """
+        return self._achievement_curves()
+
+    def goal_achievement_probability(self, goal, days):
+        # goal is a trial_goals column name (e.g. 'goal_shift_created') or 'activated'
+        label = ACTIVATION_LABEL if goal == 'activated' else next(g.label for g in GOALS if g.column == goal)
+        curve = self.goal_achievement_curves()[label]
+        return float(curve.iloc[min(int(days), len(curve) - 1)]) if len(curve) else 0.0
+
+    def _cohort_rows(self, cohort, since=None):
+        # One GROUP BY over the cohort key stored in org_summary; `since` limits it
+        # to cohorts from that key on, which the cohort index finds without a scan
+        columns = list(dict.fromkeys(column for name in COHORT_METRICS for column in SUMMARY_METRICS[name].columns))
+        where = f'WHERE {cohort.column} >= :since' if since is not None else ''
+        with self.engine.connect() as conn, \
+                self.tracer.span(f'cohorts({cohort.granularity})', conn, kind='query', rows_in='org_summary') as span:
+            query = text(f'''
                 SELECT
-                    AVG(CASE WHEN gc.shift_created_count >= 2 THEN gt.shift_created_time END) / 86400.0 AS avg_shift_created_days,
-                    AVG(CASE WHEN gc.employee_invited_count >= 1 THEN gt.employee_invited_time END) / 86400.0 AS avg_employee_invited_days,
-                    AVG(CASE WHEN gc.punched_in_count >= 1 THEN gt.punched_in_time END) / 86400.0 AS avg_punched_in_days,
-                    AVG(CASE WHEN gc.punch_approved_count >= 1 THEN gt.punch_approved_time END) / 86400.0 AS avg_punch_approved_days,
-                    AVG(CASE WHEN gc.advanced_feature_count >= 2 THEN gt.advanced_feature_time END) / 86400.0 AS avg_advanced_feature_days
-                FROM goal_times gt
-                JOIN goal_counts gc ON gt.organization_id = gc.organization_id
+                    {cohort.column} AS cohort,
+                    {', '.join(columns)}
+                FROM org_summary
+                {where}
+                GROUP BY {cohort.column}
+                ORDER BY {cohort.column}
             ''')
-            result = conn.execute(query).fetchone()
+            result = conn.execute(query, {'since': since}).fetchall()
+            span.record(rows_out=len(result))
+        rows = [
+            {'cohort': row.cohort, 'organizations': row.total_orgs,
+             **{name: SUMMARY_METRICS[name].parse(row) for name in COHORT_METRICS[:2]},
+             **SUMMARY_METRICS['goal_completion_rates'].parse(row)}
+            for row in result
+        ]
+        return pd.DataFrame(rows, columns=['cohort'] + COHORT_COLUMNS).set_index('cohort')
 
-        return {
-            'Shift Created': result.avg_shift_created_days,
-            'Employee Invited': result.avg_employee_invited_days,
-            'Punched In': result.avg_punched_in_days,
-            'Punch In Approved': result.avg_punch_approved_days,
-            'Advanced Features': result.avg_advanced_feature_days
-        }
-
-    # def goal_achievement_probability(self, goal, days):
-    #     with self.engine.connect() as conn:
-    #         query = text('''
-    #             WITH goal_achievements AS (
-    #                 SELECT organization_id,
-    #                        CASE 
-    #                            WHEN :goal = 'goal_shift_created' THEN goal_shift_created
-    #                            WHEN :goal = 'goal_employee_invited' THEN goal_employee_invited
-    #                            WHEN :goal = 'goal_punched_in' THEN goal_punched_in
-    #                            WHEN :goal = 'goal_punch_in_approved' THEN goal_punch_in_approved
-    #                            WHEN :goal = 'goal_advanced_features' THEN goal_advanced_features
-    #                            ELSE 0
-    #                        END AS achieved
-    #                 FROM trial_goals
-    #             )
-    #             SELECT AVG(CASE WHEN se.time_since_first_activity <= :days * 86400
-    #                             AND ga.achieved = 1 THEN 1.0 ELSE 0.0 END) AS probability
-    #             FROM staging_behavioral_events se
-    #             JOIN goal_achievements ga ON se.organization_id = ga.organization_id
-    #             WHERE se.timestamp = se.first_activity_timestamp
-    #         ''')
-    #         result = conn.execute(query, {'goal': goal, 'days': days}).fetchone()
-    #         probability = result[0] if result[0] is not None else 0
-
-    #     return probability
+    def cohort_metrics(self, granularity='week', settle_days=COHORT_SETTLE_DAYS):
+        """
+        Activation rate, average time to activation and goal completion rates per
+        signup cohort (day, week or month of the first activity).
+        Returns a DataFrame indexed by the cohort's first day, with an
+        `organizations` column and a `closed` flag.
+
+        A cohort is closed once `settle_days` have passed since its last day, as of
+        the build's watermark. With a cache, closed cohorts are reused across
+        incremental refreshes that touch only open cohorts, and only open cohorts
+        are queried again.
+        """
+        cohort = get_cohort(granularity)
+        with self.engine.connect() as conn:
+            watermark = read_state(conn, WATERMARK_KEY)
+            lineage = read_state(conn, LINEAGE_KEY)
+            first_open = cohort.first_open(watermark, settle_days) if watermark is not None else None
+            # Refreshes that loaded events for an organization in a closed cohort change that cohort
+            changed = cohort_change_before(conn, first_open) if first_open is not None else 0
+
+        if self.cache is None or lineage is None or first_open is None:
+            frame = self._cohort_rows(cohort)
+        else:
+            key = ('cohort_metrics', granularity, settle_days, first_open, lineage, changed)
+            found, closed = self.cache.get(key)
+            if found:
+                frame = pd.concat([closed, self._cohort_rows(cohort, since=first_open)])
+            else:
+                frame = self._cohort_rows(cohort)
+                self.cache.put(key, frame[frame.index < first_open])
+        frame['closed'] = frame.index < first_open if first_open is not None else False
+        return frame
+
+    def cohort_activation_rates(self, granularity='week'):
+        return self.cohort_metrics(granularity)['trial_activation_rate']
+
+    def cohort_time_to_activation(self, granularity='week'):
+        return self.cohort_metrics(granularity)['time_to_activation']
+
+    def cohort_goal_completion_rates(self, granularity='week'):
+        return self.cohort_metrics(granularity)[[goal.label for goal in GOALS]]
 
 # Example usage
 if __name__ == "__main__":
     analytics = TrialAnalytics()
+    report = analytics.report()
     
-    print(f"Trial Activation Rate: {analytics.trial_activation_rate():.2%}")
-    print(f"Average Time to Activation: {analytics.time_to_activation():.2f} days")
+    print(f"Trial Activation Rate: {report.trial_activation_rate:.2%}")
+    print(f"Average Time to Activation: {report.time_to_activation:.2f} days")
     
     print("\nGoal Completion Rates:")
-    for goal, rate in analytics.goal_completion_rates().items():
+    for goal, rate in report.goal_completion_rates.items():
         print(f"  {goal}: {rate:.2%}")
     
     print("\nFeature Engagement Rates:")
-    for feature, rate in analytics.advanced_features_rate().items():
+    for feature, rate in report.advanced_features_rate.items():
         print(f"  {feature}: {rate:.2%}")
 
     print("\nGoal Achievement Times:")
-    for x,i in analytics.goal_achievement_times().items():
+    for x,i in report.goal_achievement_times.items():
         print(f"  {x}: {i:.2f} days")
 
+    print("\nGoal Achievement Probabilities (within 30 days):")
+    curves = report.goal_achievement_curves
+    within = curves.iloc[min(30, len(curves) - 1)]
+    for goal, prob in within.items():
+        print(f"  {goal}: {prob:.2%}")
+
+    print("\nActivation Rate by Weekly Signup Cohort:")
+    for cohort, rate in analytics.cohort_activation_rates('week').items():
+        print(f"  {cohort}: {rate:.2%}")
 
-    # print("\nGoal Achievement Probabilities (within 30 days):")
-    # goals = ['goal_shift_created', 'goal_employee_invited', 'goal_punched_in', 
-    #          'goal_punch_in_approved', 'goal_advanced_features']
-    # for goal in goals:
-    #     prob = analytics.goal_achievement_probability(goal, 120)
-    #     print(f"  {goal}: {prob:.2%}")
+    print(f"\nReport computed in {report.seconds * 1000:.1f} ms")
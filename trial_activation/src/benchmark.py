@@ -0,0 +1,291 @@
+import argparse
+import json
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from trial_activation.src.analytics import TrialAnalytics
+from trial_activation.src.db import (DEFAULT_PROFILE, INGEST_STAGE, PROFILES, STAGES, create_build_engine, load_events,
+                                     run_stage)
+from trial_activation.src.encoding import COMPACT, ENCODINGS, TEXT
+from trial_activation.src.ingest import SQLITE_DATETIME_FORMAT
+from trial_activation.src.instrumentation import PeakRss
+
+# Named scale factors in events
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1M': 1_000_000,
+    '10M': 10_000_000,
+    '100M': 100_000_000,
+}
+
+# Event mix and trial shape observed in the real export (eda.ipynb): ~77 events per
+# organization, heavily skewed, trials of up to 30 days starting over ~15 weeks
+ACTIVITY_MIX = {
+    'Shift.Created': 0.8405,
+    'PunchClock.PunchedIn': 0.0636,
+    'PunchClock.Approvals.EntryApproved': 0.0392,
+    'Hr.Employee.Invited': 0.0346,
+    'Page.Viewed': 0.0221,
+}
+PAGE_MIX = {
+    'absence-accounts': 0.341,
+    'availability': 0.334,
+    'integrations-overview': 0.187,
+    'revenue': 0.138,
+}
+MEAN_EVENTS_PER_ORGANIZATION = 77
+EVENTS_PER_ORGANIZATION_SIGMA = 1.5
+FIRST_TRIAL_START = np.datetime64('2024-01-01T00:00:00', 'ms')
+TRIAL_START_WINDOW = 108 * 86400
+TRIAL_LENGTH = 30 * 86400
+
+# Organizations generated per block; each block has its own seeded stream, so the
+# output does not depend on how the caller consumes it
+ORGANIZATIONS_PER_BLOCK = 10_000
+
+# Differences below this many seconds are timer noise, never regressions
+MIN_REGRESSION_SECONDS = 0.01
+
+ANALYTICS_METHODS = ('trial_activation_rate', 'time_to_activation', 'goal_completion_rates',
+                     'advanced_features_rate', 'goal_achievement_times', 'goal_achievement_curves', 'report')
+
+
+def parse_scale(scale):
+    """Number of events for a scale name ('10k', '1M', ...) or a plain integer."""
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(str(scale).replace('_', ''))
+
+
+def _organization_ids(rng, organizations):
+    # 32-character hex ids, like the export's ORGANIZATION_ID
+    raw = rng.bytes(16 * organizations)
+    return np.array([raw[i:i + 16].hex() for i in range(0, len(raw), 16)], dtype=object)
+
+
+def _generate_block(seed, block):
+    rng = np.random.default_rng([seed, block])
+    organizations = _organization_ids(rng, ORGANIZATIONS_PER_BLOCK)
+    # Log-normal events per organization with the observed mean
+    mu = np.log(MEAN_EVENTS_PER_ORGANIZATION) - EVENTS_PER_ORGANIZATION_SIGMA ** 2 / 2
+    counts = np.maximum(1, rng.lognormal(mu, EVENTS_PER_ORGANIZATION_SIGMA, ORGANIZATIONS_PER_BLOCK).astype(np.int64))
+    owner = np.repeat(np.arange(ORGANIZATIONS_PER_BLOCK), counts)
+
+    starts = rng.uniform(0, TRIAL_START_WINDOW, ORGANIZATIONS_PER_BLOCK)
+    offsets = rng.uniform(0, TRIAL_LENGTH, len(owner))
+    # Every organization's first event opens its trial
+    offsets[np.cumsum(counts) - counts] = 0
+    milliseconds = np.round((starts[owner] + offsets) * 1000).astype(np.int64)
+    order = np.lexsort((milliseconds, owner))
+
+    names = np.array(list(ACTIVITY_MIX), dtype=object)[
+        rng.choice(len(ACTIVITY_MIX), len(owner), p=list(ACTIVITY_MIX.values()))]
+    details = np.full(len(owner), None, dtype=object)
+    viewed = names == 'Page.Viewed'
+    details[viewed] = np.array(list(PAGE_MIX), dtype=object)[
+        rng.choice(len(PAGE_MIX), viewed.sum(), p=list(PAGE_MIX.values()))]
+
+    return pd.DataFrame({
+        'ORGANIZATION_ID': organizations[owner[order]],
+        'ACTIVITY_NAME': names[order],
+        'ACTIVITY_DETAIL': details[order],
+        'TIMESTAMP': FIRST_TRIAL_START + milliseconds[order].astype('timedelta64[ms]'),
+    })
+
+
+def generate_events(events, seed=0):
+    """
+    Yield a deterministic synthetic event log of exactly `events` rows as DataFrames
+    with the export's columns, one block of organizations at a time.
+    """
+    remaining = events
+    block = 0
+    while remaining > 0:
+        frame = _generate_block(seed, block)
+        if len(frame) > remaining:
+            frame = frame.iloc[:remaining]
+        remaining -= len(frame)
+        block += 1
+        yield frame
+
+
+def write_events_csv(path, events, seed=0):
+    """Write the synthetic event log to a CSV shaped like the real export; returns its path."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for block, frame in enumerate(generate_events(events, seed)):
+        frame.to_csv(path, mode='w' if block == 0 else 'a', header=block == 0, index=False,
+                     date_format=SQLITE_DATETIME_FORMAT)
+    return path
+
+
+def measure(func, repeat=1):
+    """Run `func` `repeat` times; returns its last result and the fastest run's seconds and peak RSS."""
+    best = None
+    for _ in range(repeat):
+        with PeakRss() as rss:
+            start = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start
+        if best is None or seconds < best['seconds']:
+            best = {'seconds': seconds, 'peak_rss_bytes': rss.peak}
+    return result, best
+
+
+def _count(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT COUNT(*) FROM {table}')).scalar()
+
+
+def _run_stage(engine, name, encoding):
+    def run():
+        with engine.begin() as conn:
+            run_stage(conn, name, compact=encoding == COMPACT)
+    return run
+
+
+def benchmark_build(engine, csv_path, encoding=TEXT):
+    """Time and memory-profile each db.py stage in order; returns {stage: measurements}."""
+    results = {}
+    _, results[INGEST_STAGE] = measure(lambda: load_events(engine, csv_path))
+    results[INGEST_STAGE]['rows'] = _count(engine, 'behavioral_events')
+    for name, stage in STAGES.items():
+        _, results[name] = measure(_run_stage(engine, name, encoding))
+        if stage.rows_out is not None:
+            results[name]['rows'] = _count(engine, stage.rows_out)
+    return results
+
+
+def benchmark_analytics(analytics, repeat=3):
+    """Time and memory-profile each TrialAnalytics method, best of `repeat` uncached runs."""
+    results = {}
+    for name in ANALYTICS_METHODS:
+        _, results[name] = measure(getattr(analytics, name), repeat)
+    return results
+
+
+def run_benchmark(events, workdir, seed=0, repeat=3, profile=DEFAULT_PROFILE, encoding=TEXT):
+    """
+    Generate `events` synthetic events under `workdir`, build the database stage by
+    stage under a db.py profile and staging encoding and query it with
+    TrialAnalytics. Returns a JSON-serializable result.
+    """
+    workdir = Path(workdir).absolute()
+    csv_path, generation = measure(lambda: write_events_csv(workdir / 'trial_activation' / 'data' / 'events.csv',
+                                                            events, seed))
+    db_path = workdir / 'trial_activation' / 'trial_data.db'
+    for suffix in ('', '-wal', '-shm'):
+        Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+    engine = create_build_engine(db_path, profile)
+    stages = benchmark_build(engine, csv_path, encoding)
+    engine.dispose()
+
+    analytics = TrialAnalytics(db_path=str(db_path))
+    queries = benchmark_analytics(analytics, repeat)
+    analytics.engine.dispose()
+
+    return {
+        'events': events,
+        'organizations': stages['org_summary']['rows'],
+        'seed': seed,
+        'profile': profile,
+        'encoding': encoding,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'generation': generation,
+        'database_bytes': db_path.stat().st_size,
+        'stages': stages,
+        'analytics': queries,
+    }
+
+
+@dataclass
+class Regression:
+    scale: str
+    name: str
+    metric: str
+    baseline: float
+    current: float
+
+    def __str__(self):
+        return (f'{self.scale} {self.name} {self.metric}: {self.baseline:,.4g} -> {self.current:,.4g} '
+                f'({self.current / self.baseline - 1:+.0%})')
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=MIN_REGRESSION_SECONDS):
+    """
+    Compare benchmark results ({scale: run}) with a stored baseline of the same
+    shape. Returns a Regression for every stage or method whose time or peak RSS
+    grew by more than `tolerance`; scales missing from either side are skipped.
+    """
+    regressions = []
+    for scale, run in results.items():
+        if scale not in baseline:
+            continue
+        reference = baseline[scale]
+        built = ('events', 'seed', 'profile', 'encoding')
+        if [run.get(key) for key in built] != [reference.get(key) for key in built]:
+            raise ValueError(f'Scale {scale} was generated or built differently from the baseline')
+        for section in ('stages', 'analytics'):
+            for name, current in run[section].items():
+                previous = reference[section].get(name)
+                if previous is None:
+                    continue
+                if (current['seconds'] > previous['seconds'] * (1 + tolerance)
+                        and current['seconds'] - previous['seconds'] > min_seconds):
+                    regressions.append(Regression(scale, name, 'seconds', previous['seconds'], current['seconds']))
+                if current['peak_rss_bytes'] > previous['peak_rss_bytes'] * (1 + tolerance):
+                    regressions.append(Regression(scale, name, 'peak_rss_bytes',
+                                                  previous['peak_rss_bytes'], current['peak_rss_bytes']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the build and analytics on synthetic events.')
+    parser.add_argument('--scale', action='append', help=f'events per run, e.g. {", ".join(SCALES)} (repeatable)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', choices=PROFILES, default=DEFAULT_PROFILE, help='db.py build profile')
+    parser.add_argument('--encoding', choices=ENCODINGS, default=TEXT, help='db.py staging encoding')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per analytics method; the fastest is kept')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results file to compare against; exits 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--workdir', help='where to write the generated CSV and database (default: a temp dir)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scale or ['10k']:
+            run = run_benchmark(parse_scale(scale), args.workdir or tmp, args.seed, args.repeat, args.profile,
+                                args.encoding)
+            results[scale] = run
+            build_seconds = sum(stage['seconds'] for stage in run['stages'].values())
+            print(f"{scale}: {run['events']:,} events, {run['organizations']:,} organizations, "
+                  f"build {build_seconds:.2f}s, report {run['analytics']['report']['seconds'] * 1000:.1f} ms")
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print('No regressions against the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import copy
+import functools
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Bounded LRU cache for query results, optionally backed by a SQLite file.
+
+    Keys must have a stable repr. With a `path`, entries are written through to
+    disk and the most recently used ones are reloaded on start-up, so the cache
+    survives restarts.
+    """
+
+    def __init__(self, maxsize=128, path=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._store = None
+        if path is not None:
+            self._store = sqlite3.connect(str(path), check_same_thread=False)
+            # Losing the tail of a cache on a crash is harmless; skip the fsyncs
+            self._store.execute('PRAGMA synchronous = OFF')
+            self._store.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            ''')
+            rows = self._store.execute(
+                'SELECT key, value FROM results ORDER BY accessed DESC LIMIT ?', (maxsize,)
+            ).fetchall()
+            for key, value in reversed(rows):
+                self._entries[key] = pickle.loads(value)
+            self._store.execute(
+                'DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY accessed DESC LIMIT ?)',
+                (maxsize,),
+            )
+            self._store.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return (True, value) on a hit and (False, None) on a miss."""
+        key = repr(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if self._store is not None:
+                self._store.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+                self._store.commit()
+            return True, copy.deepcopy(self._entries[key])
+
+    def put(self, key, value):
+        key = repr(key)
+        with self._lock:
+            self._entries[key] = copy.deepcopy(value)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._store is not None:
+                self._store.execute(
+                    'INSERT OR REPLACE INTO results (key, value, accessed) VALUES (?, ?, ?)',
+                    (key, pickle.dumps(value), time.time()),
+                )
+                self._store.executemany('DELETE FROM results WHERE key = ?', [(k,) for k in evicted])
+                self._store.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._store is not None:
+                self._store.execute('DELETE FROM results')
+                self._store.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+def cached(method):
+    """
+    Memoize a TrialAnalytics method in `self.cache`, keyed by method name,
+    arguments and the database version token. A no-op when caching is off.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.cache is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())), self.version_token())
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        value = method(self, *args, **kwargs)
+        self.cache.put(key, value)
+        return value
+    return wrapper
@@ -0,0 +1,58 @@
+from dataclasses import dataclass
+
+import pandas as pd
+from sqlalchemy import text
+
+from trial_activation.src.indexes import Index
+
+# Days after a cohort's last signup during which its organizations' trials may
+# still change its metrics; older cohorts are closed and their results cacheable
+COHORT_SETTLE_DAYS = 30
+
+
+@dataclass(frozen=True)
+class Cohort:
+    granularity: str
+    # SQLite date() modifiers taking a timestamp to the first day of its period
+    modifiers: tuple
+    # pandas period frequency with the same boundaries
+    frequency: str
+
+    @property
+    def column(self):
+        # Cohort key column in org_summary: the period's first day as 'YYYY-MM-DD'
+        return f'cohort_{self.granularity}'
+
+    def key_sql(self, timestamp):
+        return 'DATE(' + ', '.join([timestamp] + [f"'{modifier}'" for modifier in self.modifiers]) + ')'
+
+    def key(self, timestamp):
+        return pd.Timestamp(timestamp).to_period(self.frequency).start_time.strftime('%Y-%m-%d')
+
+    def first_open(self, watermark, settle_days=COHORT_SETTLE_DAYS):
+        """Key of the earliest cohort not yet closed at `watermark`; every earlier cohort is closed."""
+        return self.key(pd.Timestamp(watermark) - pd.Timedelta(days=settle_days))
+
+
+COHORTS = {cohort.granularity: cohort for cohort in (
+    Cohort('day', (), 'D'),
+    # Weeks start on Monday
+    Cohort('week', ('weekday 0', '-6 days'), 'W-SUN'),
+    Cohort('month', ('start of month',), 'M'),
+)}
+
+COHORT_INDEXES = tuple(
+    Index(f'idx_org_summary_{cohort.column}', 'org_summary', (cohort.column,)) for cohort in COHORTS.values()
+)
+
+
+def get_cohort(granularity):
+    if granularity not in COHORTS:
+        raise ValueError(f'Unknown cohort granularity {granularity!r}; expected one of {", ".join(COHORTS)}')
+    return COHORTS[granularity]
+
+
+def create_cohort_indexes(conn):
+    # Created once org_summary is loaded; lets analytics read only the open cohorts
+    for index in COHORT_INDEXES:
+        conn.execute(text(index.create_sql()))
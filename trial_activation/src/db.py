@@ -1,172 +1,275 @@
-import pandas as pd
-from sqlalchemy import create_engine, text
-from datetime import datetime
-import os
-
-# Get the path to the trial_activation directory
-db_path = 'trial_activation/trial_data.db'
-
-# Create a database connection
-engine = create_engine(f'sqlite:///{db_path}')
-
-# Load the data into a DataFrame and set appropriate data types
-data = pd.read_csv('trial_activation/data/analytics_engineering_task.csv')
-
-# Convert timestamp to datetime
-data['TIMESTAMP'] = pd.to_datetime(data['TIMESTAMP'])
-
-# Ensure organization_id is string (for UUID)
-data['ORGANIZATION_ID'] = data['ORGANIZATION_ID'].astype(str)
-print('Number of unique organizations in source data:', len(data.ORGANIZATION_ID.unique()))
-
-# Load the data into the database
-data.to_sql('behavioral_events', con=engine, if_exists='replace', index=False)
-
-# Step 1: Staging Layer - Create staging table from behavioral_events
-with engine.connect() as conn:
-    # Drop the existing table if it exists
-    conn.execute(text('DROP TABLE IF EXISTS staging_behavioral_events'))
-    
-    # Create the staging_behavioral_events table with new columns
-    conn.execute(text('''
-        CREATE TABLE staging_behavioral_events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            organization_id TEXT NOT NULL,
-            activity_name TEXT,
-            activity_detail TEXT,
-            timestamp DATETIME NOT NULL,
-            first_activity_timestamp DATETIME NOT NULL,
-            time_since_first_activity INTERVAL
-        )
-    '''))
-    
-    # Prepare and execute the INSERT statement with new columns
-    insert_query = text('''
-        INSERT INTO staging_behavioral_events (
-            organization_id, activity_name, activity_detail, timestamp,
-            first_activity_timestamp, time_since_first_activity
-        )
-        SELECT 
-            organization_id, 
-            activity_name, 
-            activity_detail, 
-            timestamp,
-            FIRST_VALUE(timestamp) OVER (PARTITION BY organization_id ORDER BY timestamp) AS first_activity_timestamp,
-            CAST((JULIANDAY(timestamp) - JULIANDAY(FIRST_VALUE(timestamp) OVER (PARTITION BY organization_id ORDER BY timestamp))) * 86400 AS INTEGER) AS time_since_first_activity
-        FROM behavioral_events
-    ''')
-    
-    conn.execute(insert_query)
-    
-    # Commit the transaction
-    conn.commit()
-    # Check if any data was inserted
-    count_behavioral_events = conn.execute(text('SELECT COUNT(*) FROM behavioral_events')).scalar()
-    count_staging_behavioral_events = conn.execute(text('SELECT COUNT(*) FROM staging_behavioral_events')).scalar()
-    organizations_staging_behavioral_events = conn.execute(text('SELECT COUNT(DISTINCT organization_id) FROM staging_behavioral_events')).scalar()
-    print(f"Total rows in staging_behavioral_events: {count_staging_behavioral_events}")
-    print(f'total rows in behavioral_events: {count_behavioral_events}')
-    print(f'Number of unique organizations in staging_behavioral_events: {organizations_staging_behavioral_events}')
-    
-    
-
-# Step 2: Trial Goals Mart
-with engine.connect() as conn:
-    # Drop the existing table if it exists
-    conn.execute(text('DROP TABLE IF EXISTS trial_goals'))
-    
-    # Create the trial_goals table
-    conn.execute(text('''
-        CREATE TABLE trial_goals (
-            organization_id TEXT PRIMARY KEY,
-            goal_shift_created BOOLEAN NOT NULL,
-            goal_employee_invited BOOLEAN NOT NULL,
-            goal_punched_in BOOLEAN NOT NULL,
-            goal_punch_in_approved BOOLEAN NOT NULL,
-            goal_advanced_features BOOLEAN NOT NULL
-        )
-    '''))
-    
-    # Prepare and execute the INSERT statement
-    insert_query = text('''
-        INSERT INTO trial_goals (
-            organization_id,
-            goal_shift_created,
-            goal_employee_invited,
-            goal_punched_in,
-            goal_punch_in_approved,
-            goal_advanced_features
-        )
-        SELECT
-            organization_id,
-            CASE WHEN SUM(CASE WHEN activity_name = 'Shift.Created' THEN 1 ELSE 0 END) >= 2 THEN 1 ELSE 0 END,
-            CASE WHEN SUM(CASE WHEN activity_name = 'Hr.Employee.Invited' THEN 1 ELSE 0 END) >= 1 THEN 1 ELSE 0 END,
-            CASE WHEN SUM(CASE WHEN activity_name = 'PunchClock.PunchedIn' THEN 1 ELSE 0 END) >= 1 THEN 1 ELSE 0 END,
-            CASE WHEN SUM(CASE WHEN activity_name = 'PunchClock.Approvals.EntryApproved' THEN 1 ELSE 0 END) >= 1 THEN 1 ELSE 0 END,
-            CASE WHEN SUM(CASE WHEN activity_name = 'Page.Viewed' AND activity_detail IN ('revenue', 'integrations-overview', 'absence-accounts', 'availability') THEN 1 ELSE 0 END) >= 2 THEN 1 ELSE 0 END
-        FROM staging_behavioral_events
-        GROUP BY organization_id
-    ''')
-    
-    conn.execute(insert_query)
-    
-    # Commit the transaction
-    conn.commit()
-
-    # Verify the data insertion
-    result = conn.execute(text('SELECT COUNT(*) FROM trial_goals')).scalar()
-    print(f"Number of rows inserted into trial_goals: {result}")
-
-
-# After creating trial_goals table
-with engine.connect() as conn:
-    # Data Consistency Check
-    consistency_check = conn.execute(text('''
-        SELECT 
-            COUNT(DISTINCT se.organization_id) as staging_org_count,
-            COUNT(DISTINCT tg.organization_id) as trial_goals_org_count
-        FROM staging_behavioral_events se
-        LEFT JOIN trial_goals tg ON se.organization_id = tg.organization_id
-    ''')).fetchone()
-    
-    print("\nConsistency Check:")
-    print(f"Organizations in Staging: {consistency_check.staging_org_count}")
-    print(f"Organizations in Trial Goals: {consistency_check.trial_goals_org_count}")
-
-# Step 3: Trial Activation Mart
-with engine.connect() as conn:
-    # Drop the existing table if it exists
-    conn.execute(text('DROP TABLE IF EXISTS trial_activation'))
-    
-    # Create the trial_activation table
-    conn.execute(text('''
-        CREATE TABLE trial_activation (
-            organization_id TEXT PRIMARY KEY
-        )
-    '''))
-    
-    # Prepare and execute the INSERT statement
-    insert_query = text('''
-        INSERT INTO trial_activation (organization_id)
-        SELECT organization_id
-        FROM trial_goals
-        WHERE goal_shift_created = 1
-          AND goal_employee_invited = 1
-          AND goal_punched_in = 1
-          AND goal_punch_in_approved = 1
-          AND goal_advanced_features = 1
-    ''')
-    
-    conn.execute(insert_query)
-    
-    # Commit the transaction
-    conn.commit()
-
-    # Verify the data insertion
-    result = conn.execute(text('SELECT COUNT(*) FROM trial_activation')).scalar()
-    print(f"Number of rows inserted into trial_activation: {result}")
+import argparse
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from sqlalchemy import create_engine, event, text
+
+from trial_activation.src.activation import persist_activated_at
+from trial_activation.src.encoding import COMPACT, ENCODINGS, TEXT
+from trial_activation.src.features import build_features
+from trial_activation.src.incremental import new_build_id, new_lineage_id, record_source, write_watermark
+from trial_activation.src.indexes import build_indexes
+from trial_activation.src.ingest import DEFAULT_CHUNKSIZE, IngestStats, ingest_csv
+from trial_activation.src.instrumentation import NULL_TRACER, Tracer
+from trial_activation.src.parallel import build_parallel
+from trial_activation.src.snapshot import export_snapshot
+from trial_activation.src.stages import build_org_summary, build_staging, build_trial_activation, build_trial_goals
+from trial_activation.src.verify import VerificationReport, verify_build
+
+# Default locations, relative to the project root
+DEFAULT_DB_PATH = 'trial_activation/trial_data.db'
+DEFAULT_CSV_PATH = 'trial_activation/data/analytics_engineering_task.csv'
+
+
+@dataclass(frozen=True)
+class Profile:
+    # PRAGMAs applied to every build connection, in order
+    name: str
+    pragmas: dict
+
+
+PROFILES = {
+    # Throughput first: a failed build is simply rerun from the CSV, so skip
+    # fsyncs and (on a fresh file) the rollback journal file, keep a 256 MiB page cache, map up to
+    # 1 GiB of the file and keep sort data in memory
+    'bulk_load': Profile('bulk_load', {
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'mmap_size': 1 << 30,
+        'temp_store': 'MEMORY',
+    }),
+    # SQLite defaults plus WAL with full fsyncs: every committed stage survives
+    # a crash, and temporary sort data goes to disk
+    'safe': Profile('safe', {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+    }),
+}
+DEFAULT_PROFILE = 'bulk_load'
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: Callable
+    # Tables whose row counts a tracer records as rows in and out
+    rows_in: str | None = None
+    rows_out: str | None = None
+    # Build options the stage accepts as keyword arguments
+    options: tuple = ()
+    # Whether the stage changes table contents, and so invalidates result caches and snapshots
+    writes: bool = True
+
+
+# Build stages after the load, in dependency order; each takes a connection and
+# runs in its own transaction
+STAGES = {stage.name: stage for stage in (
+    # Step 1: Staging Layer - clean copy of behavioral_events with trial offsets,
+    # as text or in the compact layout
+    Stage('staging', build_staging, 'behavioral_events', 'staging_behavioral_events', options=('compact',)),
+    # Covering and per-goal partial indexes over the loaded staging table, then ANALYZE
+    Stage('indexes', build_indexes),
+    # Step 2: one row per organization from a single scan of staging; trial_goals reads its flags from here
+    Stage('org_summary', build_org_summary, 'staging_behavioral_events', 'org_summary'),
+    Stage('trial_goals', build_trial_goals, 'org_summary', 'trial_goals'),
+    # Step 3: Trial Activation Mart
+    Stage('trial_activation', build_trial_activation, 'trial_goals', 'trial_activation'),
+    # Timestamp of the event that completed activation, found in one window pass
+    Stage('activated_at', persist_activated_at, 'staging_behavioral_events', 'trial_activation'),
+    # Mergeable per-organization aggregates behind the model's feature matrix (features.py)
+    Stage('features', build_features, 'behavioral_events', 'org_features'),
+    # Record the high-water mark so incremental refreshes only load newer events
+    Stage('watermark', write_watermark),
+    # One pass per table over the build's invariants; fails the build on any problem (verify.py)
+    Stage('verify', verify_build, writes=False),
+    # Columnar .npy copy of staging next to the database for notebooks (snapshot.py)
+    Stage('snapshot', export_snapshot, 'staging_behavioral_events', writes=False),
+)}
+INGEST_STAGE = 'ingest'
+ALL_STAGES = (INGEST_STAGE,) + tuple(STAGES)
+# Stages build_parallel covers when building with several workers
+PARALLEL_STAGES = ('staging', 'org_summary', 'trial_goals', 'trial_activation', 'activated_at')
+
+
+@dataclass
+class BuildResult:
+    target: str
+    profile: str
+    ingest: IngestStats | None = None
+    # Report of the verify stage, if it ran
+    verification: VerificationReport | None = None
+    # Wall time of each stage that ran, in order
+    stage_seconds: dict = field(default_factory=dict)
+    seconds: float = 0.0
+
+
+def create_build_engine(target=DEFAULT_DB_PATH, profile=DEFAULT_PROFILE):
+    """Engine for building `target` whose connections apply a performance profile."""
+    profile = PROFILES[profile] if isinstance(profile, str) else profile
+    engine = create_engine(f'sqlite:///{target}')
+
+    @event.listens_for(engine, 'connect')
+    def apply_profile(dbapi_connection, connection_record):
+        # Leaving WAL needs exclusive access, so a finished database that readers
+        # may have open keeps it; only fresh files take the profile's journal mode
+        in_wal = dbapi_connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        for pragma, value in profile.pragmas.items():
+            if pragma == 'journal_mode' and in_wal:
+                continue
+            dbapi_connection.execute(f'PRAGMA {pragma} = {value}')
+
+    return engine
+
+
+def load_events(engine, source=DEFAULT_CSV_PATH, chunksize=DEFAULT_CHUNKSIZE, tracer=NULL_TRACER):
+    """Stream the source CSV into behavioral_events chunk by chunk, parsing timestamps per chunk."""
+    with tracer.span(INGEST_STAGE) as span:
+        stats = ingest_csv(engine, source, table='behavioral_events', chunksize=chunksize)
+        span.record(rows_in=stats.rows, rows_out=stats.rows)
+    # Incremental refreshes from the same export skip the bytes loaded here
+    with engine.begin() as conn:
+        record_source(conn, source, stats.source_bytes)
+        new_build_id(conn)
+    return stats
+
+
+def run_stage(conn, name, tracer=NULL_TRACER, **options):
+    """Run one build stage on `conn`, passing it the `options` it accepts, and return its result; the caller commits."""
+    stage = STAGES[name]
+    with tracer.span(name, conn, rows_in=stage.rows_in, rows_out=stage.rows_out):
+        value = stage.run(conn, **{option: value for option, value in options.items() if option in stage.options})
+    if stage.writes:
+        # Any stage on its own (--stage) rebuilds its tables from scratch and must
+        # invalidate what was derived from the old ones, refresh-proof results included
+        new_lineage_id(conn)
+        new_build_id(conn)
+    return value
+
+
+def build_database(source=DEFAULT_CSV_PATH, target=DEFAULT_DB_PATH, profile=DEFAULT_PROFILE,
+                   stages=ALL_STAGES, chunksize=DEFAULT_CHUNKSIZE, workers=1, tracer=NULL_TRACER,
+                   encoding=TEXT):
+    """
+    Build `target` from the `source` CSV by running `stages` (names from ALL_STAGES)
+    in dependency order under a performance profile. With `workers` > 1 the
+    staging and mart stages are built in parallel shards. `encoding` picks the
+    staging layout (see encoding.py); later stages follow whichever is in place.
+
+    The finished database is left in WAL mode whatever the profile, so read-only
+    analytics connections can run alongside later refreshes.
+    """
+    start = time.perf_counter()
+    profile = PROFILES[profile] if isinstance(profile, str) else profile
+    unknown = set(stages) - set(ALL_STAGES)
+    if unknown:
+        raise ValueError(f'Unknown build stages: {", ".join(sorted(unknown))}')
+    if encoding not in ENCODINGS:
+        raise ValueError(f'Unknown staging encoding: {encoding}')
+    compact = encoding == COMPACT
+    result = BuildResult(str(target), profile.name)
+    engine = create_build_engine(target, profile)
+    tracer.instrument(engine)
+
+    def timed(name, func):
+        stage_start = time.perf_counter()
+        value = func()
+        result.stage_seconds[name] = time.perf_counter() - stage_start
+        return value
+
+    if INGEST_STAGE in stages:
+        result.ingest = timed(INGEST_STAGE, lambda: load_events(engine, source, chunksize, tracer))
+
+    remaining = [name for name in STAGES if name in stages]
+    if workers > 1 and set(PARALLEL_STAGES) <= set(remaining):
+        # Hash-partition organizations into shards, build them in a process pool and
+        # merge; the result matches the serial build
+        def parallel():
+            with tracer.span('parallel_build'):
+                build_parallel(engine, target, workers=workers, compact=compact)
+            with engine.begin() as conn:
+                new_lineage_id(conn)
+                new_build_id(conn)
+        timed('parallel_build', parallel)
+        remaining = [name for name in remaining if name not in PARALLEL_STAGES]
+
+    # One connection for the whole build, one transaction per stage
+    with engine.connect() as conn:
+        for name in remaining:
+            value = timed(name, lambda: run_stage(conn, name, tracer, compact=compact))
+            if name == 'verify':
+                result.verification = value
+            conn.commit()
+        conn.execute(text('PRAGMA journal_mode = WAL'))
+    engine.dispose()
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def print_build_summary(target, result):
+    engine = create_engine(f'sqlite:///{target}')
+    if result.ingest is not None:
+        print('Number of unique organizations in source data:', result.ingest.organizations)
+        print(f'Loaded behavioral_events: {result.ingest}')
+
+    if result.verification is not None:
+        print(result.verification)
+    with engine.connect() as conn:
+        for table in ('org_summary', 'trial_activation'):
+            count = conn.execute(text(f'SELECT COUNT(*) FROM {table}')).scalar()
+            print(f"Number of rows inserted into {table}: {count}")
+    engine.dispose()
+
+    stages = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in result.stage_seconds.items())
+    print(f'\nBuilt {result.target} with the {result.profile} profile in {result.seconds:.2f}s ({stages})')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the trial activation database from the event export.')
+    parser.add_argument('--source', default=DEFAULT_CSV_PATH, help='event CSV export')
+    parser.add_argument('--target', default=DEFAULT_DB_PATH, help='SQLite database to (re)build')
+    parser.add_argument('--profile', choices=PROFILES, default=DEFAULT_PROFILE)
+    parser.add_argument('--stage', action='append', choices=ALL_STAGES, dest='stages',
+                        help='run only this stage (repeatable); default: all')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help='CSV rows per chunk; bounds peak memory during the load')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes for the staging and mart stages; 1 builds serially')
+    parser.add_argument('--encoding', choices=ENCODINGS, default=TEXT,
+                        help='staging layout: text columns, or integer timestamps and activity codes')
+    parser.add_argument('--trace', help='write per-stage metrics here (.prom: Prometheus text, otherwise JSON)')
+    parser.add_argument('--explain', action='store_true', help='include EXPLAIN QUERY PLAN output in the trace')
+    args = parser.parse_args(argv)
+
+    tracer = Tracer(explain=args.explain) if args.trace else NULL_TRACER
+    result = build_database(args.source, args.target, args.profile, stages=args.stages or ALL_STAGES,
+                            chunksize=args.chunksize, workers=args.workers, tracer=tracer,
+                            encoding=args.encoding)
+    print_build_summary(args.target, result)
+    if args.trace:
+        print(f'Build trace written to {tracer.write(args.trace)}')
+    return result
+
+
+# Building runs only as a script: worker processes re-import this module
+if __name__ == '__main__':
+    main()
 
 # Explanation of Layers
 # - Staging Layer: Here, we loaded the raw data into a staging table without any transformations.
+#   With `--encoding compact` it is stored as integer codes and epoch milliseconds in 'staging_events',
+#   and 'staging_behavioral_events' becomes a view with the same columns.
+# - Summary Layer: The 'org_summary' table holds one row per organization (first/last event, per-goal counts and
+#   offsets, advanced page flags, activation flag), so analytics queries scale with organizations, not events.
 # - Integration Layer: The 'trial_goals' table aggregates the event data to track whether each trial goal was completed by an organization.
 # - Data Mart Layer: The 'trial_activation' table holds information about organizations that have achieved full activation by completing all trial goals.
+# - Activation moment: 'trial_activation.activated_at' holds the timestamp of the event at which all goals first held.
+# - Incremental refresh: `python -m trial_activation.src.incremental` appends the rows added to the export since the
+#   last load (or, for another file, events from the stored watermark on)
+#   and recomputes these layers only for the organizations they touch.
+# - Feature store: 'org_features' keeps running per-organization sums, minima and maxima that incremental refreshes
+#   fold new events into; `features.feature_matrix` derives the float32 training matrix from them.
+# - Snapshot: 'trial_data.snapshot/' holds staging as memory-mappable column files; `load_snapshot` rebuilds it
+#   when the database has changed since.
+# - Parallel build: with `--workers` > 1, organizations are hash-partitioned into shards built in separate processes.
@@ -0,0 +1,47 @@
+from sqlalchemy import text
+
+# Staging storage layouts. 'text' keeps staging_behavioral_events as a table of
+# strings and DATETIME text. 'compact' stores integer epoch milliseconds and
+# dictionary codes in staging_events, with staging_behavioral_events as a view
+# in the readable shape.
+TEXT = 'text'
+COMPACT = 'compact'
+ENCODINGS = (TEXT, COMPACT)
+
+STAGING_TABLE = 'staging_behavioral_events'
+COMPACT_STAGING_TABLE = 'staging_events'
+ACTIVITIES_TABLE = 'activities'
+DETAILS_TABLE = 'details'
+
+# Physical staging columns after the id, per layout
+STAGING_COLUMNS = ('organization_id', 'activity_name', 'activity_detail', 'timestamp',
+                   'first_activity_timestamp', 'time_since_first_activity')
+COMPACT_STAGING_COLUMNS = ('organization_id', 'activity_id', 'detail_id', 'timestamp',
+                           'first_activity_timestamp', 'time_since_first_activity')
+
+
+def staging_table(compact):
+    return COMPACT_STAGING_TABLE if compact else STAGING_TABLE
+
+
+def staging_columns(compact):
+    return COMPACT_STAGING_COLUMNS if compact else STAGING_COLUMNS
+
+
+def is_compact(conn):
+    """Whether the database on `conn` stores staging in the compact layout."""
+    staging_type = conn.execute(
+        text(f"SELECT type FROM main.sqlite_master WHERE name = '{STAGING_TABLE}'")
+    ).scalar()
+    return staging_type == 'view'
+
+
+def text_to_epoch_ms(expression):
+    # Exact for the 'YYYY-MM-DD HH:MM:SS[.ffffff]' text behavioral_events holds:
+    # whole seconds from strftime plus the first three fraction digits
+    return f"(CAST(strftime('%s', {expression}) AS INTEGER) * 1000 + CAST(substr({expression}, 21, 3) AS INTEGER))"
+
+
+def epoch_ms_to_text(expression):
+    # Inverse of text_to_epoch_ms, in the same text layout as behavioral_events
+    return f"(strftime('%Y-%m-%d %H:%M:%S', {expression} / 1000, 'unixepoch') || printf('.%03d000', {expression} % 1000))"
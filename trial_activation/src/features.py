@@ -0,0 +1,178 @@
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+from trial_activation.src.encoding import text_to_epoch_ms
+from trial_activation.src.goals import GOALS
+
+FEATURES_TABLE = 'org_features'
+# Highest behavioral_events rowid already folded into FEATURES_TABLE
+FEATURES_STATE_TABLE = 'org_features_state'
+
+MS_PER_DAY = 86_400_000
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    # A running per-organization aggregate: function(expression) over events,
+    # merged into the stored value with the same function
+    name: str
+    function: str
+    expression: str
+
+    def select_sql(self):
+        return f'{self.function}({self.expression}) AS {self.name}'
+
+    def merge_sql(self):
+        if self.function == 'SUM':
+            return f'{self.name} = {self.name} + excluded.{self.name}'
+        # Two-argument MIN/MAX are NULL if either side is
+        return (f'{self.name} = COALESCE({self.function}({self.name}, excluded.{self.name}), '
+                f'{self.name}, excluded.{self.name})')
+
+
+# Everything the feature matrix is derived from. Sums, counts, minima and
+# maxima merge exactly, so folding in new events in any order or batching
+# gives the same row as aggregating the full history.
+AGGREGATES = (
+    Aggregate('event_count', 'SUM', '1'),
+    Aggregate('day_of_week_sum', 'SUM', 'day_of_week'),
+    Aggregate('day_of_week_sumsq', 'SUM', 'day_of_week * day_of_week'),
+    Aggregate('hour_of_day_sum', 'SUM', 'hour_of_day'),
+    Aggregate('hour_of_day_sumsq', 'SUM', 'hour_of_day * hour_of_day'),
+    Aggregate('first_ms', 'MIN', 'timestamp_ms'),
+    Aggregate('last_ms', 'MAX', 'timestamp_ms'),
+) + tuple(
+    aggregate for goal in GOALS for aggregate in (
+        Aggregate(f'{goal.key}_count', 'SUM', f'CASE WHEN {goal.condition()} THEN 1 ELSE 0 END'),
+        Aggregate(f'{goal.key}_first_ms', 'MIN', f'CASE WHEN {goal.condition()} THEN timestamp_ms END'),
+    )
+)
+
+# Columns of the float32 matrix, in order
+FEATURE_COLUMNS = (
+    'day_of_week_mean', 'day_of_week_std', 'hour_of_day_mean', 'hour_of_day_std',
+    'start_time', 'end_time', 'trial_duration', 'event_count',
+) + tuple(column for goal in GOALS for column in (f'{goal.key}_count', f'{goal.key}_first_offset'))
+
+
+def _events_query():
+    # New raw events with the per-event values the aggregates use; day_of_week
+    # counts from Monday = 0 like pandas
+    return f'''
+        SELECT
+            "ORGANIZATION_ID" AS organization_id,
+            "ACTIVITY_NAME" AS activity_name,
+            "ACTIVITY_DETAIL" AS activity_detail,
+            {text_to_epoch_ms('"TIMESTAMP"')} AS timestamp_ms,
+            (CAST(strftime('%w', "TIMESTAMP") AS INTEGER) + 6) % 7 AS day_of_week,
+            CAST(strftime('%H', "TIMESTAMP") AS INTEGER) AS hour_of_day
+        FROM behavioral_events
+        WHERE rowid > :after AND rowid <= :until
+    '''
+
+
+def create_features_table(conn):
+    conn.execute(text(f'DROP TABLE IF EXISTS {FEATURES_TABLE}'))
+    conn.execute(text(f'DROP TABLE IF EXISTS {FEATURES_STATE_TABLE}'))
+    columns = ''.join(f',\n            {aggregate.name} INTEGER' for aggregate in AGGREGATES)
+    conn.execute(text(f'''
+        CREATE TABLE {FEATURES_TABLE} (
+            organization_id TEXT PRIMARY KEY{columns}
+        )
+    '''))
+    conn.execute(text(f'CREATE TABLE {FEATURES_STATE_TABLE} (last_rowid INTEGER NOT NULL)'))
+    conn.execute(text(f'INSERT INTO {FEATURES_STATE_TABLE} (last_rowid) VALUES (0)'))
+
+
+def update_features(conn):
+    """
+    Fold behavioral_events rows added since the last update into the stored
+    aggregates; only organizations with new events are touched. Returns the
+    number of events folded in.
+    """
+    after = conn.execute(text(f'SELECT last_rowid FROM {FEATURES_STATE_TABLE}')).scalar()
+    until = conn.execute(text('SELECT COALESCE(MAX(rowid), 0) FROM behavioral_events')).scalar()
+    if until <= after:
+        return 0
+    names = ', '.join(aggregate.name for aggregate in AGGREGATES)
+    aggregates = ',\n                '.join(aggregate.select_sql() for aggregate in AGGREGATES)
+    merges = ',\n            '.join(aggregate.merge_sql() for aggregate in AGGREGATES)
+    # WHERE true keeps SQLite from reading ON CONFLICT as a join constraint
+    conn.execute(text(f'''
+        INSERT INTO {FEATURES_TABLE} (organization_id, {names})
+        SELECT organization_id, {names}
+        FROM (
+            SELECT
+                organization_id,
+                {aggregates}
+            FROM ({_events_query()})
+            GROUP BY organization_id
+        )
+        WHERE true
+        ON CONFLICT (organization_id) DO UPDATE SET
+            {merges}
+    '''), {'after': after, 'until': until})
+    conn.execute(text(f'UPDATE {FEATURES_STATE_TABLE} SET last_rowid = :until'), {'until': until})
+    return until - after
+
+
+def build_features(conn):
+    create_features_table(conn)
+    update_features(conn)
+
+
+def has_features(conn):
+    return inspect(conn).has_table(FEATURES_TABLE)
+
+
+def _std(total, squares, count):
+    # Sample standard deviation (ddof=1, as pandas) from running sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = (squares - total * total / count) / (count - 1)
+    return np.where(count > 1, np.sqrt(np.maximum(variance, 0)), np.nan)
+
+
+def load_features(conn):
+    """
+    The per-organization feature matrix as a DataFrame of float32 columns
+    (FEATURE_COLUMNS) plus organization_id. Times are epoch seconds, offsets
+    seconds from the organization's first event (NaN if the goal has no
+    events) and trial_duration days.
+    """
+    stored = pd.read_sql(text(f'SELECT * FROM {FEATURES_TABLE} ORDER BY organization_id'), conn)
+    count = stored['event_count'].to_numpy(np.float64)
+    first, last = stored['first_ms'].to_numpy(np.float64), stored['last_ms'].to_numpy(np.float64)
+    columns = {}
+    for name in ('day_of_week', 'hour_of_day'):
+        total, squares = stored[f'{name}_sum'].to_numpy(np.float64), stored[f'{name}_sumsq'].to_numpy(np.float64)
+        columns[f'{name}_mean'] = total / count
+        columns[f'{name}_std'] = _std(total, squares, count)
+    columns['start_time'] = first / 1000
+    columns['end_time'] = last / 1000
+    columns['trial_duration'] = (last - first) / MS_PER_DAY
+    columns['event_count'] = count
+    for goal in GOALS:
+        columns[f'{goal.key}_count'] = stored[f'{goal.key}_count'].to_numpy(np.float64)
+        columns[f'{goal.key}_first_offset'] = (stored[f'{goal.key}_first_ms'].to_numpy(np.float64) - first) / 1000
+    frame = pd.DataFrame({name: columns[name].astype(np.float32) for name in FEATURE_COLUMNS})
+    frame.insert(0, 'organization_id', stored['organization_id'])
+    return frame
+
+
+def feature_matrix(conn):
+    """(organization ids, float32 matrix with FEATURE_COLUMNS as columns) for training."""
+    frame = load_features(conn)
+    return frame['organization_id'].to_numpy(), frame[list(FEATURE_COLUMNS)].to_numpy(np.float32)
+
+
+if __name__ == '__main__':
+    engine = create_engine(f"sqlite:///{sys.argv[1] if len(sys.argv) > 1 else 'trial_activation/trial_data.db'}")
+    with engine.begin() as conn:
+        if not has_features(conn):
+            create_features_table(conn)
+        folded = update_features(conn)
+    print(f'Folded {folded} new events into {FEATURES_TABLE}')
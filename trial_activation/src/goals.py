@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+
+from trial_activation.src.encoding import staging_table
+
+ADVANCED_PAGES = ('revenue', 'integrations-overview', 'absence-accounts', 'availability')
+
+
+@dataclass(frozen=True)
+class Goal:
+    key: str
+    label: str
+    activity_name: str
+    details: tuple | None = None
+    min_count: int = 1
+
+    @property
+    def column(self):
+        # Completion flag column in trial_goals
+        return f'goal_{self.key}'
+
+    def condition(self, alias='', compact=False):
+        """SQL predicate matching the events that count towards this goal (on codes when `compact`)."""
+        prefix = f'{alias}.' if alias else ''
+        if compact:
+            sql = f'{prefix}activity_id = {ACTIVITY_CODES[self.activity_name]}'
+            if self.details is not None:
+                sql += f' AND {prefix}detail_id IN ({", ".join(str(DETAIL_CODES[d]) for d in self.details)})'
+            return sql
+        sql = f'{prefix}activity_name = {_quote(self.activity_name)}'
+        if self.details is not None:
+            sql += f' AND {prefix}activity_detail IN ({", ".join(_quote(d) for d in self.details)})'
+        return sql
+
+
+# The single definition of trial activation: every mart, analytics query and
+# test derives its SQL from this list
+GOALS = (
+    Goal('shift_created', 'Shift Created', 'Shift.Created', min_count=2),
+    Goal('employee_invited', 'Employee Invited', 'Hr.Employee.Invited'),
+    Goal('punched_in', 'Punched In', 'PunchClock.PunchedIn'),
+    Goal('punch_in_approved', 'Punch In Approved', 'PunchClock.Approvals.EntryApproved'),
+    Goal('advanced_features', 'Advanced Features', 'Page.Viewed', details=ADVANCED_PAGES, min_count=2),
+)
+
+GOALS_BY_KEY = {goal.key: goal for goal in GOALS}
+
+# Codes of the registry's activities and details in the compact layout's
+# dimension tables; fixed, so goal predicates on codes need no lookups
+ACTIVITY_CODES = {name: code for code, name in enumerate(dict.fromkeys(goal.activity_name for goal in GOALS), start=1)}
+DETAIL_CODES = {detail: code for code, detail in
+                enumerate(dict.fromkeys(detail for goal in GOALS for detail in goal.details or ()), start=1)}
+
+
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def detail_flag_column(detail):
+    # Per-page engagement flag column in org_summary
+    return 'viewed_' + detail.replace('-', '_')
+
+
+def goal_aggregates_query(where='', extra_columns=(), compact=False):
+    """
+    One GROUP BY over staging producing, per organization and goal:
+    `<key>_count` matching events, `<key>_first_offset` seconds from the first
+    activity to the first matching event, `<key>_achieved_offset` seconds to the
+    `min_count`-th matching event (when the goal was reached), and the
+    `goal_<key>` completion flag.
+    `extra_columns` are further aggregate expressions computed in the same scan.
+    With `compact`, reads the compact staging table and compares codes.
+    """
+    table = staging_table(compact)
+    columns = list(extra_columns)
+    for goal in GOALS:
+        condition = goal.condition(compact=compact)
+        count = f'SUM(CASE WHEN {condition} THEN 1 ELSE 0 END)'
+        first_offset = f'MIN(CASE WHEN {condition} THEN time_since_first_activity END)'
+        if goal.min_count > 1:
+            # The goal is reached at its min_count-th event in (timestamp, id) order,
+            # the order activation is decided in; one seek into the goal's partial index
+            achieved_offset = f'''(
+                SELECT matches.time_since_first_activity
+                FROM {table} AS matches
+                WHERE matches.organization_id = events.organization_id AND {goal.condition('matches', compact)}
+                ORDER BY matches.timestamp, matches.id
+                LIMIT 1 OFFSET {goal.min_count - 1}
+            )'''
+        else:
+            achieved_offset = first_offset
+        columns += [
+            f'{count} AS {goal.key}_count',
+            f'{first_offset} AS {goal.key}_first_offset',
+            f'{achieved_offset} AS {goal.key}_achieved_offset',
+            f'CASE WHEN {count} >= {goal.min_count} THEN 1 ELSE 0 END AS {goal.column}',
+        ]
+    select = ',\n            '.join(columns)
+    return f'''
+        SELECT
+            organization_id,
+            {select}
+        FROM {table} AS events
+        {where}
+        GROUP BY organization_id
+    '''
+
+
+def all_goals_completed(alias=''):
+    """SQL predicate over trial_goals flag columns that holds for activated organizations."""
+    prefix = f'{alias}.' if alias else ''
+    return ' AND '.join(f'{prefix}{goal.column} = 1' for goal in GOALS)
@@ -0,0 +1,280 @@
+import argparse
+import hashlib
+import os
+import time
+import uuid
+from collections import Counter
+
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+from trial_activation.src.activation import persist_activated_at
+from trial_activation.src.features import has_features, update_features
+from trial_activation.src.indexes import create_indexes
+from trial_activation.src.ingest import (DEFAULT_CHUNKSIZE, SQLITE_DATETIME_FORMAT, TIMESTAMP_COLUMN, csv_columns,
+                                         insert_chunk, read_chunks)
+from trial_activation.src.stages import SCOPE_TABLE, refresh_scoped, set_scope
+
+STATE_TABLE = 'pipeline_state'
+WATERMARK_KEY = 'events_watermark'
+BATCH_KEY = 'ingest_batch'
+# Changes whenever the build alters table contents; result caches key on it
+BUILD_KEY = 'build_id'
+# Changes only with a full build; caches of results that refreshes cannot alter key on it
+LINEAGE_KEY = 'lineage_id'
+# One row per refresh in the current lineage: the earliest first event among the
+# organizations it touched, so caches of closed cohorts can tell whether it reached them
+COHORT_CHANGES_TABLE = 'cohort_changes'
+# Bytes of the source CSV already loaded into behavioral_events, and a blake2b of
+# all of them, so a refresh from the same growing export parses only the appended
+# rows while an export rewritten anywhere in that part is read again in full
+SOURCE_OFFSET_KEY = 'source_offset'
+SOURCE_DIGEST_KEY = 'source_digest'
+# Bytes read at a time while hashing the loaded part of a source
+HASH_BLOCK = 1 << 20
+
+
+def _ensure_state_table(conn):
+    conn.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    '''))
+
+
+def _set_state(conn, key, value):
+    conn.execute(text(f'INSERT OR REPLACE INTO {STATE_TABLE} (key, value) VALUES (:key, :value)'),
+                 {'key': key, 'value': str(value)})
+
+
+def read_state(conn, key):
+    if not inspect(conn).has_table(STATE_TABLE):
+        return None
+    return conn.execute(text(f'SELECT value FROM {STATE_TABLE} WHERE key = :key'), {'key': key}).scalar()
+
+
+def new_build_id(conn):
+    """Record that table contents changed, invalidating result caches and snapshots."""
+    _ensure_state_table(conn)
+    _set_state(conn, BUILD_KEY, uuid.uuid4().hex)
+
+
+def new_lineage_id(conn):
+    """Record that tables were rebuilt from scratch, invalidating even results refreshes cannot change."""
+    _ensure_state_table(conn)
+    _set_state(conn, LINEAGE_KEY, uuid.uuid4().hex)
+    conn.execute(text(f'DROP TABLE IF EXISTS main.{COHORT_CHANGES_TABLE}'))
+
+
+def _record_cohort_change(conn, earliest_first_event):
+    conn.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {COHORT_CHANGES_TABLE} (
+            id INTEGER PRIMARY KEY,
+            earliest_first_event DATETIME NOT NULL
+        )
+    '''))
+    conn.execute(text(f'INSERT INTO {COHORT_CHANGES_TABLE} (earliest_first_event) VALUES (:first_event)'),
+                 {'first_event': earliest_first_event})
+
+
+def cohort_change_before(conn, first_day):
+    """
+    Id of the latest refresh in this lineage that touched an organization whose first
+    event is before `first_day` ('YYYY-MM-DD'), or 0; it changes only when such a refresh runs.
+    """
+    if not inspect(conn).has_table(COHORT_CHANGES_TABLE):
+        return 0
+    return conn.execute(text(f'''
+        SELECT COALESCE(MAX(id), 0) FROM {COHORT_CHANGES_TABLE} WHERE earliest_first_event < :first_day
+    '''), {'first_day': first_day}).scalar()
+
+
+def write_watermark(conn):
+    """Record the latest loaded event timestamp, a new build id and a new lineage id after a full build."""
+    _ensure_state_table(conn)
+    watermark = conn.execute(text(f'SELECT MAX("{TIMESTAMP_COLUMN}") FROM behavioral_events')).scalar()
+    if watermark is not None:
+        _set_state(conn, WATERMARK_KEY, watermark)
+    _set_state(conn, BATCH_KEY, 0)
+    new_lineage_id(conn)
+    new_build_id(conn)
+
+
+def source_digest(csv_path, end, digest=None, start=0):
+    """
+    blake2b of the bytes of `csv_path` before `end`. Continues `digest`, already
+    fed the bytes before `start`, so a growing source is hashed only once.
+    """
+    if digest is None:
+        digest = hashlib.blake2b(digest_size=16)
+    with open(csv_path, 'rb') as source:
+        source.seek(start)
+        while start < end:
+            block = source.read(min(HASH_BLOCK, end - start))
+            if not block:
+                break
+            digest.update(block)
+            start += len(block)
+    return digest
+
+
+def record_source(conn, csv_path, offset, digest=None):
+    """Record that the first `offset` bytes of `csv_path`, hashed by `digest` if given, are loaded."""
+    if digest is None:
+        digest = source_digest(csv_path, offset)
+    _ensure_state_table(conn)
+    _set_state(conn, SOURCE_OFFSET_KEY, offset)
+    _set_state(conn, SOURCE_DIGEST_KEY, digest.hexdigest())
+
+
+def loaded_prefix(conn, csv_path):
+    """
+    Bytes of `csv_path` already loaded and a digest of them to continue, or 0 and
+    an empty digest if the file does not start with exactly the recorded bytes.
+    """
+    offset = int(read_state(conn, SOURCE_OFFSET_KEY) or 0)
+    if offset and os.path.getsize(csv_path) >= offset:
+        digest = source_digest(csv_path, offset)
+        if digest.hexdigest() == read_state(conn, SOURCE_DIGEST_KEY):
+            return offset, digest
+    return 0, source_digest(csv_path, 0)
+
+
+def loaded_offset(conn, csv_path):
+    """Bytes of `csv_path` already loaded, or 0 if it does not start with the recorded source."""
+    return loaded_prefix(conn, csv_path)[0]
+
+
+def _loaded_at(conn, watermark, columns):
+    # Loaded events at the watermark itself, counted by their other columns
+    rows = conn.execute(text(f'''
+        SELECT {', '.join(f'"{column}"' for column in columns)}
+        FROM behavioral_events
+        WHERE "{TIMESTAMP_COLUMN}" = :watermark
+    '''), {'watermark': watermark})
+    return Counter(tuple(row) for row in rows)
+
+
+def _drop_loaded(chunk, watermark, loaded):
+    # Keep events at or after the watermark, but drop one event at the watermark
+    # per identical loaded event, so late events sharing that timestamp still get in
+    chunk = chunk[chunk[TIMESTAMP_COLUMN] >= pd.Timestamp(watermark)]
+    columns = [column for column in chunk.columns if column != TIMESTAMP_COLUMN]
+    ties = chunk[chunk[TIMESTAMP_COLUMN] == pd.Timestamp(watermark)]
+    duplicates = []
+    for index, row in zip(ties.index, ties[columns].astype(object).itertuples(index=False)):
+        row = tuple(None if pd.isna(value) else value for value in row)
+        if loaded[row]:
+            loaded[row] -= 1
+            duplicates.append(index)
+    return chunk.drop(index=duplicates)
+
+
+def create_refresh_indexes(conn):
+    # Scoped deletes and window recomputation look organizations up by key
+    # instead of scanning the full history
+    conn.execute(text('''
+        CREATE INDEX IF NOT EXISTS idx_behavioral_events_organization
+        ON behavioral_events ("ORGANIZATION_ID", "TIMESTAMP")
+    '''))
+    create_indexes(conn)
+
+
+def refresh_organizations(conn, organizations, watermark):
+    """
+    Recompute staging, org_summary, trial_goals, trial_activation and the
+    feature store for `organizations` after events for them were appended to
+    behavioral_events, and advance the watermark to `watermark` if it is later.
+    """
+    create_refresh_indexes(conn)
+    set_scope(conn, organizations)
+    refresh_scoped(conn)
+    # Late events only move first events earlier, so the recomputed rows bound every cohort touched
+    earliest = conn.execute(text(f'''
+        SELECT MIN(first_event) FROM org_summary WHERE organization_id IN (SELECT organization_id FROM {SCOPE_TABLE})
+    ''')).scalar()
+    if earliest is not None:
+        _record_cohort_change(conn, earliest)
+    if 'activated_at' in {column['name'] for column in inspect(conn).get_columns('trial_activation')}:
+        persist_activated_at(conn, scoped=True)
+    if has_features(conn):
+        update_features(conn)
+    _ensure_state_table(conn)
+    previous = read_state(conn, WATERMARK_KEY)
+    _set_state(conn, WATERMARK_KEY, max(watermark, previous or watermark))
+    new_build_id(conn)
+
+
+def refresh(engine, csv_path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Apply events appended to `csv_path` since the last build or refresh.
+
+    When `csv_path` still starts with the bytes loaded last time, only the rows
+    after them are parsed, whatever their timestamps. Otherwise the whole file is
+    read and events at or after the stored watermark are kept, less those already
+    loaded. Only organizations with new events have their staging rows and marts
+    recomputed. Returns a dict with the new row count, the number of touched
+    organizations, the new watermark and the number of loaded bytes skipped.
+    """
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        watermark = read_state(conn, WATERMARK_KEY)
+        if watermark is None:
+            raise RuntimeError('No watermark found; run a full build with db.py first')
+        batch = int(read_state(conn, BATCH_KEY) or 0) + 1
+        columns = csv_columns(csv_path)
+        offset, digest = loaded_prefix(conn, csv_path)
+        loaded = None if offset else _loaded_at(conn, watermark, [c for c in columns if c != TIMESTAMP_COLUMN])
+
+        new_rows = 0
+        latest = pd.Timestamp(watermark)
+        touched = set()
+        with open(csv_path, 'rb') as source:
+            source.seek(offset)
+            for chunk in read_chunks(source, chunksize, names=columns if offset else None):
+                if loaded is not None:
+                    chunk = _drop_loaded(chunk, watermark, loaded)
+                if chunk.empty:
+                    continue
+                insert_chunk(conn, 'behavioral_events', chunk)
+                touched.update(chunk['ORGANIZATION_ID'].unique())
+                latest = max(latest, chunk[TIMESTAMP_COLUMN].max())
+                new_rows += len(chunk)
+            end = source.tell()
+
+        if touched:
+            refresh_organizations(conn, touched, latest.strftime(SQLITE_DATETIME_FORMAT))
+        record_source(conn, csv_path, end, source_digest(csv_path, end, digest, start=offset))
+        _set_state(conn, BATCH_KEY, batch)
+
+    return {
+        'new_rows': new_rows,
+        'organizations': len(touched),
+        'watermark': latest.strftime(SQLITE_DATETIME_FORMAT),
+        'batch': batch,
+        'skipped_bytes': offset,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply newly exported events to an existing build.')
+    parser.add_argument('--source', default='trial_activation/data/analytics_engineering_task.csv',
+                        help='event CSV export')
+    parser.add_argument('--target', default='trial_activation/trial_data.db', help='SQLite database built by db.py')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help='CSV rows per chunk; bounds peak memory during the load')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(f'sqlite:///{args.target}')
+    result = refresh(engine, args.source, args.chunksize)
+    engine.dispose()
+    print(f"Incremental batch {result['batch']}: {result['new_rows']} new events, "
+          f"{result['organizations']} organizations refreshed in {result['seconds']:.2f}s "
+          f"({result['skipped_bytes']:,} loaded bytes skipped, watermark {result['watermark']})")
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import re
+import sys
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+from trial_activation.src.encoding import COMPACT_STAGING_TABLE, STAGING_TABLE, is_compact, staging_table
+from trial_activation.src.goals import GOALS
+from trial_activation.src.instrumentation import Tracer
+
+# Rows ANALYZE samples per index; bounds its cost on large tables
+ANALYSIS_LIMIT = 1000
+
+# One-row-per-organization marts that analytics aggregate in full; a scan of
+# these is the query's purpose, not a missing index
+FULL_SCAN_TABLES = ('org_summary',)
+
+
+@dataclass(frozen=True)
+class Index:
+    name: str
+    table: str
+    columns: tuple
+    # Partial index predicate
+    where: str | None = None
+
+    def create_sql(self):
+        where = f' WHERE {self.where}' if self.where else ''
+        return f'CREATE INDEX IF NOT EXISTS {self.name} ON {self.table} ({", ".join(self.columns)}){where}'
+
+
+# Created by the build after staging is loaded, never before: building an index
+# once over sorted data is far cheaper than maintaining it row by row
+INDEXES = (
+    # Covers every per-organization window and GROUP BY over staging. `id` follows
+    # `timestamp` so the (timestamp, id) window order comes straight from the index.
+    Index('idx_staging_behavioral_events_organization', STAGING_TABLE,
+          ('organization_id', 'timestamp', 'id', 'activity_name', 'activity_detail')),
+) + tuple(
+    # One partial index per goal over only its matching events; used by any query
+    # filtering with the goal's registry condition
+    Index(f'idx_staging_behavioral_events_{goal.key}', STAGING_TABLE,
+          ('organization_id', 'timestamp'), goal.condition())
+    for goal in GOALS
+)
+# The same indexes over the compact layout's integer codes and timestamps
+COMPACT_INDEXES = (
+    Index('idx_staging_events_organization', COMPACT_STAGING_TABLE,
+          ('organization_id', 'timestamp', 'id', 'activity_id', 'detail_id')),
+) + tuple(
+    Index(f'idx_staging_events_{goal.key}', COMPACT_STAGING_TABLE,
+          ('organization_id', 'timestamp'), goal.condition(compact=True))
+    for goal in GOALS
+)
+
+
+def staging_indexes(compact):
+    return COMPACT_INDEXES if compact else INDEXES
+
+
+def create_indexes(conn):
+    for index in staging_indexes(is_compact(conn)):
+        conn.execute(text(index.create_sql()))
+
+
+def build_indexes(conn):
+    """Create the staging indexes and refresh the planner statistics."""
+    create_indexes(conn)
+    conn.execute(text(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}'))
+    conn.execute(text(f'ANALYZE {staging_table(is_compact(conn))}'))
+
+
+def _aliases(statement):
+    # Plan lines name tables by their alias in the statement
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', statement, re.IGNORECASE):
+        aliases[table] = table
+        if alias and alias.upper() not in ('WHERE', 'ON', 'LEFT', 'JOIN', 'GROUP', 'ORDER', 'INNER', 'CROSS'):
+            aliases[alias] = table
+    return aliases
+
+
+def plan_violations(plans, tables, full_scan_tables=FULL_SCAN_TABLES):
+    """
+    Problems in captured EXPLAIN QUERY PLAN output (Span.plans): any temp B-tree,
+    and any scan of a table in `tables` that uses no index, except the
+    `full_scan_tables`. Returns one description per offending plan line.
+    """
+    violations = []
+    for plan in plans:
+        aliases = _aliases(plan['statement'])
+        for line in plan['plan']:
+            scan = re.fullmatch(r'SCAN (\w+)', line)
+            table = aliases.get(scan.group(1), scan.group(1)) if scan else None
+            if 'TEMP B-TREE' in line or (table in tables and table not in full_scan_tables):
+                violations.append(f'{line} in: {plan["statement"]}')
+    return violations
+
+
+def check_analytics_plans(db_path):
+    """Run every TrialAnalytics query against `db_path` and return its plan violations."""
+    # Imported here: analytics depends on incremental, which creates these indexes
+    from trial_activation.src.analytics import TrialAnalytics
+    from trial_activation.src.cohorts import COHORTS
+
+    tracer = Tracer(explain=True)
+    analytics = TrialAnalytics(db_path=str(db_path), tracer=tracer)
+    analytics.report()
+    for granularity in COHORTS:
+        analytics.cohort_metrics(granularity)
+    with analytics.engine.connect() as conn:
+        tables = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+    analytics.engine.dispose()
+    return plan_violations([plan for span in tracer.spans for plan in span.plans], tables)
+
+
+if __name__ == '__main__':
+    violations = check_analytics_plans(sys.argv[1] if len(sys.argv) > 1 else 'trial_activation/trial_data.db')
+    for violation in violations:
+        print(f'PLAN REGRESSION: {violation}')
+    print(f'{len(violations)} query plan regressions')
+    sys.exit(1 if violations else 0)
@@ -0,0 +1,134 @@
+import itertools
+import time
+from dataclasses import dataclass
+
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from sqlalchemy import text
+
+from trial_activation.src.instrumentation import PeakRss
+
+# Explicit dtypes for the raw export, so every chunk gets the same column types
+# no matter which values happen to land in it
+CSV_DTYPES = {
+    'ORGANIZATION_ID': str,
+    'ACTIVITY_NAME': str,
+    'ACTIVITY_DETAIL': str,
+}
+TIMESTAMP_COLUMN = 'TIMESTAMP'
+DEFAULT_CHUNKSIZE = 250_000
+
+# Same text layout SQLAlchemy uses when it binds a datetime for SQLite,
+# which is what DataFrame.to_sql writes into behavioral_events
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Bound parameters per prepared statement (SQLite's conservative default limit)
+MAX_VARIABLES = 999
+
+
+@dataclass
+class IngestStats:
+    rows: int
+    chunks: int
+    organizations: int
+    seconds: float
+    peak_rss_bytes: int
+    # Bytes of the CSV read, so later refreshes can skip them
+    source_bytes: int = 0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (f'{self.rows} rows in {self.chunks} chunks, {self.seconds:.2f}s '
+                f'({self.rows_per_second:,.0f} rows/s, peak RSS {self.peak_rss_bytes / 2**20:.1f} MB)')
+
+
+def csv_columns(csv_path):
+    return list(pd.read_csv(csv_path, dtype=CSV_DTYPES, nrows=0).columns)
+
+
+def read_chunks(source, chunksize=DEFAULT_CHUNKSIZE, names=None):
+    """
+    Yield the CSV as DataFrames of at most `chunksize` rows with parsed timestamps.
+
+    `source` is a path or a binary file. Given `names`, the file is read from its
+    current position, which must be the start of a data row, with those columns.
+    """
+    timestamp_format = None
+    header = {'header': None, 'names': names} if names is not None else {}
+    reader = pd.read_csv(source, dtype=CSV_DTYPES, chunksize=chunksize, **header)
+    for chunk in reader:
+        if timestamp_format is None:
+            # Infer the format once from the first value, like a whole-file
+            # pd.to_datetime would, so later chunks cannot parse differently
+            first = chunk[TIMESTAMP_COLUMN].dropna()
+            timestamp_format = guess_datetime_format(first.iloc[0]) if len(first) else None
+        chunk[TIMESTAMP_COLUMN] = pd.to_datetime(chunk[TIMESTAMP_COLUMN], format=timestamp_format)
+        chunk['ORGANIZATION_ID'] = chunk['ORGANIZATION_ID'].astype(str)
+        yield chunk
+
+
+def _to_sql_values(chunk):
+    # Mirror DataFrame.to_sql: datetimes as SQLAlchemy text, missing values as NULL
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        if chunk[column].dtype.kind == 'M':
+            chunk[column] = chunk[column].dt.strftime(SQLITE_DATETIME_FORMAT)
+    chunk = chunk.astype(object)
+    return chunk.where(chunk.notna(), None).to_numpy()
+
+
+def _multi_row_insert(table, columns, rows):
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    row = '(' + ', '.join('?' * len(columns)) + ')'
+    return f'INSERT INTO "{table}" ({column_list}) VALUES ' + ', '.join([row] * rows)
+
+
+def insert_chunk(conn, table, chunk):
+    """Insert a DataFrame chunk with prepared multi-row INSERT statements."""
+    values = _to_sql_values(chunk)
+    width = len(chunk.columns)
+    per_statement = max(1, MAX_VARIABLES // width)
+    full = len(values) // per_statement * per_statement
+
+    if full:
+        statement = _multi_row_insert(table, chunk.columns, per_statement)
+        batches = values[:full].reshape(-1, per_statement * width).tolist()
+        conn.exec_driver_sql(statement, [tuple(batch) for batch in batches])
+    if full < len(values):
+        statement = _multi_row_insert(table, chunk.columns, len(values) - full)
+        conn.exec_driver_sql(statement, tuple(itertools.chain.from_iterable(values[full:].tolist())))
+
+
+def ingest_csv(engine, csv_path, table='behavioral_events', chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Stream `csv_path` into `table`, replacing it, in one transaction.
+
+    Only one chunk is held in memory at a time; the resulting table has the same
+    schema and values as DataFrame.to_sql(if_exists='replace', index=False).
+    """
+    start = time.perf_counter()
+    rows = chunks = 0
+
+    # Sampled while the load runs, not the process's lifetime high-water mark
+    with PeakRss() as rss, engine.begin() as conn, open(csv_path, 'rb') as source:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+        for chunk in read_chunks(source, chunksize):
+            if chunks == 0:
+                conn.exec_driver_sql(pd.io.sql.get_schema(chunk, table, con=conn))
+            insert_chunk(conn, table, chunk)
+            rows += len(chunk)
+            chunks += 1
+        source_bytes = source.tell()
+        organizations = conn.execute(text(f'SELECT COUNT(DISTINCT "ORGANIZATION_ID") FROM "{table}"')).scalar()
+
+    return IngestStats(
+        rows=rows,
+        chunks=chunks,
+        organizations=organizations,
+        seconds=time.perf_counter() - start,
+        peak_rss_bytes=rss.peak,
+        source_bytes=source_bytes,
+    )
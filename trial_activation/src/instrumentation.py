@@ -0,0 +1,208 @@
+import contextlib
+import json
+import resource
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import psutil
+from sqlalchemy import event, text
+
+# Statements worth an EXPLAIN QUERY PLAN; DDL and PRAGMAs have no plan
+PLANNED_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Span fields exported as Prometheus gauges
+PROMETHEUS_METRICS = {
+    'seconds': 'Wall time of the stage or query',
+    'rows_in': 'Rows read by the stage or query',
+    'rows_out': 'Rows produced by the stage or query',
+    'peak_rss_bytes': 'Peak resident set size of the process during the stage or query',
+    'blocks_read': 'Filesystem blocks read during the stage or query (OS page cache misses)',
+    'blocks_written': 'Filesystem blocks written during the stage or query',
+}
+
+
+class PeakRss:
+    # Samples the process RSS on a background thread; resource's ru_maxrss is a
+    # lifetime high-water mark and cannot attribute peaks to a single stage
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._done = threading.Event()
+
+    def _sample(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._done.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str = 'stage'
+    seconds: float = 0.0
+    rows_in: int | None = None
+    rows_out: int | None = None
+    peak_rss_bytes: int | None = None
+    blocks_read: int | None = None
+    blocks_written: int | None = None
+    # page_size, page_count and cache_size of the connection's main database
+    sqlite: dict = field(default_factory=dict)
+    # EXPLAIN QUERY PLAN of each statement run in the span, when enabled
+    plans: list = field(default_factory=list)
+
+    def record(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def record(self, **values):
+        pass
+
+
+_NULL_SPAN = contextlib.nullcontext(_NullSpan())
+
+
+def _count_rows(conn, table):
+    return conn.execute(text(f'SELECT COUNT(*) FROM {table}')).scalar()
+
+
+def page_cache_stats(conn):
+    # Python's sqlite3 module does not expose sqlite3_db_status hit/miss
+    # counters, so report the cache's configuration against the file size
+    return {pragma: conn.execute(text(f'PRAGMA {pragma}')).scalar()
+            for pragma in ('page_size', 'page_count', 'cache_size')}
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Tracer:
+    """
+    Records wall time, rows in and out, peak RSS, block I/O and SQLite page-cache
+    figures for pipeline stages and analytics queries, and optionally the
+    EXPLAIN QUERY PLAN of every statement they run.
+
+    A disabled tracer hands out a shared no-op context and never touches the
+    engine, so instrumented code pays one attribute check per span.
+    """
+
+    def __init__(self, enabled=True, explain=False):
+        self.enabled = enabled
+        self.explain = explain
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def instrument(self, engine):
+        """Capture query plans for statements `engine` runs inside spans (when `explain` is on)."""
+        if self.enabled and self.explain and not event.contains(engine, 'before_cursor_execute', self._capture_plan):
+            event.listen(engine, 'before_cursor_execute', self._capture_plan)
+        return engine
+
+    def _capture_plan(self, conn, cursor, statement, parameters, context, executemany):
+        stack = self._stack()
+        if executemany or not stack or not statement.lstrip().upper().startswith(PLANNED_STATEMENTS):
+            return
+        statement_text = ' '.join(statement.split())
+        # Repeated statements (e.g. per-chunk inserts) are planned once per span
+        if any(plan['statement'] == statement_text for plan in stack[-1].plans):
+            return
+        try:
+            rows = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        except Exception:
+            # Statements whose tables do not exist yet cannot be planned
+            return
+        stack[-1].plans.append({'statement': statement_text, 'plan': [row[-1] for row in rows]})
+
+    def span(self, name, conn=None, kind='stage', rows_in=None, rows_out=None):
+        """
+        Context manager measuring one stage or query and yielding its Span.
+        `rows_in`/`rows_out` are counts or table names counted on `conn`; the
+        span's `record()` sets any figure from inside the block.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, conn, kind, rows_in, rows_out)
+
+    @contextlib.contextmanager
+    def _span(self, name, conn, kind, rows_in, rows_out):
+        span = Span(name, kind)
+        span.rows_in = _count_rows(conn, rows_in) if isinstance(rows_in, str) else rows_in
+        stack = self._stack()
+        stack.append(span)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            with PeakRss() as rss:
+                start = time.perf_counter()
+                yield span
+                span.seconds = time.perf_counter() - start
+        finally:
+            stack.pop()
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        span.peak_rss_bytes = rss.peak
+        span.blocks_read = after.ru_inblock - usage.ru_inblock
+        span.blocks_written = after.ru_oublock - usage.ru_oublock
+        if isinstance(rows_out, str):
+            span.rows_out = _count_rows(conn, rows_out)
+        elif rows_out is not None:
+            span.rows_out = rows_out
+        if conn is not None:
+            span.sqlite = page_cache_stats(conn)
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dicts(self):
+        return [asdict(span) for span in self.spans]
+
+    def to_json(self):
+        return json.dumps(self.to_dicts(), indent=2)
+
+    def to_prometheus(self, prefix='trial_activation'):
+        """Spans in the Prometheus text exposition format, one gauge family per figure."""
+        lines = []
+        families = dict(PROMETHEUS_METRICS, sqlite_page_count='Pages in the database file',
+                        sqlite_page_size='Database page size in bytes',
+                        sqlite_cache_size='Configured page cache size (negative: KiB)')
+        for metric, help_text in families.items():
+            name = f'{prefix}_{metric}'
+            samples = []
+            for span in self.spans:
+                value = span.sqlite.get(metric[len('sqlite_'):]) if metric.startswith('sqlite_') else getattr(span, metric)
+                if value is not None:
+                    samples.append(f'{name}{{stage="{_escape_label(span.name)}",kind="{span.kind}"}} {value}')
+            if samples:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge'] + samples
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the spans to `path`: Prometheus text for a .prom file, JSON otherwise."""
+        path = Path(path)
+        path.write_text(self.to_prometheus() if path.suffix == '.prom' else self.to_json())
+        return path
+
+
+# Default for instrumented code that was not given a tracer
+NULL_TRACER = Tracer(enabled=False)
@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.activation import add_activated_at_column, persist_activated_at
+from trial_activation.src.cohorts import create_cohort_indexes
+from trial_activation.src.encoding import ACTIVITIES_TABLE, DETAILS_TABLE, staging_columns, staging_table
+from trial_activation.src.stages import (build_org_summary, build_trial_activation, build_trial_goals,
+                                         create_org_summary_table, create_staging_table,
+                                         create_trial_activation_table, create_trial_goals_table,
+                                         insert_dimensions, insert_staging, set_scope)
+
+# Tables each shard produces, merged into the target database in this order
+SHARD_TABLES = ('staging_behavioral_events', 'org_summary', 'trial_goals', 'trial_activation')
+
+
+def shard_of(organization_id, shards):
+    # crc32 rather than hash(): it must agree across processes and runs
+    return zlib.crc32(organization_id.encode('utf-8')) % shards
+
+
+def _shard_engine(path, source_path=None):
+    def connect():
+        conn = sqlite3.connect(Path(path).absolute().as_uri(), uri=True)
+        if source_path is not None:
+            source = Path(source_path).absolute().as_uri() + '?mode=ro'
+            conn.execute('ATTACH DATABASE ? AS source', (source,))
+        return conn
+    return create_engine('sqlite://', creator=connect)
+
+
+def build_shard(shard_path, source_path, organization_bases, compact=False):
+    """
+    Worker: build staging and the marts for one shard of organizations into its own
+    SQLite file, reading behavioral_events from the source database read-only.
+
+    `organization_bases` maps each organization to the staging id its first event
+    gets in a serial build; the shard stores the offset from its local ids.
+    In the compact layout the shard codes activities and details with the
+    source's dictionaries, so merged codes agree.
+    """
+    engine = _shard_engine(shard_path, source_path)
+    with engine.begin() as conn:
+        create_staging_table(conn, compact)
+        if compact:
+            for table in (ACTIVITIES_TABLE, DETAILS_TABLE):
+                conn.execute(text(f'INSERT OR REPLACE INTO {table} SELECT * FROM source.{table}'))
+        set_scope(conn, organization_bases)
+        insert_staging(conn, scoped=True)
+        build_org_summary(conn)
+        build_trial_goals(conn)
+        build_trial_activation(conn)
+        persist_activated_at(conn)
+
+        conn.execute(text('CREATE TABLE id_bases (organization_id TEXT PRIMARY KEY, base_id INTEGER NOT NULL)'))
+        if organization_bases:
+            conn.execute(text('INSERT INTO id_bases (organization_id, base_id) VALUES (:organization_id, :base_id)'),
+                         [{'organization_id': org, 'base_id': base} for org, base in organization_bases.items()])
+        conn.execute(text(f'''
+            CREATE TABLE id_offsets AS
+            SELECT s.organization_id, b.base_id - MIN(s.id) AS id_offset
+            FROM {staging_table(compact)} s
+            JOIN id_bases b ON b.organization_id = s.organization_id
+            GROUP BY s.organization_id
+        '''))
+    engine.dispose()
+    return shard_path
+
+
+def _partition(conn, shards):
+    # Staging ids in a serial build run in (organization, timestamp) order, so each
+    # organization's first id is one plus the number of events of all smaller ids
+    counts = conn.execute(text('''
+        SELECT organization_id, COUNT(*)
+        FROM behavioral_events
+        GROUP BY organization_id
+        ORDER BY organization_id
+    ''')).fetchall()
+    partitions = [{} for _ in range(shards)]
+    next_id = 1
+    for organization_id, count in counts:
+        partitions[shard_of(organization_id, shards)][organization_id] = next_id
+        next_id += count
+    return partitions
+
+
+def _merge_shard(conn, shard_path, compact=False):
+    # ATTACH/DETACH must run outside a transaction, so each shard is committed on its own
+    conn.execute(text('ATTACH DATABASE :path AS shard'), {'path': str(shard_path)})
+    table = staging_table(compact)
+    columns = staging_columns(compact)
+    conn.execute(text(f'''
+        INSERT INTO {table} (id, {', '.join(columns)})
+        SELECT s.id + o.id_offset, {', '.join(f's.{column}' for column in columns)}
+        FROM shard.{table} s
+        JOIN shard.id_offsets o ON o.organization_id = s.organization_id
+    '''))
+    for table in SHARD_TABLES[1:]:
+        conn.execute(text(f'INSERT INTO {table} SELECT * FROM shard.{table}'))
+    conn.commit()
+    conn.execute(text('DETACH DATABASE shard'))
+
+
+def build_parallel(engine, db_path, workers=None, shards=None, compact=False):
+    """
+    Build staging, org_summary, trial_goals and trial_activation (with activated_at)
+    from behavioral_events in `db_path` by hash-partitioning organizations into
+    `shards` and building each shard in a process pool of `workers`.
+    The merged tables hold the same rows, including staging ids, as the serial build.
+    """
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+    with engine.connect() as conn:
+        partitions = _partition(conn, shards)
+        # Staging, and in the compact layout its dictionaries, exist before the
+        # workers start so every shard reads the same codes
+        create_staging_table(conn, compact)
+        if compact:
+            insert_dimensions(conn)
+        conn.commit()
+
+    with tempfile.TemporaryDirectory(dir=Path(db_path).absolute().parent) as shard_dir:
+        shard_paths = [Path(shard_dir) / f'shard_{i}.db' for i in range(shards)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(build_shard, shard_paths, [db_path] * shards, partitions, [compact] * shards))
+
+        # ATTACH is limited to a handful of databases per connection, so merge one shard at a time
+        with engine.connect() as conn:
+            create_org_summary_table(conn)
+            create_trial_goals_table(conn)
+            create_trial_activation_table(conn)
+            add_activated_at_column(conn)
+            conn.commit()
+            for shard_path in shard_paths:
+                _merge_shard(conn, shard_path, compact)
+            create_cohort_indexes(conn)
+            conn.commit()
@@ -0,0 +1,216 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.encoding import (ACTIVITIES_TABLE, COMPACT_STAGING_TABLE, DETAILS_TABLE, STAGING_TABLE,
+                                           is_compact, text_to_epoch_ms)
+from trial_activation.src.incremental import BUILD_KEY, read_state
+
+# Columnar copy of staging_behavioral_events: one .npy file per column plus a
+# manifest, next to the database. Rows are ordered by (organization, timestamp,
+# id), so each organization's events are one contiguous range.
+SNAPSHOT_SUFFIX = '.snapshot'
+MANIFEST = 'manifest.json'
+OFFSETS = 'organization_offsets.npy'
+# Rows read from SQLite per batch while exporting
+EXPORT_CHUNKSIZE = 100_000
+
+# Column layouts: int64 values, dictionary codes into the manifest's
+# categories (-1 for NULL), or int64 nanoseconds since the epoch
+NUMERIC = 'numeric'
+CATEGORY = 'category'
+DATETIME = 'datetime'
+COLUMNS = {
+    'id': NUMERIC,
+    'organization_id': CATEGORY,
+    'activity_name': CATEGORY,
+    'activity_detail': CATEGORY,
+    'timestamp': DATETIME,
+    'first_activity_timestamp': DATETIME,
+    'time_since_first_activity': NUMERIC,
+}
+
+
+def snapshot_path(db_path):
+    return Path(db_path).with_suffix(SNAPSHOT_SUFFIX)
+
+
+def database_version(conn, db_path):
+    # Same token result caches use: the build id, which the load, every writing
+    # build stage and every refresh replace, or the file's modification time for
+    # databases built before it existed
+    build_id = read_state(conn, BUILD_KEY)
+    return build_id if build_id is not None else str(os.stat(db_path).st_mtime_ns)
+
+
+def _codes_dtype(categories):
+    # The smallest type pandas itself would use, so loading needs no conversion
+    for dtype in (np.int8, np.int16, np.int32):
+        if len(categories) < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _export_query(compact):
+    # Timestamps leave SQLite as integer milliseconds in both layouts; no Python parsing
+    if compact:
+        return f'''
+            SELECT s.id, s.organization_id, a.name AS activity_name, d.name AS activity_detail,
+                   s.timestamp, s.first_activity_timestamp, s.time_since_first_activity
+            FROM {COMPACT_STAGING_TABLE} s
+            LEFT JOIN {ACTIVITIES_TABLE} a ON a.id = s.activity_id
+            LEFT JOIN {DETAILS_TABLE} d ON d.id = s.detail_id
+            ORDER BY s.organization_id, s.timestamp, s.id
+        '''
+    return f'''
+        SELECT s.id, s.organization_id, s.activity_name, s.activity_detail,
+               {text_to_epoch_ms('s.timestamp')} AS timestamp,
+               {text_to_epoch_ms('s.first_activity_timestamp')} AS first_activity_timestamp,
+               s.time_since_first_activity
+        FROM {STAGING_TABLE} s
+        ORDER BY s.organization_id, s.timestamp, s.id
+    '''
+
+
+def write_snapshot(conn, db_path, path=None):
+    """
+    Export staging from `conn` (the database at `db_path`) to a columnar snapshot
+    at `path` (default: next to the database). The previous snapshot is replaced
+    only once the new one is complete.
+    """
+    path = Path(path or snapshot_path(db_path))
+    rows = conn.execute(text(f'SELECT COUNT(*) FROM {STAGING_TABLE}')).scalar()
+    organizations = conn.execute(text(f'''
+        SELECT organization_id, COUNT(*)
+        FROM {STAGING_TABLE}
+        GROUP BY organization_id
+        ORDER BY organization_id
+    ''')).fetchall()
+    categories = {'organization_id': [organization for organization, _ in organizations]}
+    for column in ('activity_name', 'activity_detail'):
+        categories[column] = list(conn.execute(text(
+            f'SELECT DISTINCT {column} FROM {STAGING_TABLE} WHERE {column} IS NOT NULL ORDER BY {column}'
+        )).scalars())
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    staging_dir = Path(tempfile.mkdtemp(prefix=f'{path.name}.', dir=path.parent))
+    try:
+        arrays = {}
+        for column, kind in COLUMNS.items():
+            dtype = _codes_dtype(categories[column]) if kind == CATEGORY else np.int64
+            arrays[column] = np.lib.format.open_memmap(staging_dir / f'{column}.npy', mode='w+',
+                                                       dtype=dtype, shape=(rows,))
+        start = 0
+        for chunk in pd.read_sql(text(_export_query(is_compact(conn))), conn, chunksize=EXPORT_CHUNKSIZE):
+            end = start + len(chunk)
+            for column, kind in COLUMNS.items():
+                if kind == CATEGORY:
+                    values = pd.Categorical(chunk[column], categories=categories[column]).codes
+                elif kind == DATETIME:
+                    values = chunk[column].to_numpy(np.int64) * 1_000_000
+                else:
+                    values = chunk[column].to_numpy(np.int64)
+                arrays[column][start:end] = values
+            start = end
+        for array in arrays.values():
+            array.flush()
+        del arrays
+
+        counts = np.array([count for _, count in organizations], dtype=np.int64)
+        np.save(staging_dir / OFFSETS, np.concatenate([[0], np.cumsum(counts)]))
+        manifest = {
+            'version': database_version(conn, db_path),
+            'rows': rows,
+            'columns': COLUMNS,
+            'categories': categories,
+        }
+        (staging_dir / MANIFEST).write_text(json.dumps(manifest))
+
+        # Readers holding maps of the old files keep them until they close
+        if path.exists():
+            retired = Path(tempfile.mkdtemp(prefix=f'{path.name}.old.', dir=path.parent))
+            os.replace(path, retired / path.name)
+            os.replace(staging_dir, path)
+            shutil.rmtree(retired)
+        else:
+            os.replace(staging_dir, path)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return path
+
+
+def export_snapshot(conn):
+    """Build stage: write the snapshot of the database `conn` is connected to."""
+    db_path = next(row[2] for row in conn.execute(text('PRAGMA database_list')) if row[1] == 'main')
+    write_snapshot(conn, db_path)
+
+
+def _read_manifest(path):
+    try:
+        return json.loads((Path(path) / MANIFEST).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def ensure_snapshot(db_path, path=None):
+    """Return the snapshot path for `db_path`, rebuilding it if the database has changed since."""
+    path = Path(path or snapshot_path(db_path))
+    manifest = _read_manifest(path)
+    engine = create_engine(f'sqlite:///{db_path}')
+    with engine.connect() as conn:
+        if manifest is None or manifest['version'] != database_version(conn, db_path):
+            write_snapshot(conn, db_path, path)
+    engine.dispose()
+    return path
+
+
+def _organization_rows(path, manifest, organizations):
+    # Row ranges are contiguous per organization; one organization stays a view
+    offsets = np.load(Path(path) / OFFSETS)
+    positions = pd.Index(manifest['categories']['organization_id']).get_indexer(list(organizations))
+    positions = np.sort(positions[positions >= 0])
+    if len(positions) == 1:
+        return slice(offsets[positions[0]], offsets[positions[0] + 1])
+    return np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in positions] or [np.array([], np.int64)])
+
+
+def load_snapshot(db_path, columns=None, organizations=None, path=None):
+    """
+    Staging as a DataFrame memory-mapped from the columnar snapshot of `db_path`,
+    rebuilt first if the database changed. Column data is not copied: categorical
+    columns wrap the stored codes and timestamps are datetime64[ns] views.
+
+    `columns` limits the files opened; `organizations` limits rows to those
+    organizations (a copy of just their rows unless there is only one).
+    """
+    path = ensure_snapshot(db_path, path)
+    manifest = _read_manifest(path)
+    columns = list(columns or COLUMNS)
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f'Unknown snapshot columns: {", ".join(sorted(unknown))}')
+    rows = slice(None) if organizations is None else _organization_rows(path, manifest, organizations)
+
+    data = {}
+    for column in columns:
+        values = np.load(path / f'{column}.npy', mmap_mode='r')[rows]
+        kind = manifest['columns'][column]
+        if kind == CATEGORY:
+            categories = pd.Index(manifest['categories'][column], dtype=object)
+            values = pd.Categorical.from_codes(values, categories=categories, validate=False)
+        elif kind == DATETIME:
+            values = values.view('datetime64[ns]')
+        data[column] = pd.Series(values, copy=False)
+    return pd.DataFrame(data, copy=False)
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'trial_activation/trial_data.db'
+    print(f'Snapshot written to {ensure_snapshot(db_path)}')
@@ -0,0 +1,282 @@
+from dataclasses import replace
+
+from sqlalchemy import text
+
+from trial_activation.src.cohorts import COHORTS, create_cohort_indexes
+from trial_activation.src.encoding import (ACTIVITIES_TABLE, COMPACT_STAGING_COLUMNS, COMPACT_STAGING_TABLE,
+                                           DETAILS_TABLE, STAGING_COLUMNS, STAGING_TABLE, epoch_ms_to_text, is_compact,
+                                           staging_table, text_to_epoch_ms)
+from trial_activation.src.goals import (ACTIVITY_CODES, DETAIL_CODES, GOALS, GOALS_BY_KEY, all_goals_completed,
+                                        detail_flag_column, goal_aggregates_query)
+from trial_activation.src.indexes import create_indexes
+
+# Temporary table holding the organizations a stage should be limited to.
+# Stages run over every organization when no scope is given.
+SCOPE_TABLE = 'scope_organizations'
+
+
+def _scope_filter(scoped, keyword='WHERE'):
+    return f'{keyword} organization_id IN (SELECT organization_id FROM {SCOPE_TABLE})' if scoped else ''
+
+
+def set_scope(conn, organization_ids):
+    """Limit scoped stage runs on `conn` to the given organizations."""
+    conn.execute(text(f'DROP TABLE IF EXISTS temp.{SCOPE_TABLE}'))
+    conn.execute(text(f'CREATE TEMP TABLE {SCOPE_TABLE} (organization_id TEXT PRIMARY KEY)'))
+    rows = [{'organization_id': org} for org in organization_ids]
+    if rows:
+        conn.execute(text(f'INSERT OR IGNORE INTO {SCOPE_TABLE} (organization_id) VALUES (:organization_id)'), rows)
+
+
+# Step 1: Staging Layer
+def _drop_staging(conn):
+    # Either layout may be in place from an earlier build. Qualified with main:
+    # shard builds attach a source database holding the same tables.
+    if is_compact(conn):
+        conn.execute(text(f'DROP VIEW main.{STAGING_TABLE}'))
+    conn.execute(text(f'DROP TABLE IF EXISTS main.{STAGING_TABLE}'))
+    for table in (COMPACT_STAGING_TABLE, ACTIVITIES_TABLE, DETAILS_TABLE):
+        conn.execute(text(f'DROP TABLE IF EXISTS main.{table}'))
+
+
+def _create_dimension_tables(conn):
+    # Registry activities and details get their fixed codes; others are appended on load
+    for table, codes in ((ACTIVITIES_TABLE, ACTIVITY_CODES), (DETAILS_TABLE, DETAIL_CODES)):
+        conn.execute(text(f'''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+        '''))
+        conn.execute(text(f'INSERT INTO {table} (id, name) VALUES (:id, :name)'),
+                     [{'id': code, 'name': name} for name, code in codes.items()])
+
+
+def create_staging_table(conn, compact=False):
+    _drop_staging(conn)
+    if not compact:
+        conn.execute(text('''
+            CREATE TABLE staging_behavioral_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                organization_id TEXT NOT NULL,
+                activity_name TEXT,
+                activity_detail TEXT,
+                timestamp DATETIME NOT NULL,
+                first_activity_timestamp DATETIME NOT NULL,
+                time_since_first_activity INTEGER
+            )
+        '''))
+        return
+
+    _create_dimension_tables(conn)
+    conn.execute(text(f'''
+        CREATE TABLE {COMPACT_STAGING_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            organization_id TEXT NOT NULL,
+            activity_id INTEGER REFERENCES {ACTIVITIES_TABLE}(id),
+            detail_id INTEGER REFERENCES {DETAILS_TABLE}(id),
+            timestamp INTEGER NOT NULL,
+            first_activity_timestamp INTEGER NOT NULL,
+            time_since_first_activity INTEGER
+        )
+    '''))
+    # The readable shape every reader of staging_behavioral_events expects
+    conn.execute(text(f'''
+        CREATE VIEW {STAGING_TABLE} AS
+        SELECT
+            s.id,
+            s.organization_id,
+            a.name AS activity_name,
+            d.name AS activity_detail,
+            {epoch_ms_to_text('s.timestamp')} AS timestamp,
+            {epoch_ms_to_text('s.first_activity_timestamp')} AS first_activity_timestamp,
+            s.time_since_first_activity
+        FROM {COMPACT_STAGING_TABLE} s
+        LEFT JOIN {ACTIVITIES_TABLE} a ON a.id = s.activity_id
+        LEFT JOIN {DETAILS_TABLE} d ON d.id = s.detail_id
+    '''))
+
+
+def insert_dimensions(conn, scoped=False):
+    # New names get the next free codes, in name order so every build agrees
+    for table, column in ((ACTIVITIES_TABLE, 'activity_name'), (DETAILS_TABLE, 'activity_detail')):
+        conn.execute(text(f'''
+            INSERT OR IGNORE INTO {table} (name)
+            SELECT DISTINCT {column}
+            FROM behavioral_events
+            WHERE {column} IS NOT NULL
+              {_scope_filter(scoped, 'AND')}
+            ORDER BY {column}
+        '''))
+
+
+def insert_staging(conn, scoped=False):
+    # Ids follow (organization, timestamp, load order), the order the window already
+    # sorts in, so they are deterministic and a sharded build can reproduce them.
+    # Offsets are exact integer seconds, in both layouts.
+    if not is_compact(conn):
+        conn.execute(text(f'''
+            INSERT INTO staging_behavioral_events ({', '.join(STAGING_COLUMNS)})
+            SELECT
+                organization_id,
+                activity_name,
+                activity_detail,
+                timestamp,
+                FIRST_VALUE(timestamp) OVER events AS first_activity_timestamp,
+                ({text_to_epoch_ms('timestamp')} - {text_to_epoch_ms('FIRST_VALUE(timestamp) OVER events')}) / 1000 AS time_since_first_activity
+            FROM behavioral_events
+            {_scope_filter(scoped)}
+            WINDOW events AS (PARTITION BY organization_id ORDER BY timestamp, rowid)
+            ORDER BY organization_id, timestamp, rowid
+        '''))
+        return
+
+    insert_dimensions(conn, scoped)
+    conn.execute(text(f'''
+        INSERT INTO {COMPACT_STAGING_TABLE} ({', '.join(COMPACT_STAGING_COLUMNS)})
+        SELECT
+            e.organization_id,
+            a.id,
+            d.id,
+            e.timestamp,
+            FIRST_VALUE(e.timestamp) OVER events AS first_activity_timestamp,
+            (e.timestamp - FIRST_VALUE(e.timestamp) OVER events) / 1000 AS time_since_first_activity
+        FROM (
+            SELECT rowid AS event_order, organization_id, activity_name, activity_detail,
+                   {text_to_epoch_ms('timestamp')} AS timestamp
+            FROM behavioral_events
+            {_scope_filter(scoped)}
+        ) e
+        LEFT JOIN {ACTIVITIES_TABLE} a ON a.name = e.activity_name
+        LEFT JOIN {DETAILS_TABLE} d ON d.name = e.activity_detail
+        WINDOW events AS (PARTITION BY e.organization_id ORDER BY e.timestamp, e.event_order)
+        ORDER BY e.organization_id, e.timestamp, e.event_order
+    '''))
+
+
+def build_staging(conn, compact=False):
+    create_staging_table(conn, compact)
+    insert_staging(conn)
+
+
+# Step 2: Organization Summary Mart - one row per organization, built in a single scan of staging
+ADVANCED_FEATURES = GOALS_BY_KEY['advanced_features']
+
+
+def _org_summary_columns(compact=False):
+    # Compact staging aggregates integers; only the per-organization result is formatted
+    first_event, last_event = ('MIN(timestamp)', 'MAX(timestamp)') if not compact else (
+        epoch_ms_to_text('MIN(timestamp)'), epoch_ms_to_text('MAX(timestamp)'))
+    columns = [
+        ('first_event', 'DATETIME NOT NULL', first_event),
+        ('last_event', 'DATETIME NOT NULL', last_event),
+        ('event_count', 'INTEGER NOT NULL', 'COUNT(*)'),
+    ]
+    # Signup cohort keys, so cohort analytics group by a stored column
+    columns += [(cohort.column, 'TEXT NOT NULL', cohort.key_sql(first_event)) for cohort in COHORTS.values()]
+    for page in ADVANCED_FEATURES.details:
+        condition = replace(ADVANCED_FEATURES, details=(page,)).condition(compact=compact)
+        columns.append((detail_flag_column(page), 'BOOLEAN NOT NULL', f'MAX(CASE WHEN {condition} THEN 1 ELSE 0 END)'))
+    return columns
+
+
+def create_org_summary_table(conn):
+    conn.execute(text('DROP TABLE IF EXISTS main.org_summary'))
+    columns = [(name, sql_type) for name, sql_type, _ in _org_summary_columns()]
+    for goal in GOALS:
+        columns += [
+            (f'{goal.key}_count', 'INTEGER NOT NULL'),
+            (f'{goal.key}_first_offset', 'INTEGER'),
+            (f'{goal.key}_achieved_offset', 'INTEGER'),
+            (goal.column, 'BOOLEAN NOT NULL'),
+        ]
+    columns.append(('activated', 'BOOLEAN NOT NULL'))
+    definitions = ''.join(f',\n            {name} {sql_type}' for name, sql_type in columns)
+    conn.execute(text(f'''
+        CREATE TABLE org_summary (
+            organization_id TEXT PRIMARY KEY{definitions}
+        )
+    '''))
+
+
+def insert_org_summary(conn, scoped=False):
+    compact = is_compact(conn)
+    extra_columns = [f'{expression} AS {name}' for name, _, expression in _org_summary_columns(compact)]
+    conn.execute(text(f'''
+        INSERT OR REPLACE INTO org_summary
+        SELECT
+            aggregates.*,
+            CASE WHEN {all_goals_completed()} THEN 1 ELSE 0 END AS activated
+        FROM ({goal_aggregates_query(_scope_filter(scoped), extra_columns, compact)}) AS aggregates
+    '''))
+
+
+def build_org_summary(conn):
+    # Achieved offsets seek into the per-goal indexes; a no-op after the indexes stage
+    create_indexes(conn)
+    create_org_summary_table(conn)
+    insert_org_summary(conn)
+    create_cohort_indexes(conn)
+
+
+# Step 3: Trial Goals Mart
+def create_trial_goals_table(conn):
+    conn.execute(text('DROP TABLE IF EXISTS main.trial_goals'))
+    flags = ''.join(f',\n            {goal.column} BOOLEAN NOT NULL' for goal in GOALS)
+    conn.execute(text(f'''
+        CREATE TABLE trial_goals (
+            organization_id TEXT PRIMARY KEY{flags}
+        )
+    '''))
+
+
+def insert_trial_goals(conn, scoped=False):
+    # Flags are already in org_summary, so this reads one row per organization.
+    # INSERT OR REPLACE doubles as the upsert for scoped (incremental) runs
+    flags = ', '.join(goal.column for goal in GOALS)
+    conn.execute(text(f'''
+        INSERT OR REPLACE INTO trial_goals (organization_id, {flags})
+        SELECT organization_id, {flags}
+        FROM org_summary
+        {_scope_filter(scoped)}
+    '''))
+
+
+def build_trial_goals(conn):
+    create_trial_goals_table(conn)
+    insert_trial_goals(conn)
+
+
+# Step 4: Trial Activation Mart
+def create_trial_activation_table(conn):
+    conn.execute(text('DROP TABLE IF EXISTS main.trial_activation'))
+    conn.execute(text('''
+        CREATE TABLE trial_activation (
+            organization_id TEXT PRIMARY KEY
+        )
+    '''))
+
+
+def insert_trial_activation(conn, scoped=False):
+    conn.execute(text(f'''
+        INSERT OR IGNORE INTO trial_activation (organization_id)
+        SELECT organization_id
+        FROM trial_goals
+        WHERE {all_goals_completed()}
+          {_scope_filter(scoped, 'AND')}
+    '''))
+
+
+def build_trial_activation(conn):
+    create_trial_activation_table(conn)
+    insert_trial_activation(conn)
+
+
+def refresh_scoped(conn):
+    """Recompute staging, org_summary, trial_goals and trial_activation for the scoped organizations only."""
+    for table in (staging_table(is_compact(conn)), 'trial_activation'):
+        conn.execute(text(f'DELETE FROM {table} {_scope_filter(True)}'))
+    insert_staging(conn, scoped=True)
+    insert_org_summary(conn, scoped=True)
+    insert_trial_goals(conn, scoped=True)
+    insert_trial_activation(conn, scoped=True)
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import csv
+import inspect as pyinspect
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+from trial_activation.src.activation import add_activated_at_column
+from trial_activation.src.goals import GOALS
+from trial_activation.src.incremental import (loaded_offset, record_source, refresh_organizations, source_digest,
+                                              write_watermark)
+from trial_activation.src.ingest import SQLITE_DATETIME_FORMAT, TIMESTAMP_COLUMN, insert_chunk
+from trial_activation.src.stages import build_org_summary, build_staging, build_trial_activation, build_trial_goals
+
+DEFAULT_CHECKPOINT_EVENTS = 10_000
+# Organizations kept in memory; older ones are reloaded from org_summary when seen again
+DEFAULT_MAX_ORGANIZATIONS = 1_000_000
+
+EPOCH = datetime(1970, 1, 1)
+MIN_COUNTS = tuple(goal.min_count for goal in GOALS)
+EVENT_COLUMNS = ['ORGANIZATION_ID', 'ACTIVITY_NAME', 'ACTIVITY_DETAIL', TIMESTAMP_COLUMN]
+
+
+def _goals_by_activity():
+    # activity name -> (goal index, accepted details or None) for every goal it counts towards
+    goals = {}
+    for index, goal in enumerate(GOALS):
+        details = frozenset(goal.details) if goal.details is not None else None
+        goals.setdefault(goal.activity_name, []).append((index, details))
+    return goals
+
+
+GOALS_BY_ACTIVITY = _goals_by_activity()
+
+
+@dataclass(frozen=True)
+class Event:
+    organization_id: str
+    activity_name: str
+    activity_detail: str | None
+    timestamp_us: int
+
+    @classmethod
+    def from_row(cls, organization_id, activity_name, activity_detail, timestamp):
+        """An event from export values; `timestamp` may be text, a datetime or a pandas Timestamp."""
+        detail = activity_detail if isinstance(activity_detail, str) and activity_detail else None
+        return cls(str(organization_id), activity_name, detail, pd.Timestamp(timestamp).value // 1000)
+
+
+@dataclass(frozen=True)
+class Activation:
+    organization_id: str
+    activated_at: str
+
+
+class OrgState:
+    """Everything the tracker keeps per organization; goal counts stop at each goal's min_count."""
+    __slots__ = ('counts', 'activated')
+
+    def __init__(self, counts=None, activated=False):
+        self.counts = bytearray(counts or len(GOALS))
+        self.activated = activated
+
+
+def format_us(timestamp_us):
+    return (EPOCH + timedelta(microseconds=timestamp_us)).strftime(SQLITE_DATETIME_FORMAT)
+
+
+def create_empty_build(conn):
+    """Create an empty behavioral_events table and build staging and the marts over it."""
+    empty = pd.DataFrame({column: pd.Series(dtype=object) for column in EVENT_COLUMNS[:-1]})
+    empty[TIMESTAMP_COLUMN] = pd.Series(dtype='datetime64[ns]')
+    conn.exec_driver_sql(pd.io.sql.get_schema(empty, 'behavioral_events', con=conn))
+    build_staging(conn)
+    build_org_summary(conn)
+    build_trial_goals(conn)
+    build_trial_activation(conn)
+    add_activated_at_column(conn)
+    write_watermark(conn)
+
+
+class ActivationTracker:
+    """
+    Applies events one at a time to per-organization goal counters and reports
+    the event at which an organization first meets every trial_goals criterion.
+
+    Each event touches only its organization's in-memory state, so its cost does
+    not depend on history. Every `checkpoint_events` events the buffered events
+    are appended to behavioral_events and the organizations they touched are
+    recomputed like an incremental refresh, so staging, org_summary, the marts
+    and the analytics built on them match a batch build. At most
+    `max_organizations` states stay in memory; others start from org_summary,
+    so events should be those after the build's watermark. An engine without
+    a build gets an empty one. Checkpoints of events read by tail_csv also record
+    how far into the CSV they are loaded, like a refresh, so a refresh or a later
+    tail of the same file starts after them.
+    """
+
+    def __init__(self, engine, checkpoint_events=DEFAULT_CHECKPOINT_EVENTS,
+                 max_organizations=DEFAULT_MAX_ORGANIZATIONS):
+        self.engine = engine
+        self.checkpoint_events = checkpoint_events
+        self.max_organizations = max_organizations
+        self.events = 0
+        self._states = OrderedDict()
+        self._pending = []
+        # CSV the pending events were read from: path, end of the lines read, and a
+        # digest of the file up to `_source_hashed`, recorded like a refresh's
+        self._source_path = None
+        self._source_end = 0
+        self._source_hashed = 0
+        self._source_digest = None
+        self._conn = engine.connect()
+        if not inspect(self._conn).has_table('behavioral_events'):
+            create_empty_build(self._conn)
+            self._conn.commit()
+
+    def _load(self, organization_id):
+        counts = ', '.join(f'{goal.key}_count' for goal in GOALS)
+        row = self._conn.execute(text(f'''
+            SELECT {counts}, activated FROM org_summary WHERE organization_id = :organization_id
+        '''), {'organization_id': organization_id}).fetchone()
+        if row is None:
+            return OrgState()
+        counts = [min(count, minimum) for count, minimum in zip(row[:-1], MIN_COUNTS)]
+        return OrgState(counts, bool(row[-1]))
+
+    def state(self, organization_id):
+        state = self._states.get(organization_id)
+        if state is None:
+            state = self._states[organization_id] = self._load(organization_id)
+        else:
+            self._states.move_to_end(organization_id)
+        return state
+
+    def process(self, event):
+        """Apply one Event; returns an Activation if it completed the organization's goals."""
+        state = self.state(event.organization_id)
+        self._pending.append(event)
+        self.events += 1
+
+        counts = state.counts
+        for index, details in GOALS_BY_ACTIVITY.get(event.activity_name, ()):
+            if counts[index] < MIN_COUNTS[index] and (details is None or event.activity_detail in details):
+                counts[index] += 1
+        if not state.activated and all(count >= minimum for count, minimum in zip(counts, MIN_COUNTS)):
+            state.activated = True
+            return Activation(event.organization_id, format_us(event.timestamp_us))
+        return None
+
+    def process_batch(self, events):
+        """Apply a micro-batch in order, checkpointing when due; returns its activations."""
+        activations = [activation for activation in map(self.process, events) if activation is not None]
+        if len(self._pending) >= self.checkpoint_events:
+            self.checkpoint()
+        return activations
+
+    def _read_from(self, batch):
+        # Called before a CsvBatch is applied, so the recorded end covers only applied events
+        if batch.path != self._source_path:
+            self._source_path = batch.path
+            self._source_digest = source_digest(batch.path, batch.start)
+            self._source_hashed = batch.start
+        self._source_end = batch.end
+
+    def checkpoint(self):
+        """Append buffered events and refresh the organizations they touched in one transaction, then trim memory."""
+        if self._pending:
+            events = pd.DataFrame(
+                [(event.organization_id, event.activity_name, event.activity_detail, event.timestamp_us)
+                 for event in self._pending],
+                columns=EVENT_COLUMNS,
+            )
+            events[TIMESTAMP_COLUMN] = pd.to_datetime(events[TIMESTAMP_COLUMN], unit='us')
+            insert_chunk(self._conn, 'behavioral_events', events)
+            refresh_organizations(self._conn, set(events['ORGANIZATION_ID']),
+                                  events[TIMESTAMP_COLUMN].max().strftime(SQLITE_DATETIME_FORMAT))
+            if self._source_path is not None:
+                # A refresh or a later tail of the same file skips what is now loaded
+                source_digest(self._source_path, self._source_end, self._source_digest, start=self._source_hashed)
+                self._source_hashed = self._source_end
+                record_source(self._conn, self._source_path, self._source_end, self._source_digest)
+            self._conn.commit()
+            self._pending.clear()
+        while len(self._states) > self.max_organizations:
+            self._states.popitem(last=False)
+
+    async def run(self, source, on_activation=None):
+        """
+        Consume an async iterable of Events or lists of Events, calling
+        `on_activation` (a function or coroutine function) for each activation.
+        Checkpoints when the source is exhausted.
+        """
+        async for item in source:
+            if isinstance(item, CsvBatch):
+                self._read_from(item)
+            for activation in self.process_batch(item if isinstance(item, list) else [item]):
+                if on_activation is not None:
+                    result = on_activation(activation)
+                    if pyinspect.isawaitable(result):
+                        await result
+        self.checkpoint()
+
+    def close(self):
+        self.checkpoint()
+        self._conn.close()
+
+
+class CsvBatch(list):
+    """Events read from a CSV, with the byte range [start, end) of the lines holding them."""
+
+    def __init__(self, events, path, start, end):
+        super().__init__(events)
+        self.path = path
+        self.start = start
+        self.end = end
+
+
+async def tail_csv(path, follow=True, poll_interval=1.0, batch_size=1000, offset=0):
+    """
+    Yield CsvBatches of Events from an export-format CSV as lines are appended to it,
+    starting at byte `offset` (a line start after the header; 0 reads from the top).
+    Stops at the end of the file unless `follow`; a partial last line waits for its newline.
+    """
+    with open(path, 'rb') as file:
+        header = None
+        if offset:
+            header = [column.upper() for column in next(csv.reader([file.readline().decode()]))]
+            file.seek(max(offset, file.tell()))
+        position = file.tell()
+        pending = b''
+        while True:
+            lines = file.readlines(batch_size * 128)
+            if not lines:
+                if follow:
+                    await asyncio.sleep(poll_interval)
+                    continue
+                if not pending:
+                    return
+                # The file ended without a final newline
+                lines, pending = [pending], b''
+            else:
+                lines[0] = pending + lines[0]
+                pending = b'' if lines[-1].endswith(b'\n') or not follow else lines.pop()
+            start, position = position, file.tell() - len(pending)
+            rows = list(csv.reader(line.decode() for line in lines))
+            if header is None and rows:
+                header = [column.upper() for column in rows.pop(0)]
+            events = [Event.from_row(*(dict(zip(header, row))[column] for column in
+                                       ('ORGANIZATION_ID', 'ACTIVITY_NAME', 'ACTIVITY_DETAIL', 'TIMESTAMP')))
+                      for row in rows if row]
+            if events:
+                yield CsvBatch(events, path, start, position)
+
+
+async def queue_events(queue):
+    """Yield items put on an asyncio.Queue (Events or lists of Events) until None is put."""
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        yield item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Track trial activation from a growing event CSV.')
+    parser.add_argument('source', help='export-format CSV to tail')
+    parser.add_argument('--target', default='trial_activation/trial_data.db')
+    parser.add_argument('--checkpoint-events', type=int, default=DEFAULT_CHECKPOINT_EVENTS)
+    parser.add_argument('--no-follow', action='store_true', help='stop at the end of the file')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(f'sqlite:///{args.target}')
+    tracker = ActivationTracker(engine, args.checkpoint_events)
+    # Resume after the bytes a build, refresh or earlier tail already loaded from this file
+    with engine.connect() as conn:
+        offset = loaded_offset(conn, args.source)
+
+    def report(activation):
+        print(f'ACTIVATED {activation.organization_id} at {activation.activated_at}', flush=True)
+
+    try:
+        asyncio.run(tracker.run(tail_csv(args.source, follow=not args.no_follow, offset=offset), report))
+    finally:
+        tracker.close()
+
+
+if __name__ == '__main__':
+    main()
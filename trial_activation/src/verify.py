@@ -0,0 +1,200 @@
+import hashlib
+import sys
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import create_engine, inspect, text
+
+from trial_activation.src.encoding import (ACTIVITIES_TABLE, COMPACT_STAGING_TABLE, DETAILS_TABLE, STAGING_TABLE,
+                                           epoch_ms_to_text, is_compact)
+from trial_activation.src.goals import GOALS
+
+# Columns whose NULLs make an event unusable
+CRITICAL_COLUMNS = ('organization_id', 'activity_name', 'timestamp')
+# Fingerprints are sums of per-organization hashes, modulo 2**64, so they do
+# not depend on the order organizations come back in
+FINGERPRINT_MODULUS = 1 << 64
+# Tables a finished build must have for its invariants to be checked at all
+REQUIRED_TABLES = ('behavioral_events', STAGING_TABLE, 'trial_goals')
+
+
+@dataclass
+class TableProfile:
+    table: str
+    rows: int = 0
+    organizations: int = 0
+    nulls: dict = field(default_factory=dict)
+    first_timestamp: str | None = None
+    last_timestamp: str | None = None
+    # Events whose activity name or detail holds a ';' (several values in one field)
+    non_atomic: int = 0
+    # trial_goals flags that are neither 0 nor 1
+    invalid_flags: int = 0
+    # Per-organization (id, event count, first and last timestamp)
+    events_fingerprint: int | None = None
+    # Per-organization (id, goal flags)
+    goals_fingerprint: int | None = None
+    seconds: float = 0.0
+
+
+@dataclass
+class VerificationReport:
+    tables: dict
+    problems: list
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def __str__(self):
+        lines = []
+        for profile in self.tables.values():
+            nulls = ', '.join(f'{column} {count}' for column, count in profile.nulls.items() if count)
+            lines.append(f'{profile.table}: {profile.rows} rows, {profile.organizations} organizations'
+                         + (f', {profile.first_timestamp} to {profile.last_timestamp}' if profile.first_timestamp else '')
+                         + (f', nulls: {nulls}' if nulls else '') + f' ({profile.seconds:.2f}s)')
+        lines += [f'PROBLEM: {problem}' for problem in self.problems] or ['All checks passed']
+        return '\n'.join(lines)
+
+
+def _fingerprint(half, *values):
+    # One 32-bit half of an 8-byte blake2b of the values; SQL sums each half, which
+    # cannot overflow SQLite's 64-bit SUM, and _combine recovers the 64-bit sum
+    digest = hashlib.blake2b('\x1f'.join(map(str, values)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest[4 * half:4 * half + 4], 'little')
+
+
+def _register_fingerprint(conn):
+    conn.connection.dbapi_connection.create_function('fingerprint', -1, _fingerprint, deterministic=True)
+
+
+def _fingerprint_sums(*values):
+    values = ', '.join(values)
+    return f'COALESCE(SUM(fingerprint(0, {values})), 0), COALESCE(SUM(fingerprint(1, {values})), 0)'
+
+
+def _combine(low, high):
+    return (low + (high << 32)) % FINGERPRINT_MODULUS
+
+
+def _events_query(table, compact):
+    # One GROUP BY pass over an event table for per-organization counts, NULLs,
+    # timestamp range, non-atomic values and goal flags, summed up in the same query
+    if compact:
+        table = COMPACT_STAGING_TABLE
+        name, detail = 'activity_id', 'detail_id'
+        timestamp_range = f"{epoch_ms_to_text('MIN(timestamp)')} AS first_event, {epoch_ms_to_text('MAX(timestamp)')} AS last_event"
+        non_atomic = (f"activity_id IN (SELECT id FROM {ACTIVITIES_TABLE} WHERE name LIKE '%;%') "
+                      f"OR detail_id IN (SELECT id FROM {DETAILS_TABLE} WHERE name LIKE '%;%')")
+    else:
+        name, detail = 'activity_name', 'activity_detail'
+        timestamp_range = 'MIN(timestamp) AS first_event, MAX(timestamp) AS last_event'
+        non_atomic = f"{name} LIKE '%;%' OR {detail} LIKE '%;%'"
+    nulls = {'organization_id': 'organization_id', 'activity_name': name, 'timestamp': 'timestamp'}
+    null_counts = ', '.join(f'SUM(CASE WHEN {nulls[column]} IS NULL THEN 1 ELSE 0 END) AS null_{column}'
+                            for column in CRITICAL_COLUMNS)
+    flags = ', '.join(
+        f'SUM(CASE WHEN {goal.condition(compact=compact)} THEN 1 ELSE 0 END) >= {goal.min_count} AS {goal.column}'
+        for goal in GOALS
+    )
+    total_nulls = ', '.join(f'COALESCE(SUM(null_{column}), 0)' for column in CRITICAL_COLUMNS)
+    return f'''
+        SELECT COALESCE(SUM(events), 0), COUNT(organization_id), MIN(first_event), MAX(last_event), {total_nulls},
+               COALESCE(SUM(non_atomic), 0),
+               {_fingerprint_sums('organization_id', 'events', 'first_event', 'last_event')},
+               {_fingerprint_sums('organization_id', *(goal.column for goal in GOALS))}
+        FROM (
+            SELECT organization_id, COUNT(*) AS events, {timestamp_range}, {null_counts},
+                   SUM(CASE WHEN {non_atomic} THEN 1 ELSE 0 END) AS non_atomic, {flags}
+            FROM {table}
+            GROUP BY organization_id
+        )
+    '''
+
+
+def profile_events(conn, table):
+    """Profile behavioral_events or staging in one query, fingerprinting every organization."""
+    start = time.perf_counter()
+    _register_fingerprint(conn)
+    compact = table == STAGING_TABLE and is_compact(conn)
+    row = conn.execute(text(_events_query(table, compact))).fetchone()
+    rows, organizations, first, last = row[:4]
+    nulls = row[4:4 + len(CRITICAL_COLUMNS)]
+    non_atomic, events_low, events_high, goals_low, goals_high = row[4 + len(CRITICAL_COLUMNS):]
+    return TableProfile(
+        table, rows, organizations, dict(zip(CRITICAL_COLUMNS, nulls)), first, last, non_atomic,
+        events_fingerprint=_combine(events_low, events_high),
+        goals_fingerprint=_combine(goals_low, goals_high),
+        seconds=time.perf_counter() - start,
+    )
+
+
+def profile_trial_goals(conn):
+    """Profile trial_goals in one query over its rows."""
+    start = time.perf_counter()
+    _register_fingerprint(conn)
+    columns = [goal.column for goal in GOALS]
+    invalid = ' + '.join(f'COALESCE({column} NOT IN (0, 1), 1)' for column in columns)
+    rows, organizations, invalid_flags, low, high = conn.execute(text(f'''
+        SELECT COUNT(*), COUNT(DISTINCT organization_id), COALESCE(SUM({invalid}), 0),
+               {_fingerprint_sums('organization_id', *columns)}
+        FROM trial_goals
+    ''')).fetchone()
+    return TableProfile('trial_goals', rows, organizations, invalid_flags=invalid_flags,
+                        goals_fingerprint=_combine(low, high), seconds=time.perf_counter() - start)
+
+
+def verify(conn, required=()):
+    """
+    Check the build's invariants with one pass per table and return a
+    VerificationReport. Tables that do not exist yet are skipped, unless they
+    are `required`, which makes their absence a problem.
+    """
+    existing = set(inspect(conn).get_table_names()) | set(inspect(conn).get_view_names())
+    tables = {}
+    for table in ('behavioral_events', STAGING_TABLE):
+        if table in existing:
+            tables[table] = profile_events(conn, table)
+    if 'trial_goals' in existing:
+        tables['trial_goals'] = profile_trial_goals(conn)
+
+    problems = [f'{table} is missing' for table in required if table not in existing]
+    for profile in tables.values():
+        problems += [f'{profile.table} has {count} NULL {column} values'
+                     for column, count in profile.nulls.items() if count]
+        if profile.non_atomic:
+            problems.append(f'{profile.table} has {profile.non_atomic} non-atomic activity values')
+        if profile.invalid_flags:
+            problems.append(f'{profile.table} has {profile.invalid_flags} goal flags that are not 0 or 1')
+
+    raw, staging, goals = (tables.get(name) for name in ('behavioral_events', STAGING_TABLE, 'trial_goals'))
+    if raw and staging:
+        for attribute in ('rows', 'organizations', 'first_timestamp', 'last_timestamp'):
+            if getattr(raw, attribute) != getattr(staging, attribute):
+                problems.append(f'{attribute} differ: behavioral_events {getattr(raw, attribute)}, '
+                                f'{STAGING_TABLE} {getattr(staging, attribute)}')
+        if raw.events_fingerprint != staging.events_fingerprint:
+            problems.append(f'per-organization events differ between behavioral_events and {STAGING_TABLE}')
+    if staging and goals:
+        if staging.organizations != goals.organizations:
+            problems.append(f'organizations differ: {STAGING_TABLE} {staging.organizations}, '
+                            f'trial_goals {goals.organizations}')
+        if staging.goals_fingerprint != goals.goals_fingerprint:
+            problems.append(f'trial_goals flags do not match the goal counts in {STAGING_TABLE}')
+    return VerificationReport(tables, problems)
+
+
+def verify_build(conn):
+    """Build stage: raise if a required table is missing or any invariant does not hold, otherwise return the report."""
+    report = verify(conn, REQUIRED_TABLES)
+    if not report.ok:
+        raise RuntimeError(f'Build verification failed:\n{report}')
+    return report
+
+
+if __name__ == '__main__':
+    engine = create_engine(f"sqlite:///{sys.argv[1] if len(sys.argv) > 1 else 'trial_activation/trial_data.db'}")
+    with engine.connect() as conn:
+        report = verify(conn, REQUIRED_TABLES)
+    print(report)
+    sys.exit(0 if report.ok else 1)
@@ -0,0 +1,73 @@
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine
+
+from trial_activation.src.activation import persist_activated_at
+from trial_activation.src.incremental import record_source, write_watermark
+from trial_activation.src.ingest import ingest_csv
+from trial_activation.src.stages import build_org_summary, build_staging, build_trial_activation, build_trial_goals
+
+# Small hand-written event log: org-a completes every goal, org-b completes some,
+# org-c only browses; includes empty details
+EVENTS = [
+    ('org-a', 'Page.Viewed', 'dashboard', '2024-01-01 09:00:00'),
+    ('org-a', 'Shift.Created', None, '2024-01-01 09:30:00'),
+    ('org-a', 'Hr.Employee.Invited', None, '2024-01-01 10:00:00'),
+    ('org-a', 'Shift.Created', None, '2024-01-02 08:15:30'),
+    ('org-a', 'Page.Viewed', 'revenue', '2024-01-02 12:00:00'),
+    ('org-a', 'PunchClock.PunchedIn', None, '2024-01-03 07:59:59'),
+    ('org-a', 'PunchClock.Approvals.EntryApproved', None, '2024-01-04 16:00:00'),
+    ('org-a', 'Page.Viewed', 'availability', '2024-01-05 11:00:00'),
+    ('org-a', 'Shift.Created', None, '2024-01-06 11:00:00'),
+    ('org-b', 'Shift.Created', None, '2024-01-03 14:00:00'),
+    ('org-b', 'Hr.Employee.Invited', None, '2024-01-03 14:05:00'),
+    ('org-b', 'Page.Viewed', 'revenue', '2024-01-04 09:00:00'),
+    ('org-b', 'PunchClock.PunchedIn', None, '2024-01-08 09:00:00'),
+    ('org-b', 'Page.Viewed', 'absence-accounts', '2024-01-09 09:00:00'),
+    ('org-c', 'Page.Viewed', 'dashboard', '2024-01-10 18:00:00'),
+    ('org-c', 'Page.Viewed', 'revenue', '2024-01-10 18:01:00'),
+    ('org-c', 'Scheduling.Template.ApplyModal.Applied', None, '2024-01-11 08:00:00'),
+]
+
+
+@pytest.fixture
+def events_frame():
+    return pd.DataFrame(EVENTS, columns=['ORGANIZATION_ID', 'ACTIVITY_NAME', 'ACTIVITY_DETAIL', 'TIMESTAMP'])
+
+
+@pytest.fixture
+def events_csv(tmp_path, events_frame):
+    path = tmp_path / 'events.csv'
+    events_frame.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def full_build():
+    # Same stage sequence as db.py, against any engine and CSV
+    def build(engine, csv_path):
+        stats = ingest_csv(engine, csv_path)
+        with engine.begin() as conn:
+            record_source(conn, csv_path, stats.source_bytes)
+            build_staging(conn)
+            build_org_summary(conn)
+            build_trial_goals(conn)
+            build_trial_activation(conn)
+            persist_activated_at(conn)
+            write_watermark(conn)
+        return engine
+    return build
+
+
+@pytest.fixture
+def built_engine(tmp_path, events_csv, full_build):
+    return full_build(create_engine(f'sqlite:///{tmp_path / "trial_data.db"}'), events_csv)
+
+
+@pytest.fixture
+def project_db(tmp_path, monkeypatch, events_csv, full_build):
+    # A built database at the project-relative path TrialAnalytics opens by default
+    (tmp_path / 'trial_activation').mkdir()
+    engine = full_build(create_engine(f'sqlite:///{tmp_path / "trial_activation" / "trial_data.db"}'), events_csv)
+    monkeypatch.chdir(tmp_path)
+    return engine
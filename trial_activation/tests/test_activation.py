@@ -0,0 +1,57 @@
+import pandas as pd
+from sqlalchemy import text
+
+from trial_activation.src.activation import find_activation_moments, query_activation_moments
+from trial_activation.src.goals import GOALS
+
+
+def _prefix_search(events):
+    # The original notebook algorithm: re-check every growing prefix
+    moments = {}
+    ordered = events.sort_values(['organization_id', 'timestamp', 'id'])
+    for org_id, group in ordered.groupby('organization_id'):
+        for end in range(1, len(group) + 1):
+            prefix = group.iloc[:end]
+            if all(
+                ((prefix.activity_name == goal.activity_name)
+                 & (prefix.activity_detail.isin(goal.details) if goal.details else True)).sum() >= goal.min_count
+                for goal in GOALS
+            ):
+                moments[org_id] = (int(prefix.iloc[-1].id), prefix.iloc[-1].timestamp)
+                break
+    return moments
+
+
+def _as_dict(moments):
+    return {row.organization_id: (int(row.event_id), row.activated_at) for row in moments.itertuples()}
+
+
+def _staging(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(text('SELECT * FROM staging_behavioral_events'), conn)
+
+
+def test_numpy_and_sql_paths_match_prefix_search(built_engine):
+    events = _staging(built_engine)
+    expected = _prefix_search(events)
+
+    assert _as_dict(find_activation_moments(events)) == expected
+    with built_engine.connect() as conn:
+        assert _as_dict(query_activation_moments(conn)) == expected
+    assert list(expected) == ['org-a']
+    assert expected['org-a'][1] == '2024-01-05 11:00:00.000000'
+
+
+def test_activation_moment_for_shuffled_events_with_ties(built_engine):
+    events = _staging(built_engine)
+    # Later duplicates of the completing event must not move the moment
+    extra = events[events.activity_name == 'PunchClock.Approvals.EntryApproved'].assign(id=events.id.max() + 1)
+    events = pd.concat([events, extra]).sample(frac=1, random_state=7)
+
+    assert _as_dict(find_activation_moments(events)) == _prefix_search(events)
+
+
+def test_activated_at_is_persisted_on_trial_activation(built_engine):
+    with built_engine.connect() as conn:
+        rows = conn.execute(text('SELECT organization_id, activated_at FROM trial_activation')).fetchall()
+    assert [tuple(row) for row in rows] == [('org-a', '2024-01-05 11:00:00.000000')]
@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from trial_activation.src.analytics import SUMMARY_METRICS, TrialAnalytics, TrialReport
+from trial_activation.src.goals import GOALS
+
+DAY = 86400
+
+
+@pytest.fixture
+def analytics(project_db):
+    return TrialAnalytics()
+
+
+def test_trial_activation_rate(analytics):
+    assert analytics.trial_activation_rate() == pytest.approx(1 / 3)
+
+
+def test_time_to_activation(analytics):
+    assert analytics.time_to_activation() == pytest.approx(5 + 2 / 24)
+
+
+def test_goal_completion_rates(analytics):
+    assert analytics.goal_completion_rates() == pytest.approx({
+        'Shift Created': 1 / 3,
+        'Employee Invited': 2 / 3,
+        'Punched In': 2 / 3,
+        'Punch In Approved': 1 / 3,
+        'Advanced Features': 2 / 3,
+    })
+
+
+def test_advanced_features_rate(analytics):
+    assert analytics.advanced_features_rate() == pytest.approx({
+        'revenue': 1.0,
+        'availability': 1 / 3,
+        'absence-accounts': 1 / 3,
+    })
+
+
+def test_goal_achievement_times(analytics):
+    # Offsets are exact integer seconds in both staging layouts, so these hold to float precision
+    assert analytics.goal_achievement_times() == pytest.approx({
+        'Shift Created': 1800 / DAY,
+        'Employee Invited': (3600 + 300) / 2 / DAY,
+        'Punched In': (169199 + 414000) / 2 / DAY,
+        'Punch In Approved': 284400 / DAY,
+        'Advanced Features': (97200 + 68400) / 2 / DAY,
+    })
+
+
+def test_org_summary_agrees_with_marts(built_engine):
+    with built_engine.connect() as conn:
+        mismatches = conn.execute(text(f'''
+            SELECT COUNT(*)
+            FROM org_summary os
+            JOIN trial_goals tg USING (organization_id)
+            LEFT JOIN trial_activation ta USING (organization_id)
+            WHERE os.activated != (ta.organization_id IS NOT NULL)
+               OR {' OR '.join(f'os.{goal.column} != tg.{goal.column}' for goal in GOALS)}
+        ''')).scalar()
+        summary_orgs = conn.execute(text('SELECT COUNT(*) FROM org_summary')).scalar()
+        staging_orgs = conn.execute(text('SELECT COUNT(DISTINCT organization_id) FROM staging_behavioral_events')).scalar()
+
+    assert mismatches == 0
+    assert summary_orgs == staging_orgs == 3
+
+
+def test_goal_achievement_curves(analytics):
+    curves = analytics.goal_achievement_curves()
+
+    assert list(curves.index) == list(range(7))
+    expected = {
+        'Shift Created': [0, 1, 1, 1, 1, 1, 1],
+        'Employee Invited': [0, 2, 2, 2, 2, 2, 2],
+        'Punched In': [0, 0, 1, 1, 1, 2, 2],
+        'Punch In Approved': [0, 0, 0, 0, 1, 1, 1],
+        'Advanced Features': [0, 0, 0, 0, 0, 1, 2],
+        'Activation': [0, 0, 0, 0, 0, 1, 1],
+    }
+    assert list(curves.columns) == list(expected)
+    for label, achieved in expected.items():
+        np.testing.assert_allclose(curves[label].to_numpy(), np.array(achieved) / 3)
+
+
+def test_goal_achievement_probability(analytics):
+    assert analytics.goal_achievement_probability('goal_punched_in', 2) == pytest.approx(1 / 3)
+    assert analytics.goal_achievement_probability('goal_punched_in', 120) == pytest.approx(2 / 3)
+    assert analytics.goal_achievement_probability('activated', 4) == 0
+
+
+def test_report_matches_individual_methods(analytics):
+    report = analytics.report()
+
+    assert isinstance(report, TrialReport)
+    assert report.trial_activation_rate == analytics.trial_activation_rate()
+    assert report.time_to_activation == analytics.time_to_activation()
+    assert report.goal_completion_rates == analytics.goal_completion_rates()
+    assert report.advanced_features_rate == analytics.advanced_features_rate()
+    assert report.goal_achievement_times == analytics.goal_achievement_times()
+    pd.testing.assert_frame_equal(report.goal_achievement_curves, analytics.goal_achievement_curves())
+    assert set(report.timings) == set(SUMMARY_METRICS) | {'goal_achievement_curves'}
+    assert report.seconds >= max(report.timings.values())
+
+
+def test_report_runs_independent_tasks_concurrently(analytics, monkeypatch):
+    tasks = [lambda name=name: analytics._summary([name]) for name in SUMMARY_METRICS]
+    monkeypatch.setattr(analytics, '_report_tasks', lambda: tasks)
+
+    report = analytics.report(max_workers=3)
+
+    assert report.trial_activation_rate == pytest.approx(1 / 3)
+    assert report.goal_completion_rates == analytics.goal_completion_rates()
+    assert set(report.timings) == set(SUMMARY_METRICS)
+
+
+def test_analytics_connections_are_read_only(analytics):
+    with analytics.engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text('DELETE FROM org_summary'))
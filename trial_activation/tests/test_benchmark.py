@@ -0,0 +1,73 @@
+import copy
+import json
+
+import pandas as pd
+
+from trial_activation.src.benchmark import (ANALYTICS_METHODS, compare, generate_events, main, parse_scale,
+                                            run_benchmark, write_events_csv)
+from trial_activation.src.db import ALL_STAGES
+from trial_activation.src.goals import GOALS
+from trial_activation.src.ingest import read_chunks
+
+
+def test_generator_is_deterministic_and_exact():
+    first = pd.concat(generate_events(5_000, seed=7))
+    again = pd.concat(generate_events(5_000, seed=7))
+    other = pd.concat(generate_events(5_000, seed=8))
+
+    assert len(first) == 5_000
+    pd.testing.assert_frame_equal(first, again)
+    assert not first['ORGANIZATION_ID'].isin(other['ORGANIZATION_ID']).any()
+
+
+def test_generated_csv_matches_export_schema(tmp_path):
+    path = write_events_csv(tmp_path / 'events.csv', 3_000, seed=1)
+    events = pd.concat(read_chunks(path, chunksize=1_000))
+
+    assert list(events.columns) == ['ORGANIZATION_ID', 'ACTIVITY_NAME', 'ACTIVITY_DETAIL', 'TIMESTAMP']
+    assert events['ORGANIZATION_ID'].str.fullmatch('[0-9a-f]{32}').all()
+    assert events['TIMESTAMP'].dtype.kind == 'M'
+    assert set(events['ACTIVITY_NAME']) == {goal.activity_name for goal in GOALS}
+    viewed = events['ACTIVITY_NAME'] == 'Page.Viewed'
+    assert events.loc[viewed, 'ACTIVITY_DETAIL'].notna().all()
+    assert events.loc[~viewed, 'ACTIVITY_DETAIL'].isna().all()
+
+
+def test_run_benchmark_profiles_every_stage_and_method(tmp_path):
+    run = run_benchmark(2_000, tmp_path, repeat=1)
+
+    assert list(run['stages']) == list(ALL_STAGES)
+    assert list(run['analytics']) == list(ANALYTICS_METHODS)
+    assert run['stages']['staging']['rows'] == 2_000
+    assert run['stages']['trial_goals']['rows'] == run['organizations']
+    assert all(m['seconds'] > 0 and m['peak_rss_bytes'] > 0 for m in run['analytics'].values())
+    assert json.loads(json.dumps(run)) == run
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    stage = {'seconds': 1.0, 'peak_rss_bytes': 100 * 2**20}
+    baseline = {'10k': {'events': 10_000, 'seed': 0, 'stages': {'staging': dict(stage), 'ingest': dict(stage)},
+                        'analytics': {'report': {'seconds': 0.001, 'peak_rss_bytes': 2**20}}}}
+    results = copy.deepcopy(baseline)
+    results['10k']['stages']['staging']['seconds'] = 1.5
+    results['10k']['stages']['ingest']['peak_rss_bytes'] = 200 * 2**20
+    # Tripled, but below the noise floor
+    results['10k']['analytics']['report']['seconds'] = 0.003
+
+    regressions = compare(results, baseline, tolerance=0.25)
+
+    assert {(r.name, r.metric) for r in regressions} == {('staging', 'seconds'), ('ingest', 'peak_rss_bytes')}
+    assert compare(baseline, baseline) == []
+
+
+def test_cli_exits_nonzero_on_regression(tmp_path):
+    output = tmp_path / 'results.json'
+    assert main(['--scale', '1000', '--repeat', '1', '--output', str(output), '--workdir', str(tmp_path)]) == 0
+    baseline = json.loads(output.read_text())
+    for stage in baseline['1000']['stages'].values():
+        stage['seconds'] /= 100
+    (tmp_path / 'baseline.json').write_text(json.dumps(baseline))
+
+    assert main(['--scale', '1000', '--repeat', '1', '--output', str(output), '--workdir', str(tmp_path),
+                 '--baseline', str(tmp_path / 'baseline.json')]) == 1
+    assert parse_scale('1M') == 1_000_000
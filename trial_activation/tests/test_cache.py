@@ -0,0 +1,80 @@
+from sqlalchemy import text
+
+from trial_activation.src.analytics import TrialAnalytics
+from trial_activation.src.cache import ResultCache
+from trial_activation.src.db import build_database
+from trial_activation.src.incremental import write_watermark
+
+
+def test_lru_eviction_and_counters():
+    cache = ResultCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == (True, 1)
+    cache.put('c', 3)
+
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.get('c') == (True, 3)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2}
+
+
+def test_disk_store_survives_restart(tmp_path):
+    path = tmp_path / 'cache.db'
+    cache = ResultCache(maxsize=2, path=path)
+    cache.put(('rates', ()), {'Shift Created': 0.5})
+    cache.put('evicted', 1)
+    cache.put('kept', 2)
+    cache.close()
+
+    reopened = ResultCache(maxsize=2, path=path)
+    assert len(reopened) == 2
+    assert reopened.get('kept') == (True, 2)
+    assert reopened.get(('rates', ())) == (False, None)
+
+
+def test_cached_results_are_copies():
+    cache = ResultCache()
+    cache.put('rates', {'a': 1})
+    _, value = cache.get('rates')
+    value['a'] = 2
+    assert cache.get('rates') == (True, {'a': 1})
+
+
+def test_analytics_cache_hits_until_rebuild(project_db):
+    cache = ResultCache(maxsize=8)
+    analytics = TrialAnalytics(cache=cache)
+
+    first = analytics.goal_completion_rates()
+    assert analytics.goal_completion_rates() == first
+    analytics.goal_achievement_times()
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # A new build id invalidates every cached result
+    with project_db.begin() as conn:
+        conn.execute(text('UPDATE org_summary SET goal_shift_created = 1'))
+        write_watermark(conn)
+
+    assert analytics.goal_completion_rates()['Shift Created'] == 1.0
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_analytics_without_cache(project_db):
+    analytics = TrialAnalytics()
+    assert analytics.cache is None
+    assert analytics.trial_activation_rate() == analytics.trial_activation_rate()
+
+
+def test_rebuild_without_the_watermark_stage_invalidates_the_cache(tmp_path, events_frame, events_csv):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target)
+    analytics = TrialAnalytics(cache=ResultCache(), db_path=target)
+    assert analytics.trial_activation_rate() == 1 / 3
+
+    # Without org-a's approval nobody is activated; only the mart stages run
+    rebuilt_csv = tmp_path / 'rebuilt.csv'
+    events_frame[events_frame['ACTIVITY_NAME'] != 'PunchClock.Approvals.EntryApproved'].to_csv(rebuilt_csv, index=False)
+    build_database(rebuilt_csv, target, stages=('ingest', 'staging', 'org_summary', 'trial_goals', 'trial_activation'))
+
+    assert analytics.trial_activation_rate() == 0.0
+    analytics.engine.dispose()
@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from trial_activation.src.analytics import TrialAnalytics
+from trial_activation.src.cache import ResultCache
+from trial_activation.src.cohorts import COHORTS, get_cohort
+from trial_activation.src.goals import GOALS
+from trial_activation.src.incremental import refresh
+
+
+@pytest.fixture
+def analytics(project_db):
+    return TrialAnalytics()
+
+
+def test_cohort_keys_are_stored_per_organization(built_engine):
+    with built_engine.connect() as conn:
+        summary = pd.read_sql('SELECT * FROM org_summary ORDER BY organization_id', conn)
+
+    assert list(summary['cohort_week']) == ['2024-01-01', '2024-01-01', '2024-01-08']
+    assert list(summary['cohort_month']) == ['2024-01-01'] * 3
+    for cohort in COHORTS.values():
+        assert list(summary[cohort.column]) == [cohort.key(first) for first in summary['first_event']]
+
+
+def test_cohort_metrics_match_the_global_metrics_per_cohort(analytics, project_db):
+    weekly = analytics.cohort_metrics('week')
+
+    assert list(weekly.index) == ['2024-01-01', '2024-01-08']
+    assert list(weekly['organizations']) == [2, 1]
+    assert list(weekly['trial_activation_rate']) == [0.5, 0.0]
+    assert weekly.loc['2024-01-01', 'time_to_activation'] == pytest.approx(5 + 2 / 24)
+    assert list(weekly[GOALS[0].label]) == [0.5, 0.0]
+    assert not weekly['closed'].any()
+
+    monthly = analytics.cohort_metrics('month')
+    assert monthly.loc['2024-01-01', 'trial_activation_rate'] == pytest.approx(analytics.trial_activation_rate())
+    assert monthly.loc['2024-01-01', 'time_to_activation'] == pytest.approx(analytics.time_to_activation())
+    assert monthly.loc['2024-01-01', [goal.label for goal in GOALS]].to_dict() == analytics.goal_completion_rates()
+    assert analytics.cohort_activation_rates('day').to_dict() == {
+        '2024-01-01': 1.0, '2024-01-03': 0.0, '2024-01-10': 0.0}
+
+
+def test_closed_cohorts_are_served_from_the_cache(project_db):
+    analytics = TrialAnalytics(cache=ResultCache())
+    first = analytics.cohort_metrics('week', settle_days=0)
+    assert list(first['closed']) == [True, False]
+
+    # A refresh changes the build id but not the lineage; only the open cohort is read again
+    with project_db.begin() as conn:
+        conn.execute(text("UPDATE org_summary SET activated = 0 WHERE organization_id = 'org-a'"))
+        conn.execute(text("UPDATE org_summary SET activated = 1 WHERE organization_id = 'org-c'"))
+        conn.execute(text("UPDATE pipeline_state SET value = 'refreshed' WHERE key = 'build_id'"))
+    second = analytics.cohort_metrics('week', settle_days=0)
+
+    assert list(second['trial_activation_rate']) == [0.5, 1.0]
+    assert analytics.cache.stats()['hits'] == 1
+    pd.testing.assert_frame_equal(TrialAnalytics().cohort_metrics('week', settle_days=0).iloc[1:], second.iloc[1:])
+
+
+
+def test_refreshes_reaching_a_closed_cohort_invalidate_it(project_db, events_csv):
+    analytics = TrialAnalytics(cache=ResultCache())
+    analytics.cohort_metrics('week', settle_days=0)
+
+    # A late event for org-b changes the closed 2024-01-01 cohort
+    with open(events_csv, 'a') as export:
+        export.write('org-b,PunchClock.Approvals.EntryApproved,,2024-01-12 09:00:00\n')
+    refresh(project_db, events_csv)
+    refreshed = analytics.cohort_metrics('week', settle_days=0)
+    assert analytics.cache.stats()['hits'] == 0
+    pd.testing.assert_frame_equal(TrialAnalytics().cohort_metrics('week', settle_days=0), refreshed)
+
+    # One for org-c reaches only the open cohort
+    with open(events_csv, 'a') as export:
+        export.write('org-c,Shift.Created,,2024-01-13 09:00:00\n')
+    refresh(project_db, events_csv)
+    refreshed = analytics.cohort_metrics('week', settle_days=0)
+    assert analytics.cache.stats()['hits'] == 1
+    pd.testing.assert_frame_equal(TrialAnalytics().cohort_metrics('week', settle_days=0), refreshed)
+
+def test_unknown_granularity():
+    with pytest.raises(ValueError, match='quarter'):
+        get_cohort('quarter')
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.analytics import TrialAnalytics
+from trial_activation.src.db import ALL_STAGES, PROFILES, build_database, create_build_engine, main
+
+TABLES = ('staging_behavioral_events', 'org_summary', 'trial_goals', 'trial_activation')
+
+
+def _rows(path):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.connect() as conn:
+        rows = {table: conn.execute(text(f'SELECT * FROM {table} ORDER BY 1')).fetchall() for table in TABLES}
+        journal_mode = conn.execute(text('PRAGMA journal_mode')).scalar()
+    engine.dispose()
+    return rows, journal_mode
+
+
+@pytest.mark.parametrize('profile', list(PROFILES))
+def test_build_database_matches_stage_by_stage_build(tmp_path, events_csv, built_engine, profile):
+    target = tmp_path / f'{profile}.db'
+    result = build_database(events_csv, target, profile=profile)
+
+    rows, journal_mode = _rows(target)
+    expected, _ = _rows(built_engine.url.database)
+    assert rows == expected
+    assert journal_mode == 'wal'
+    assert list(result.stage_seconds) == list(ALL_STAGES)
+    assert result.ingest.rows == 17 and result.profile == profile
+    assert result.verification.ok and result.verification.tables['trial_goals'].organizations == 3
+
+
+def test_profile_pragmas_apply_to_every_connection(tmp_path):
+    engine = create_build_engine(tmp_path / 'trial_data.db', 'bulk_load')
+    with engine.connect() as conn:
+        assert conn.execute(text('PRAGMA synchronous')).scalar() == 0
+        assert conn.execute(text('PRAGMA cache_size')).scalar() == -262144
+        assert conn.execute(text('PRAGMA temp_store')).scalar() == 2
+
+
+def test_stages_run_on_their_own(tmp_path, events_csv, built_engine):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target, stages=('ingest', 'staging'))
+    build_database(events_csv, target, stages=ALL_STAGES[2:])
+
+    assert _rows(target)[0] == _rows(built_engine.url.database)[0]
+    with pytest.raises(ValueError, match='Unknown build stages: trial_goal'):
+        build_database(events_csv, target, stages=('trial_goal',))
+
+
+def test_cli_takes_paths_profile_and_workers(tmp_path, events_csv, built_engine, capsys):
+    target = tmp_path / 'cli.db'
+    main(['--source', str(events_csv), '--target', str(target), '--profile', 'safe', '--workers', '2',
+          '--trace', str(tmp_path / 'trace.json')])
+
+    assert _rows(target)[0] == _rows(built_engine.url.database)[0]
+    output = capsys.readouterr().out
+    assert 'Number of rows inserted into trial_activation: 1' in output
+    assert 'staging_behavioral_events: 17 rows, 3 organizations' in output
+    assert 'with the safe profile' in output
+    assert (tmp_path / 'trace.json').exists()
+
+
+@pytest.mark.parametrize('profile', list(PROFILES))
+def test_rebuild_while_analytics_hold_a_connection(tmp_path, events_csv, profile):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target, profile=profile)
+    analytics = TrialAnalytics(db_path=target)
+
+    with analytics.engine.connect() as conn:
+        conn.execute(text('SELECT COUNT(*) FROM org_summary')).scalar()
+        build_database(events_csv, target, profile=profile)
+
+    assert analytics.trial_activation_rate() == pytest.approx(1 / 3)
+    assert _rows(target)[1] == 'wal'
+    analytics.engine.dispose()
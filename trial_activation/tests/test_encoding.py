@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.db import build_database
+from trial_activation.src.encoding import COMPACT, epoch_ms_to_text, is_compact, text_to_epoch_ms
+from trial_activation.src.incremental import refresh
+
+TABLES = ('staging_behavioral_events', 'org_summary', 'trial_goals', 'trial_activation')
+
+
+def _rows(path):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.connect() as conn:
+        rows = {table: conn.execute(text(f'SELECT * FROM {table} ORDER BY 1')).fetchall() for table in TABLES}
+    engine.dispose()
+    return rows
+
+
+def _without_ids(staging):
+    return sorted(row[1:] for row in staging)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_compact_build_reads_like_the_text_build(tmp_path, events_csv, built_engine, workers):
+    target = tmp_path / 'compact.db'
+    build_database(events_csv, target, encoding=COMPACT, workers=workers)
+
+    assert _rows(target) == _rows(built_engine.url.database)
+    engine = create_engine(f'sqlite:///{target}')
+    with engine.connect() as conn:
+        assert is_compact(conn)
+        assert conn.execute(text('SELECT typeof(timestamp), typeof(activity_id) FROM staging_events')).first() == \
+            ('integer', 'integer')
+        # Activities outside the goal registry are coded on load
+        assert conn.execute(text(
+            "SELECT id FROM activities WHERE name = 'Scheduling.Template.ApplyModal.Applied'"
+        )).scalar() == 6
+
+
+def test_epoch_milliseconds_round_trip():
+    engine = create_engine('sqlite://')
+    with engine.connect() as conn:
+        for value in ('2024-01-01 09:00:00.000000', '2024-02-29 23:59:59.999000', '1999-12-31 00:00:00.042000'):
+            epoch_ms = conn.execute(text(f'SELECT {text_to_epoch_ms(":value")}'), {'value': value}).scalar()
+            assert conn.execute(text(f'SELECT {epoch_ms_to_text(":epoch_ms")}'), {'epoch_ms': epoch_ms}).scalar() == value
+
+
+def test_incremental_refresh_of_a_compact_build(tmp_path, events_frame, events_csv, built_engine):
+    history_csv = tmp_path / 'history.csv'
+    events_frame[events_frame['TIMESTAMP'] < '2024-01-04'].to_csv(history_csv, index=False)
+    target = tmp_path / 'compact.db'
+    build_database(history_csv, target, encoding=COMPACT)
+
+    result = refresh(create_engine(f'sqlite:///{target}'), events_csv)
+
+    assert result['new_rows'] == 9
+    rows, expected = _rows(target), _rows(built_engine.url.database)
+    # Refreshed staging rows get new ids; everything else matches a full build
+    assert _without_ids(rows.pop('staging_behavioral_events')) == _without_ids(expected.pop('staging_behavioral_events'))
+    assert rows == expected
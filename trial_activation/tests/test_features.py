@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.db import build_database
+from trial_activation.src.features import FEATURE_COLUMNS, feature_matrix, load_features, update_features
+from trial_activation.src.goals import GOALS
+from trial_activation.src.incremental import refresh
+
+
+def _features(path):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.connect() as conn:
+        features = load_features(conn)
+    engine.dispose()
+    return features
+
+
+def test_features_match_a_full_recomputation(tmp_path, events_csv, events_frame):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target)
+    features = _features(target).set_index('organization_id')
+
+    events = events_frame.assign(timestamp=pd.to_datetime(events_frame['TIMESTAMP']))
+    events['day_of_week'] = events['timestamp'].dt.dayofweek
+    events['hour_of_day'] = events['timestamp'].dt.hour
+    expected = events.groupby('ORGANIZATION_ID').agg(
+        day_of_week_mean=('day_of_week', 'mean'), day_of_week_std=('day_of_week', 'std'),
+        hour_of_day_mean=('hour_of_day', 'mean'), hour_of_day_std=('hour_of_day', 'std'),
+        event_count=('timestamp', 'size'),
+    )
+    for column in expected:
+        np.testing.assert_allclose(features[column], expected[column], rtol=1e-6)
+    assert features.loc['org-a', 'trial_duration'] == np.float32(5 + 2 / 24)
+
+    engine = create_engine(f'sqlite:///{target}')
+    summary = pd.read_sql('SELECT * FROM org_summary', engine).set_index('organization_id')
+    for goal in GOALS:
+        np.testing.assert_array_equal(features[f'{goal.key}_count'], summary[f'{goal.key}_count'])
+        np.testing.assert_array_equal(features[f'{goal.key}_first_offset'],
+                                      summary[f'{goal.key}_first_offset'].astype(np.float32))
+
+
+def test_incremental_update_matches_a_full_build(tmp_path, events_frame, events_csv):
+    history_csv = tmp_path / 'history.csv'
+    events_frame[events_frame['TIMESTAMP'] < '2024-01-04'].to_csv(history_csv, index=False)
+    incremental = tmp_path / 'incremental.db'
+    build_database(history_csv, incremental)
+
+    refresh(create_engine(f'sqlite:///{incremental}'), events_csv, chunksize=5)
+    full = tmp_path / 'full.db'
+    build_database(events_csv, full)
+
+    pd.testing.assert_frame_equal(_features(incremental), _features(full))
+    with create_engine(f'sqlite:///{incremental}').begin() as conn:
+        assert update_features(conn) == 0
+        assert conn.execute(text('SELECT last_rowid FROM org_features_state')).scalar() == 17
+
+
+def test_feature_matrix_is_float32(tmp_path, events_csv):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target)
+    with create_engine(f'sqlite:///{target}').connect() as conn:
+        organizations, matrix = feature_matrix(conn)
+
+    assert list(organizations) == ['org-a', 'org-b', 'org-c']
+    assert matrix.dtype == np.float32 and matrix.shape == (3, len(FEATURE_COLUMNS))
@@ -0,0 +1,114 @@
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.incremental import WATERMARK_KEY, main, read_state, refresh
+
+
+def _snapshot(engine):
+    # Surrogate staging ids depend on insertion order, so compare content only
+    with engine.connect() as conn:
+        return {
+            'staging': sorted(conn.execute(text('''
+                SELECT organization_id, activity_name, activity_detail, timestamp,
+                       first_activity_timestamp, time_since_first_activity
+                FROM staging_behavioral_events
+            ''')).fetchall(), key=repr),
+            'trial_goals': conn.execute(text('SELECT * FROM trial_goals ORDER BY organization_id')).fetchall(),
+            'trial_activation': conn.execute(text('SELECT * FROM trial_activation ORDER BY organization_id')).fetchall(),
+        }
+
+
+def test_incremental_refresh_matches_full_rebuild(tmp_path, events_frame, events_csv, full_build):
+    history_csv = tmp_path / 'history.csv'
+    events_frame[events_frame['TIMESTAMP'] < '2024-01-04'].to_csv(history_csv, index=False)
+
+    incremental = create_engine(f'sqlite:///{tmp_path / "incremental.db"}')
+    full_build(incremental, history_csv)
+    with incremental.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM trial_activation')).scalar() == 0
+
+    result = refresh(incremental, events_csv, chunksize=5)
+    assert result['new_rows'] == 9
+    assert result['organizations'] == 3
+
+    full = create_engine(f'sqlite:///{tmp_path / "full.db"}')
+    full_build(full, events_csv)
+    assert _snapshot(incremental) == _snapshot(full)
+
+    with incremental.connect() as conn:
+        assert read_state(conn, WATERMARK_KEY) == '2024-01-11 08:00:00.000000'
+
+
+def test_refresh_without_new_events_is_a_no_op(built_engine, events_csv):
+    engine = built_engine
+    before = _snapshot(engine)
+
+    result = refresh(engine, events_csv)
+
+    assert result['new_rows'] == 0
+    assert result['batch'] == 1
+    assert _snapshot(engine) == before
+
+
+def test_refresh_parses_only_rows_appended_to_the_export(tmp_path, events_frame, events_csv, built_engine, full_build):
+    loaded_bytes = events_csv.stat().st_size
+    # A late event older than the watermark and one at the watermark itself
+    late = pd.DataFrame([
+        ('org-c', 'Shift.Created', None, '2024-01-05 10:00:00'),
+        ('org-b', 'PunchClock.Approvals.EntryApproved', None, '2024-01-11 08:00:00'),
+    ], columns=events_frame.columns)
+    late.to_csv(events_csv, mode='a', header=False, index=False)
+
+    result = refresh(built_engine, events_csv, chunksize=1)
+    assert result['skipped_bytes'] == loaded_bytes
+    assert (result['new_rows'], result['organizations']) == (2, 2)
+
+    full = full_build(create_engine(f'sqlite:///{tmp_path / "full.db"}'), events_csv)
+    assert _snapshot(built_engine) == _snapshot(full)
+    assert refresh(built_engine, events_csv)['new_rows'] == 0
+
+
+def test_refresh_of_another_file_keeps_late_events_at_the_watermark(tmp_path, events_frame, full_build):
+    watermark = '2024-01-04 09:00:00'
+    history_csv = tmp_path / 'history.csv'
+    events_frame[events_frame['TIMESTAMP'] <= watermark].to_csv(history_csv, index=False)
+    incremental = full_build(create_engine(f'sqlite:///{tmp_path / "incremental.db"}'), history_csv)
+
+    # The export was rewritten with an event for org-c sharing the watermark timestamp
+    export_csv = tmp_path / 'export.csv'
+    late = pd.DataFrame([('org-c', 'Shift.Created', None, watermark)], columns=events_frame.columns)
+    pd.concat([events_frame, late]).to_csv(export_csv, index=False)
+
+    result = refresh(incremental, export_csv)
+    assert result['skipped_bytes'] == 0
+    assert result['new_rows'] == 9
+
+    full = full_build(create_engine(f'sqlite:///{tmp_path / "full.db"}'), export_csv)
+    assert _snapshot(incremental) == _snapshot(full)
+
+
+def test_export_rewritten_in_the_middle_is_read_again(tmp_path, events_frame, full_build):
+    # Large enough that the changed event is far from both ends of the file
+    filler = pd.DataFrame([('org-z', 'Page.Viewed', 'dashboard', f'2023-12-{day:02d} 10:00:00')
+                           for day in range(1, 29) for _ in range(200)], columns=events_frame.columns)
+    export_csv = tmp_path / 'export.csv'
+    pd.concat([filler, events_frame, filler]).to_csv(export_csv, index=False)
+    engine = full_build(create_engine(f'sqlite:///{tmp_path / "incremental.db"}'), export_csv)
+
+    # Same size, one changed event in the middle
+    original = export_csv.read_bytes()
+    rewritten = original.replace(b'org-b,Page.Viewed,revenue', b'org-b,Page.Viewed,reports')
+    assert len(rewritten) == len(original) > 1 << 18 and rewritten != original
+    export_csv.write_bytes(rewritten)
+
+    assert refresh(engine, export_csv)['skipped_bytes'] == 0
+
+
+def test_cli_takes_source_target_and_chunksize(tmp_path, events_frame, events_csv, built_engine, capsys):
+    late = pd.DataFrame([('org-c', 'Shift.Created', None, '2024-01-12 10:00:00')], columns=events_frame.columns)
+    late.to_csv(events_csv, mode='a', header=False, index=False)
+
+    result = main(['--source', str(events_csv), '--target', built_engine.url.database, '--chunksize', '1'])
+
+    assert (result['new_rows'], result['organizations']) == (1, 1)
+    assert 'Incremental batch 1: 1 new events' in capsys.readouterr().out
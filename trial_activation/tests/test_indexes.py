@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.activation import activation_moments_query
+from trial_activation.src.benchmark import write_events_csv
+from trial_activation.src.db import build_database
+from trial_activation.src.goals import GOALS_BY_KEY, goal_aggregates_query
+from trial_activation.src.indexes import INDEXES, check_analytics_plans, plan_violations
+from trial_activation.src.instrumentation import Tracer
+
+
+@pytest.fixture(scope='module')
+def synthetic_db(tmp_path_factory):
+    # Large enough for the planner's statistics to matter
+    tmp_path = tmp_path_factory.mktemp('indexes')
+    target = tmp_path / 'trial_data.db'
+    build_database(write_events_csv(tmp_path / 'events.csv', 20_000), target)
+    return target
+
+
+def _plan(engine, query):
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {query}'))]
+
+
+def test_build_creates_indexes_and_statistics(synthetic_db):
+    engine = create_engine(f'sqlite:///{synthetic_db}')
+    with engine.connect() as conn:
+        names = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+        analyzed = set(conn.execute(text('SELECT idx FROM sqlite_stat1')).scalars())
+    assert {index.name for index in INDEXES} <= names
+    assert INDEXES[0].name in analyzed
+
+
+def test_staging_queries_use_the_indexes(synthetic_db):
+    engine = create_engine(f'sqlite:///{synthetic_db}')
+
+    activation = _plan(engine, activation_moments_query())
+    assert f'SCAN staging_behavioral_events USING COVERING INDEX {INDEXES[0].name}' in activation
+    assert not any(line == 'SCAN staging_behavioral_events' for line in activation)
+    assert 'USE TEMP B-TREE FOR GROUP BY' not in _plan(engine, goal_aggregates_query())
+
+    invited = GOALS_BY_KEY['employee_invited']
+    plan = _plan(engine, f'SELECT organization_id, MIN(timestamp) FROM staging_behavioral_events '
+                         f'WHERE {invited.condition()} GROUP BY organization_id')
+    assert plan == [f'SCAN staging_behavioral_events USING INDEX idx_staging_behavioral_events_{invited.key}']
+
+
+def test_analytics_plans_have_no_full_scans_or_temp_btrees(synthetic_db):
+    assert check_analytics_plans(synthetic_db) == []
+
+
+def test_plan_violations_flag_scans_and_sorts(synthetic_db):
+    engine = create_engine(f'sqlite:///{synthetic_db}')
+    tracer = Tracer(explain=True)
+    tracer.instrument(engine)
+    with engine.connect() as conn, tracer.span('bad'):
+        conn.execute(text("SELECT * FROM staging_behavioral_events se WHERE se.activity_detail = 'revenue' "
+                          "ORDER BY se.time_since_first_activity")).fetchall()
+        conn.execute(text('SELECT SUM(activated) FROM org_summary')).scalar()
+
+    violations = plan_violations(tracer.spans[0].plans, {'staging_behavioral_events', 'org_summary'})
+    assert [violation.split(' in: ')[0] for violation in violations] == ['SCAN se', 'USE TEMP B-TREE FOR ORDER BY']
@@ -0,0 +1,59 @@
+import resource
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.ingest import ingest_csv
+
+
+def peak_rss_bytes():
+    # Lifetime high-water mark of the process; Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _legacy_load(engine, csv_path):
+    data = pd.read_csv(csv_path)
+    data['TIMESTAMP'] = pd.to_datetime(data['TIMESTAMP'])
+    data['ORGANIZATION_ID'] = data['ORGANIZATION_ID'].astype(str)
+    data.to_sql('behavioral_events', con=engine, if_exists='replace', index=False)
+
+
+def _dump(engine):
+    with engine.connect() as conn:
+        schema = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'behavioral_events'")).scalar()
+        rows = conn.execute(text('SELECT * FROM behavioral_events')).fetchall()
+    return schema, rows
+
+
+def test_chunked_ingest_matches_to_sql(tmp_path, events_csv):
+    legacy = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    streamed = create_engine(f'sqlite:///{tmp_path / "streamed.db"}')
+    _legacy_load(legacy, events_csv)
+
+    # A chunk size that leaves a partial final chunk and a partial final statement
+    stats = ingest_csv(streamed, events_csv, chunksize=4)
+
+    assert _dump(streamed) == _dump(legacy)
+    assert stats.rows == 17
+    assert stats.chunks == 5
+    assert stats.organizations == 3
+    assert stats.peak_rss_bytes > 0
+
+
+def test_ingest_replaces_existing_table(tmp_path, events_csv):
+    engine = create_engine(f'sqlite:///{tmp_path / "trial_data.db"}')
+    ingest_csv(engine, events_csv)
+    ingest_csv(engine, events_csv, chunksize=1)
+
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM behavioral_events')).scalar() == 17
+
+
+def test_peak_rss_is_measured_during_the_load(tmp_path, events_csv):
+    # Memory touched and released before the load must not count as its peak
+    ballast = b'\x01' * (256 * 2**20)
+    del ballast
+
+    stats = ingest_csv(create_engine(f'sqlite:///{tmp_path / "trial_data.db"}'), events_csv)
+
+    assert 0 < stats.peak_rss_bytes < peak_rss_bytes()
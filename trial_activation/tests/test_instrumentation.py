@@ -0,0 +1,81 @@
+import json
+
+from sqlalchemy import create_engine, event, text
+
+from trial_activation.src.analytics import TrialAnalytics
+from trial_activation.src.ingest import ingest_csv
+from trial_activation.src.instrumentation import NULL_TRACER, Tracer
+from trial_activation.src.stages import build_org_summary, build_staging
+
+
+def test_disabled_tracer_records_nothing_and_leaves_engine_alone(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "trial_data.db"}')
+    tracer = Tracer(enabled=False, explain=True)
+    tracer.instrument(engine)
+
+    with tracer.span('stage') as span:
+        span.record(rows_out=1)
+
+    assert tracer.spans == []
+    assert not event.contains(engine, 'before_cursor_execute', tracer._capture_plan)
+
+
+def test_stage_spans_record_rows_memory_and_page_cache(tmp_path, events_csv):
+    engine = create_engine(f'sqlite:///{tmp_path / "trial_data.db"}')
+    tracer = Tracer()
+    ingest_csv(engine, events_csv)
+    with engine.begin() as conn:
+        with tracer.span('staging', conn, rows_in='behavioral_events', rows_out='staging_behavioral_events'):
+            build_staging(conn)
+        with tracer.span('org_summary', conn, rows_in=17) as span:
+            build_org_summary(conn)
+            span.record(rows_out=3)
+
+    staging, summary = tracer.spans
+    assert (staging.name, staging.rows_in, staging.rows_out) == ('staging', 17, 17)
+    assert (summary.rows_in, summary.rows_out) == (17, 3)
+    assert staging.seconds > 0 and staging.peak_rss_bytes > 0
+    assert staging.sqlite['page_count'] > 0 and staging.sqlite['page_size'] > 0
+    assert staging.plans == []
+
+
+def test_explain_captures_query_plans(built_engine):
+    tracer = Tracer(explain=True)
+    tracer.instrument(built_engine)
+    with built_engine.connect() as conn, tracer.span('lookup', conn):
+        conn.execute(text('SELECT COUNT(*) FROM staging_behavioral_events WHERE organization_id = :org'),
+                     {'org': 'org-a'}).scalar()
+    # Outside any span nothing is captured
+    with built_engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+    (span,) = tracer.spans
+    statements = [plan['statement'] for plan in span.plans]
+    assert any('WHERE organization_id = ?' in statement for statement in statements)
+    assert all(plan['plan'] for plan in span.plans)
+    assert any('staging_behavioral_events' in line for plan in span.plans for line in plan['plan'])
+
+
+def test_analytics_queries_are_traced(project_db):
+    tracer = Tracer(explain=True)
+    report = TrialAnalytics(tracer=tracer).report()
+
+    names = {span.name for span in tracer.spans}
+    assert 'achievement_curves' in names
+    assert any(name.startswith('summary(') for name in names)
+    assert all(span.kind == 'query' and span.rows_in == 3 for span in tracer.spans)
+    assert report.trial_activation_rate == 1 / 3
+    assert TrialAnalytics().tracer is NULL_TRACER
+
+
+def test_json_and_prometheus_output(tmp_path, built_engine):
+    tracer = Tracer()
+    with built_engine.connect() as conn, tracer.span('org "summary"', conn, rows_out='org_summary'):
+        pass
+
+    assert json.loads(tracer.write(tmp_path / 'trace.json').read_text())[0]['rows_out'] == 3
+    prometheus = tracer.write(tmp_path / 'trace.prom').read_text()
+    assert '# TYPE trial_activation_seconds gauge' in prometheus
+    assert 'trial_activation_rows_out{stage="org \\"summary\\"",kind="stage"} 3' in prometheus
+    assert 'trial_activation_sqlite_page_count{' in prometheus
+    assert 'trial_activation_rows_in' not in prometheus
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from trial_activation.src.db import build_database
+from trial_activation.src.encoding import COMPACT, TEXT
+from trial_activation.src.incremental import refresh
+from trial_activation.src.snapshot import MANIFEST, load_snapshot, snapshot_path
+
+
+def _is_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def _stored(series):
+    return series.array.codes if series.dtype == 'category' else series.to_numpy()
+
+
+def _staging(db_path):
+    engine = create_engine(f'sqlite:///{db_path}')
+    frame = pd.read_sql('SELECT * FROM staging_behavioral_events ORDER BY organization_id, timestamp, id', engine)
+    engine.dispose()
+    for column in ('timestamp', 'first_activity_timestamp'):
+        frame[column] = pd.to_datetime(frame[column])
+    return frame
+
+
+@pytest.mark.parametrize('encoding', [TEXT, COMPACT])
+def test_build_exports_a_snapshot_matching_staging(tmp_path, events_csv, encoding):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target, encoding=encoding)
+    assert (snapshot_path(target) / MANIFEST).exists()
+
+    snapshot = load_snapshot(target)
+
+    assert snapshot['organization_id'].dtype == 'category'
+    assert snapshot['timestamp'].dtype == 'datetime64[ns]'
+    # Every column, categorical codes included, is still backed by the mapped files
+    assert all(_is_mapped(_stored(snapshot[column])) for column in snapshot)
+    categorical = {column: object for column in snapshot.select_dtypes('category')}
+    pd.testing.assert_frame_equal(snapshot.astype(categorical), _staging(target).astype(categorical).fillna(np.nan))
+
+
+def test_projection_and_organization_slices(built_engine):
+    db_path = built_engine.url.database
+    staging = _staging(db_path)
+
+    org_a = load_snapshot(db_path, columns=['id', 'timestamp'], organizations=['org-a'])
+    assert list(org_a.columns) == ['id', 'timestamp']
+    assert org_a['id'].tolist() == staging.loc[staging['organization_id'] == 'org-a', 'id'].tolist()
+    assert _is_mapped(org_a['id'].to_numpy())
+
+    both = load_snapshot(db_path, organizations=['org-c', 'org-a', 'org-x'])
+    assert both['organization_id'].tolist() == ['org-a'] * 9 + ['org-c'] * 3
+
+    with pytest.raises(ValueError):
+        load_snapshot(db_path, columns=['nope'])
+
+
+def test_snapshot_rebuilds_when_the_database_changes(tmp_path, events_frame, events_csv):
+    history_csv = tmp_path / 'history.csv'
+    events_frame[events_frame['TIMESTAMP'] < '2024-01-04'].to_csv(history_csv, index=False)
+    target = tmp_path / 'trial_data.db'
+    build_database(history_csv, target)
+    manifest = snapshot_path(target) / MANIFEST
+    built = manifest.stat().st_mtime_ns
+
+    assert len(load_snapshot(target)) == 8
+    assert manifest.stat().st_mtime_ns == built
+
+    refresh(create_engine(f'sqlite:///{target}'), events_csv)
+    assert len(load_snapshot(target)) == 17
+    assert list(tmp_path.glob('trial_data.snapshot.*')) == []
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_snapshot_rebuilds_after_a_stage_only_rebuild(tmp_path, events_frame, events_csv, workers):
+    history_csv = tmp_path / 'history.csv'
+    events_frame[events_frame['TIMESTAMP'] < '2024-01-04'].to_csv(history_csv, index=False)
+    target = tmp_path / 'trial_data.db'
+    build_database(history_csv, target)
+    assert len(load_snapshot(target)) == 8
+
+    # No watermark or snapshot stage: staging changes all the same
+    build_database(events_csv, target, stages=('ingest', 'staging', 'org_summary', 'trial_goals',
+                                               'trial_activation', 'activated_at'), workers=workers)
+    assert len(load_snapshot(target)) == 17
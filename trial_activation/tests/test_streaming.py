@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.db import build_database
+from trial_activation.src.incremental import loaded_offset, refresh
+from trial_activation.src.streaming import (ActivationTracker, Activation, Event, OrgState, main, queue_events,
+                                            tail_csv)
+from trial_activation.src.verify import verify
+
+
+def _marts(engine):
+    with engine.connect() as conn:
+        return {table: conn.execute(text(f'SELECT * FROM {table} ORDER BY organization_id')).fetchall()
+                for table in ('org_summary', 'trial_goals', 'trial_activation')}
+
+
+def _events(frame):
+    return [Event.from_row(*row) for row in frame.itertuples(index=False)]
+
+
+@pytest.mark.parametrize('max_organizations', [1, 1000])
+def test_streamed_events_give_the_batch_marts(tmp_path, events_frame, built_engine, max_organizations):
+    engine = create_engine(f'sqlite:///{tmp_path / "stream.db"}')
+    tracker = ActivationTracker(engine, checkpoint_events=4, max_organizations=max_organizations)
+
+    activations = [activation for event in _events(events_frame)
+                   for activation in tracker.process_batch([event])]
+    tracker.close()
+
+    assert activations == [Activation('org-a', '2024-01-05 11:00:00.000000')]
+    assert _marts(engine) == _marts(built_engine)
+
+
+def test_tracker_continues_a_build_from_a_file_tail(tmp_path, events_frame, events_csv):
+    history = events_frame[events_frame['TIMESTAMP'] < '2024-01-04']
+    history_csv = tmp_path / 'history.csv'
+    history.to_csv(history_csv, index=False)
+    target = tmp_path / 'trial_data.db'
+    build_database(history_csv, target)
+    live_csv = tmp_path / 'live.csv'
+    events_frame[events_frame['TIMESTAMP'] >= '2024-01-04'].to_csv(live_csv, index=False)
+
+    engine = create_engine(f'sqlite:///{target}')
+    tracker = ActivationTracker(engine)
+    activations = []
+    asyncio.run(tracker.run(tail_csv(live_csv, follow=False, batch_size=2), activations.append))
+    tracker.close()
+
+    full = tmp_path / 'full.db'
+    build_database(events_csv, full)
+    assert [activation.organization_id for activation in activations] == ['org-a']
+    assert _marts(engine) == _marts(create_engine(f'sqlite:///{full}'))
+    with engine.connect() as conn:
+        report = verify(conn)
+    assert report.ok, str(report)
+
+
+def test_queue_source_and_async_callback(tmp_path, events_frame):
+    tracker = ActivationTracker(create_engine(f'sqlite:///{tmp_path / "stream.db"}'))
+    seen = []
+
+    async def on_activation(activation):
+        seen.append(activation.organization_id)
+
+    async def feed():
+        queue = asyncio.Queue()
+        for event in _events(events_frame):
+            await queue.put(event)
+        await queue.put(None)
+        await tracker.run(queue_events(queue), on_activation)
+
+    asyncio.run(feed())
+    tracker.close()
+    assert seen == ['org-a'] and tracker.events == len(events_frame)
+
+
+def test_org_state_is_slotted():
+    state = OrgState()
+    with pytest.raises(AttributeError):
+        state.history = []
+    assert len(state.counts) == 5
+
+
+def test_tailing_the_builds_own_export_loads_only_appended_events(tmp_path, events_frame, capsys):
+    export_csv = tmp_path / 'export.csv'
+    events_frame[events_frame['TIMESTAMP'] < '2024-01-04'].to_csv(export_csv, index=False)
+    target = tmp_path / 'trial_data.db'
+    build_database(export_csv, target)
+    events_frame[events_frame['TIMESTAMP'] >= '2024-01-04'].to_csv(export_csv, mode='a', header=False, index=False)
+
+    main([str(export_csv), '--target', str(target), '--no-follow'])
+
+    assert capsys.readouterr().out.splitlines() == ['ACTIVATED org-a at 2024-01-05 11:00:00.000000']
+    engine = create_engine(f'sqlite:///{target}')
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT COUNT(*) FROM behavioral_events')).scalar() == len(events_frame)
+        assert loaded_offset(conn, export_csv) == export_csv.stat().st_size
+
+    # A refresh, or a second tail, of the same export finds nothing new
+    assert refresh(engine, export_csv)['new_rows'] == 0
+    main([str(export_csv), '--target', str(target), '--no-follow'])
+    assert capsys.readouterr().out == ''
+    full = tmp_path / 'full.db'
+    build_database(export_csv, full)
+    assert _marts(engine) == _marts(create_engine(f'sqlite:///{full}'))
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from trial_activation.src.db import build_database
+from trial_activation.src.encoding import COMPACT, TEXT
+from trial_activation.src.verify import REQUIRED_TABLES, verify, verify_build
+
+
+@pytest.mark.parametrize('encoding', [TEXT, COMPACT])
+def test_clean_build_passes(tmp_path, events_csv, encoding):
+    target = tmp_path / 'trial_data.db'
+    build_database(events_csv, target, encoding=encoding, stages=('ingest', 'staging', 'org_summary', 'trial_goals'))
+    with create_engine(f'sqlite:///{target}').connect() as conn:
+        report = verify(conn)
+
+    assert report.ok, str(report)
+    staging = report.tables['staging_behavioral_events']
+    assert (staging.rows, staging.organizations) == (17, 3)
+    assert (staging.first_timestamp, staging.last_timestamp) == ('2024-01-01 09:00:00.000000',
+                                                                 '2024-01-11 08:00:00.000000')
+    assert staging.goals_fingerprint == report.tables['trial_goals'].goals_fingerprint
+
+
+@pytest.mark.parametrize('corruption, problem', [
+    ("DELETE FROM staging_behavioral_events WHERE rowid = 3", 'rows differ'),
+    ("UPDATE staging_behavioral_events SET timestamp = '2024-01-03 13:00:00.000000' WHERE rowid = 10",
+     'per-organization events differ'),
+    ("UPDATE trial_goals SET goal_punched_in = 1 - goal_punched_in WHERE organization_id = 'org-c'",
+     'trial_goals flags do not match'),
+    ("UPDATE trial_goals SET goal_punched_in = 2 WHERE organization_id = 'org-a'", 'not 0 or 1'),
+    ("UPDATE behavioral_events SET activity_detail = 'revenue;dashboard' WHERE rowid = 1", 'non-atomic'),
+    ("UPDATE behavioral_events SET timestamp = NULL WHERE rowid = 5", 'NULL timestamp'),
+])
+def test_corruption_is_reported(built_engine, corruption, problem):
+    with built_engine.begin() as conn:
+        conn.execute(text(corruption))
+        report = verify(conn)
+        assert not report.ok
+        assert any(problem in line for line in report.problems), report.problems
+        with pytest.raises(RuntimeError, match=problem):
+            verify_build(conn)
+
+
+def test_verify_stage_fails_without_the_build_tables(tmp_path):
+    with pytest.raises(RuntimeError, match='behavioral_events is missing'):
+        build_database(tmp_path / 'events.csv', tmp_path / 'empty.db', stages=('verify',))
+
+    with create_engine(f'sqlite:///{tmp_path / "empty.db"}').connect() as conn:
+        assert verify(conn).ok
+        assert verify(conn, REQUIRED_TABLES).problems == [f'{table} is missing' for table in REQUIRED_TABLES]